@@ -0,0 +1,265 @@
+# async_lemmy_client.py
+
+import asyncio
+import random
+import time
+
+import aiohttp
+import config
+from ratelimit import get_rate_limiter
+from metrics import LEMMY_API_LATENCY
+from mapping_store import get_store
+from capture import CAPTURE_FILE, LEMMY, record_response
+from lemmy_client import (
+    LemmyClient,
+    RETRY_STATUS_CODES,
+    COMMENT_PAGE_SIZE,
+    COMMENT_SORT,
+    COMMENT_MAX_DEPTH,
+    TOKEN_CACHE_ENABLED,
+    comment_list_params,
+    comment_page,
+    jwt_expiry,
+    token_is_fresh
+)
+
+class AsyncLemmyClient:
+    """
+    asyncio counterpart of LemmyClient. It keeps one aiohttp session (and connection
+    pool) open for its whole lifetime, so many coroutines can share a few sockets.
+    Use it as an async context manager or call close() when done.
+    """
+
+    def __init__(self, base_url=None, username=None, password=None):
+        self.base_url = base_url or config.LEMMY_BASE_URL
+        self.username = username or config.LEMMY_USERNAME
+        self.password = password or config.LEMMY_PASSWORD
+        self.jwt_token = None
+        self.jwt_expires_at = None
+        self._login_lock = asyncio.Lock()
+
+        self.pool_size = getattr(config, "LEMMY_POOL_SIZE", 10)
+        connect_timeout, read_timeout = getattr(config, "LEMMY_TIMEOUT", (5, 30))
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.max_retries = getattr(config, "LEMMY_MAX_RETRIES", 3)
+        self.backoff_base = getattr(config, "LEMMY_BACKOFF_BASE", 0.5)
+        self.backoff_max = getattr(config, "LEMMY_BACKOFF_MAX", 30.0)
+
+        self.session = None
+        self.last_latency = None
+        self.on_request = None
+        self.rate_limiter = get_rate_limiter()
+
+    async def __aenter__(self):
+        self._ensure_session()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _ensure_session(self):
+        # The session must be created inside a running event loop.
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _auth_headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.jwt_token}"}
+
+    def _backoff_delay(self, attempt: int, retry_after: str = None) -> float:
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_max)
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+    async def _request(self, method: str, path: str, auth: bool = False, **kwargs):
+        """
+        Like LemmyClient._request: attaches the JWT if `auth` is set, logging in
+        first if needed and once more (then replaying) if Lemmy answers 401.
+        """
+        if not auth:
+            return await self._send(method, path, **kwargs)
+        await self.ensure_login()
+        token = self.jwt_token
+        status, body = await self._send(method, path, headers=self._auth_headers(), **kwargs)
+        if status == 401:
+            print("AsyncLemmyClient: JWT rejected (401); logging in again.")
+            await self._relogin(token)
+            status, body = await self._send(method, path, headers=self._auth_headers(), **kwargs)
+        return status, body
+
+    async def _send(self, method: str, path: str, **kwargs):
+        """
+        Sends a request and returns (status_code, json_body or None), retrying on
+        connection errors, 429 and 5xx with jittered exponential backoff.
+        """
+        self._ensure_session()
+        url = f"{self.base_url}{path}"
+        kind = LemmyClient._rate_limit_kind(method, path)
+        endpoint = f"{method} {path}"
+        attempt = 0
+        while True:
+            attempt += 1
+            await self.rate_limiter.acquire_async("lemmy", kind, endpoint=endpoint)
+            start = time.monotonic()
+            try:
+                async with self.session.request(method, url, **kwargs) as response:
+                    status = response.status
+                    retry_after = response.headers.get("Retry-After")
+                    self.rate_limiter.observe("lemmy", kind, status, response.headers, endpoint)
+                    body = await response.json(content_type=None) if status < 400 else await response.text()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                self._record_latency(method, path, None, time.monotonic() - start)
+                if attempt > self.max_retries:
+                    raise
+                await asyncio.sleep(self._backoff_delay(attempt))
+                continue
+
+            latency = time.monotonic() - start
+            self._record_latency(method, path, status, latency)
+            if CAPTURE_FILE:
+                record_response(LEMMY, method, path, status, latency, params=kwargs.get("params"), payload=body)
+            if status in RETRY_STATUS_CODES and attempt <= self.max_retries:
+                # On 429 the limiter has already paused the bucket for Retry-After.
+                if status != 429:
+                    await asyncio.sleep(self._backoff_delay(attempt, retry_after))
+                continue
+            return status, body
+
+    def _record_latency(self, method, path, status_code, latency):
+        self.last_latency = latency
+        LEMMY_API_LATENCY.observe(latency, method=method, endpoint=path, status=status_code or "error")
+        if self.on_request is not None:
+            self.on_request(method, path, status_code, latency)
+
+    @staticmethod
+    def _raise_for_status(status, body, what):
+        if status >= 400:
+            raise RuntimeError(f"{what} failed with HTTP {status}: {body}")
+
+    async def _load_cached_token(self) -> bool:
+        # The token cache is SQLite: every access runs in a worker thread.
+        if not TOKEN_CACHE_ENABLED:
+            return False
+        cached = await asyncio.to_thread(lambda: get_store().get_auth_token(self.base_url, self.username))
+        if cached is None or not token_is_fresh(cached[1]):
+            return False
+        self.jwt_token, self.jwt_expires_at = cached
+        return True
+
+    async def ensure_login(self):
+        """
+        Reuses the in-memory or cached JWT while it is fresh; logs in otherwise.
+        """
+        async with self._login_lock:
+            if self.jwt_token and token_is_fresh(self.jwt_expires_at):
+                return
+            if await self._load_cached_token():
+                print("AsyncLemmyClient: Reusing cached Lemmy login.")
+                return
+            await self.login()
+
+    async def _relogin(self, stale_token):
+        async with self._login_lock:
+            if self.jwt_token != stale_token:
+                return
+            if TOKEN_CACHE_ENABLED:
+                await asyncio.to_thread(lambda: get_store().delete_auth_token(self.base_url, self.username))
+            await self.login()
+
+    async def login(self):
+        """
+        Logs into Lemmy with the username/password from config and stores the JWT token
+        (in memory and, unless LEMMY_TOKEN_CACHE is off, in the mapping DB).
+        """
+        payload = {
+            "username_or_email": self.username,
+            "password": self.password
+        }
+        try:
+            status, body = await self._request("POST", "/api/v3/user/login", json=payload)
+            self._raise_for_status(status, body, "Login")
+            self.jwt_token = body["jwt"]
+            self.jwt_expires_at = jwt_expiry(self.jwt_token)
+        except Exception as e:
+            raise RuntimeError(f"Failed to login to Lemmy: {e}")
+        if TOKEN_CACHE_ENABLED:
+            jwt_token, jwt_expires_at = self.jwt_token, self.jwt_expires_at
+            await asyncio.to_thread(
+                lambda: get_store().set_auth_token(self.base_url, self.username, jwt_token, jwt_expires_at)
+            )
+
+    async def create_post(self, community_id: int, title: str, body: str = "") -> dict:
+        """
+        Creates a new post in the given community. Returns the JSON response from Lemmy.
+        """
+        payload = {
+            "community_id": community_id,
+            "name": title,
+            "body": body
+        }
+        status, response_body = await self._request("POST", "/api/v3/post", json=payload, auth=True)
+        self._raise_for_status(status, response_body, "Create post")
+        return response_body
+
+    async def create_comment(self, post_id: int, content: str, parent_id: int = None) -> dict:
+        """
+        Creates a comment on a Lemmy post. Returns the JSON response from Lemmy.
+        """
+        payload = {
+            "post_id": post_id,
+            "content": content,
+        }
+        if parent_id is not None:
+            payload["parent_id"] = parent_id
+        status, body = await self._request("POST", "/api/v3/comment", json=payload, auth=True)
+        self._raise_for_status(status, body, "Create comment")
+        return body
+
+    async def get_comments(self, post_id: int) -> list:
+        """
+        Retrieves comments for a given Lemmy post, or an empty list if the post isn't found.
+        """
+        params = {"post_id": post_id}
+        status, body = await self._request("GET", "/api/v3/post/comments", params=params, auth=True)
+        if status == 404:
+            print(f"Warning: Post {post_id} not found on Lemmy (404 returned).")
+            return []
+        self._raise_for_status(status, body, "Get comments")
+        return body.get("comments", [])
+
+    async def iter_comment_pages(self, post_id: int = None, sort: str = COMMENT_SORT,
+                                 limit: int = COMMENT_PAGE_SIZE, max_depth: int = COMMENT_MAX_DEPTH,
+                                 stop_at_id: int = None, community_id: int = None):
+        """
+        Async generator counterpart of LemmyClient.iter_comment_pages: pages through
+        /api/v3/comment/list and stops early once `stop_at_id` (or lower) is reached.
+        """
+        page = 1
+        while True:
+            params = comment_list_params(page, post_id, community_id, sort, limit, max_depth)
+            status, body = await self._request("GET", "/api/v3/comment/list", params=params, auth=True)
+            if status == 404:
+                print(f"Warning: Post {post_id} / community {community_id} not found on Lemmy (404 returned).")
+                return
+            self._raise_for_status(status, body, "List comments")
+            comments, last = comment_page(body.get("comments", []), stop_at_id, limit)
+            if comments:
+                yield comments
+            if last:
+                return
+            page += 1
+
+    async def iter_comments(self, post_id: int = None, sort: str = COMMENT_SORT, limit: int = COMMENT_PAGE_SIZE,
+                            max_depth: int = COMMENT_MAX_DEPTH, stop_at_id: int = None, community_id: int = None):
+        """
+        Yields the comments of iter_comment_pages() one at a time.
+        """
+        async for page in self.iter_comment_pages(post_id, sort, limit, max_depth, stop_at_id, community_id):
+            for comment in page:
+                yield comment
@@ -0,0 +1,242 @@
+# async_sync.py
+#
+# asyncio driver for the bidirectional comment sync. Mappings are processed
+# concurrently (bounded by SYNC_CONCURRENCY), so a cycle takes about as long as the
+# slowest thread instead of the sum of all threads. PRAW is synchronous, so Reddit
+# work runs in worker threads behind its own, smaller semaphore (REDDIT_CONCURRENCY)
+# to stay inside the Reddit API budget. SQLite calls (store, synced index, poll
+# scheduler) also run in worker threads, so a lock wait never stalls the loop.
+
+import asyncio
+import time
+
+import config
+from reddit_client import get_reddit_client
+from async_lemmy_client import AsyncLemmyClient
+from mapping_store import get_store
+from synced_index import get_synced_index
+from comment_tree import walk_comment_tree
+from metrics import COMMENTS_SYNCED, SYNC_CYCLE, record_error, start_metrics_server
+from poll_scheduler import PollScheduler, POLL_SCHEDULER_ENABLED
+from sync_cursors import (
+    REDDIT_TO_LEMMY,
+    LEMMY_TO_REDDIT,
+    CursorAdvance,
+    mark_stalled,
+    mapping_scope,
+    reddit_comments_after,
+    lemmy_cursor,
+    lemmy_comments_after
+)
+from bidirectional_sync import (
+    is_own_reddit_comment,
+    format_reddit_comment_for_lemmy,
+    extract_lemmy_comment_id,
+    extract_lemmy_comment_data
+)
+
+SYNC_CONCURRENCY = getattr(config, "SYNC_CONCURRENCY", 20)
+REDDIT_CONCURRENCY = getattr(config, "REDDIT_CONCURRENCY", 2)
+SYNC_INTERVAL = getattr(config, "SYNC_INTERVAL", 60)
+
+async def _reddit_call(reddit_sem, func, *args):
+    """
+    Runs a blocking PRAW call in a worker thread, holding the Reddit semaphore.
+    """
+    async with reddit_sem:
+        return await asyncio.to_thread(func, *args)
+
+def _fetch_submission(reddit, reddit_submission_id):
+    return reddit.submission(id=reddit_submission_id)
+
+async def _reddit_batches(reddit, reddit_sem, submission, scope):
+    # One worker-thread call per batch of walk_comment_tree(), so only the batch
+    # being synced is in memory, as in the threaded sync.
+    walk = walk_comment_tree(reddit, submission, scope)
+    while True:
+        batch = await _reddit_call(reddit_sem, next, walk, None)
+        if batch is None:
+            return
+        yield batch
+
+async def sync_reddit_thread_to_lemmy(reddit, lemmy, submission, all_comments, lemmy_post_id, scope, cursor):
+    """
+    Syncs new comments of one Reddit submission (past its cursor) to its Lemmy post.
+    """
+    index = await asyncio.to_thread(get_synced_index)
+    print(f"Processing Reddit submission {submission.id}: Found {len(all_comments)} comments.")
+    pending = reddit_comments_after(all_comments, cursor)
+    unsynced = await asyncio.to_thread(index.unsynced_reddit_ids, [comment.id for comment in pending])
+    advance = CursorAdvance(cursor)
+    new_pairs = []
+    try:
+        for comment in pending:
+            position = (comment.created_utc, comment.id)
+            if comment.id not in unsynced or is_own_reddit_comment(reddit, comment):
+                advance.done(position)
+                continue
+            try:
+                content = format_reddit_comment_for_lemmy(comment)
+                lemmy_response = await lemmy.create_comment(post_id=lemmy_post_id, content=content, parent_id=None)
+                lemmy_comment_id = extract_lemmy_comment_id(lemmy_response)
+                if lemmy_comment_id:
+                    new_pairs.append((comment.id, lemmy_comment_id))
+                    advance.done(position)
+                    COMMENTS_SYNCED.inc(direction=REDDIT_TO_LEMMY)
+                    print(f"Synced Reddit comment {comment.id} to Lemmy comment {lemmy_comment_id}")
+                else:
+                    advance.failed(position, REDDIT_TO_LEMMY, comment.id)
+                    print(f"Failed to extract Lemmy comment ID for Reddit comment {comment.id}. Response: {lemmy_response}")
+            except Exception as e:
+                advance.failed(position, REDDIT_TO_LEMMY, comment.id)
+                record_error(REDDIT_TO_LEMMY)
+                print(f"Error syncing Reddit comment {comment.id}: {e}")
+    finally:
+        moved = scope is not None and advance.moved
+        await asyncio.to_thread(index.record, new_pairs, (scope, REDDIT_TO_LEMMY, advance.position) if moved else None)
+        if scope is not None and advance.blocked:
+            mark_stalled(scope)
+
+async def _lemmy_pages(lemmy, lemmy_post_id, cursor):
+    # Newest first down to the cursor, as one page; a first sync walks the post
+    # oldest first, one API page at a time, so it is never held in memory at once.
+    if cursor is not None:
+        comments = [
+            comment async for comment in lemmy.iter_comments(lemmy_post_id, sort="New", stop_at_id=cursor[1])
+        ]
+        if comments:
+            yield comments
+        return
+    async for comments in lemmy.iter_comment_pages(lemmy_post_id, sort="Old"):
+        yield comments
+
+async def sync_lemmy_thread_to_reddit(lemmy, reddit_sem, submission, lemmy_post_id, scope, cursor):
+    """
+    Syncs new comments of one Lemmy post (above its cursor) back to its Reddit submission.
+    """
+    cursor = lemmy_cursor(cursor)
+    try:
+        async for lemmy_comments in _lemmy_pages(lemmy, lemmy_post_id, cursor):
+            print(f"Processing Lemmy post {lemmy_post_id}: Found {len(lemmy_comments)} new comments.")
+            advance = await _sync_lemmy_comments(reddit_sem, submission, lemmy_comments, scope, cursor)
+            if advance.blocked:
+                # The cursor stays before the failed comment; later pages are
+                # still synced, deduplicated by the synced index.
+                scope = None
+            else:
+                cursor = advance.position
+    except Exception as e:
+        record_error("lemmy_fetch")
+        print(f"Error fetching comments from Lemmy for post {lemmy_post_id}: {e}")
+
+async def _sync_lemmy_comments(reddit_sem, submission, lemmy_comments, scope, cursor):
+    index = await asyncio.to_thread(get_synced_index)
+    pending = lemmy_comments_after([extract_lemmy_comment_data(comment) for comment in lemmy_comments], cursor)
+    unsynced = await asyncio.to_thread(index.unsynced_lemmy_ids, [data["id"] for data in pending])
+    advance = CursorAdvance(cursor)
+    new_pairs = []
+    try:
+        for comment_data in pending:
+            lemmy_comment_id = comment_data["id"]
+            if lemmy_comment_id not in unsynced:
+                advance.done((None, lemmy_comment_id))
+                continue
+            try:
+                reddit_comment = await _reddit_call(reddit_sem, submission.reply, comment_data.get("content", ""))
+                new_pairs.append((reddit_comment.id, lemmy_comment_id))
+                advance.done((None, lemmy_comment_id))
+                COMMENTS_SYNCED.inc(direction=LEMMY_TO_REDDIT)
+                print(f"Synced Lemmy comment {lemmy_comment_id} to Reddit comment {reddit_comment.id}")
+            except Exception as e:
+                advance.failed((None, lemmy_comment_id), LEMMY_TO_REDDIT, lemmy_comment_id)
+                record_error(LEMMY_TO_REDDIT)
+                print(f"Error syncing Lemmy comment {lemmy_comment_id}: {e}")
+    finally:
+        moved = scope is not None and advance.moved
+        await asyncio.to_thread(index.record, new_pairs, (scope, LEMMY_TO_REDDIT, advance.position) if moved else None)
+        if scope is not None and advance.blocked:
+            mark_stalled(scope)
+    return advance
+
+async def sync_mapping(reddit, lemmy, reddit_sem, mapping, cursors):
+    """
+    Runs both sync directions for a single mapping record. `cursors` maps each
+    direction to its {scope: position} dict for this cycle.
+    """
+    scope = mapping_scope(mapping[0])
+    reddit_submission_id = mapping[1]
+    lemmy_post_id = mapping[3]
+    try:
+        submission = await _reddit_call(reddit_sem, _fetch_submission, reddit, reddit_submission_id)
+        async for comments, branch in _reddit_batches(reddit, reddit_sem, submission, scope):
+            if branch is None:
+                await sync_reddit_thread_to_lemmy(
+                    reddit, lemmy, submission, comments, lemmy_post_id, scope, cursors[REDDIT_TO_LEMMY].get(scope)
+                )
+            else:
+                # "Load more" branch: not filtered by (and not moving) the cursor.
+                await sync_reddit_thread_to_lemmy(reddit, lemmy, submission, comments, lemmy_post_id, None, None)
+    except Exception as e:
+        record_error("reddit_fetch")
+        print(f"Error fetching Reddit submission {reddit_submission_id}: {e}")
+        return
+    await sync_lemmy_thread_to_reddit(
+        lemmy, reddit_sem, submission, lemmy_post_id, scope, cursors[LEMMY_TO_REDDIT].get(scope)
+    )
+
+def _load_cycle(mappings):
+    # Returns the cycle's mappings and {direction: {scope: position}}.
+    store = get_store()
+    if mappings is None:
+        mappings = store.get_all_mappings(include_held=False)
+    scopes = [mapping_scope(mapping[0]) for mapping in mappings]
+    return mappings, {
+        REDDIT_TO_LEMMY: store.get_cursors(REDDIT_TO_LEMMY, scopes),
+        LEMMY_TO_REDDIT: store.get_cursors(LEMMY_TO_REDDIT, scopes),
+    }
+
+async def run_sync_cycle(reddit, lemmy, concurrency=SYNC_CONCURRENCY, reddit_concurrency=REDDIT_CONCURRENCY,
+                         mappings=None):
+    """
+    Syncs every mapping (or only `mappings`) once, with at most `concurrency`
+    mappings in flight.
+    """
+    mappings, cursors = await asyncio.to_thread(_load_cycle, mappings)
+    if not mappings:
+        print("No post mappings found. Skipping sync.")
+        return
+
+    mapping_sem = asyncio.Semaphore(concurrency)
+    reddit_sem = asyncio.Semaphore(reddit_concurrency)
+
+    async def bounded(mapping):
+        async with mapping_sem:
+            await sync_mapping(reddit, lemmy, reddit_sem, mapping, cursors)
+
+    await asyncio.gather(*(bounded(mapping) for mapping in mappings))
+
+async def main():
+    reddit = get_reddit_client()
+    start_metrics_server()
+    async with AsyncLemmyClient() as lemmy:
+        await lemmy.ensure_login()
+        scheduler = await asyncio.to_thread(PollScheduler) if POLL_SCHEDULER_ENABLED else None
+        while True:
+            print("Starting async bidirectional comment sync...")
+            start = time.monotonic()
+            if scheduler is None:
+                await run_sync_cycle(reddit, lemmy)
+            else:
+                due = await asyncio.to_thread(scheduler.due)
+                before = await asyncio.to_thread(scheduler.cursor_positions, due)
+                try:
+                    await run_sync_cycle(reddit, lemmy, mappings=due)
+                finally:
+                    await asyncio.to_thread(scheduler.complete, due, before)
+            SYNC_CYCLE.observe(time.monotonic() - start)
+            print(f"Async sync complete in {time.monotonic() - start:.1f}s. "
+                  f"Waiting {SYNC_INTERVAL} seconds before next check...")
+            await asyncio.sleep(SYNC_INTERVAL)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,434 @@
+# backfill.py
+#
+# Bulk import of existing Reddit threads. Instead of triggering threads one by
+# one and waiting for the sync loop to copy their comments, this bridges a list
+# of submissions in one run: each gets a Lemmy post (an already bridged thread
+# keeps its post) and its existing comment tree is copied oldest first. Run it
+# from the lemmylink_bot directory, alongside or instead of the bot:
+#
+#   python backfill.py abc123 https://www.reddit.com/r/fediverse/comments/def456/
+#   python backfill.py --file submissions.txt
+#   python backfill.py --listing top --time-filter year --limit 500
+#   python backfill.py --query "flair:Guide" --subreddit fediverse
+#
+# Threads are bridged by --workers threads in parallel, at BACKGROUND priority of
+# the shared rate limiter, so the Reddit and Lemmy budgets hold and a live bot in
+# the same process keeps precedence. Posts go to the community of the
+# submission's route (see routing.py); submissions from other subreddits are
+# skipped.
+#
+# A new post's mapping is stored right away, under the submission's single-flight
+# lock (see bridged_posts.py), before any comment is copied: a live trigger for
+# the same thread then reuses the post, and a post that lost the race to another
+# process is deleted again. The mapping is stored held (see mapping_store.py):
+# the bot's sync leaves the thread alone until the flush that records its
+# copied comments releases it, so it never copies them a second time. A thread
+# that was already bridged is only put back on the poll schedule; its comments
+# are the sync loop's. Comment trees are walked with walk_comment_tree(),
+# expanding at most --more-budget "load more" branches per thread; the others
+# are stored and expanded by the sync loop on later cycles.
+#
+# The comment mappings and the progress checkpoint are written together in
+# large batched transactions (every --batch-size rows or --flush-interval
+# seconds). The checkpoint -- a backfill_checkpoint row per --job -- records the
+# highest Reddit ID up to which every thread is done; submissions are handled in
+# Reddit ID order, so an interrupted run picks up there when started again with
+# the same arguments. Ctrl-C finishes the threads in progress and flushes before
+# exiting. After a hard crash the unflushed threads stay held until the job is
+# resumed, which recovers their copied comments from the bot's Lemmy copies
+# instead of copying them again.
+
+import argparse
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import config
+from reddit_client import get_reddit_client
+from mapping_store import get_store
+from synced_index import get_synced_index
+from bridged_posts import get_bridged_posts, lemmy_post_url
+from routing import RoutingTable
+from comment_tree import walk_comment_tree
+from bidirectional_sync import format_reddit_comment_for_lemmy, extract_lemmy_comment_id, is_own_reddit_comment
+from sync_snapshot import bridged_reddit_id
+from outbox import bridge_reply_text
+from sync_cursors import REDDIT_TO_LEMMY, CursorAdvance, mapping_scope, reddit_comments_after
+from ratelimit import get_rate_limiter, BACKGROUND
+from reddit_ids import reddit_id_to_int
+from metrics import COMMENTS_SYNCED, POSTS_CREATED, record_error
+
+BACKFILL_WORKERS = getattr(config, "BACKFILL_WORKERS", 4)
+BACKFILL_BATCH_SIZE = getattr(config, "BACKFILL_BATCH_SIZE", 1000)
+BACKFILL_FLUSH_INTERVAL = getattr(config, "BACKFILL_FLUSH_INTERVAL", 10)
+# "Load more" branches expanded per thread in one run (one Reddit request each).
+BACKFILL_MORE_COMMENTS_BUDGET = getattr(config, "BACKFILL_MORE_COMMENTS_BUDGET", 32)
+
+def parse_submission_id(value):
+    """
+    Returns the submission ID in an ID, fullname ("t3_...") or Reddit/redd.it URL.
+    """
+    value = value.strip().rstrip("/")
+    if "/comments/" in value:
+        value = value.split("/comments/", 1)[1].split("/", 1)[0]
+    elif "redd.it/" in value:
+        value = value.rsplit("/", 1)[-1]
+    if value.startswith("t3_"):
+        value = value[3:]
+    return value.lower()
+
+def backfill_post_body(submission):
+    """
+    Builds the Lemmy post body for a backfilled submission.
+    """
+    body = f"**Original Reddit Post:** [{submission.title}]({submission.url or submission.shortlink})"
+    if submission.selftext:
+        quoted = "\n".join(f"> {line}" for line in submission.selftext.splitlines())
+        body += f"\n\n{quoted}"
+    return body + f"\n\nBridged from r/{submission.subreddit.display_name} by LemmyLink."
+
+class ThreadResult:
+    """
+    Outcome of bridging one submission, written at the next flush.
+    """
+
+    def __init__(self, submission_id):
+        self.submission_id = submission_id
+        self.mapping_id = None
+        self.post = None  # BridgedPost, once the thread has a Lemmy post
+        self.created = False  # the post was created by this run
+        self.held = False  # the mapping is held for this run's comments (see flush)
+        self.pairs = []  # (reddit_comment_id, lemmy_comment_id) of copied comments
+        self.recovered = 0  # pairs recovered from an earlier, crashed run
+        self.cursor = None  # Reddit-to-Lemmy cursor position up to the first failed comment
+        self.ok = False  # everything was copied
+
+class Backfill:
+    """
+    Bridges a set of submissions with bounded parallelism and a resumable checkpoint.
+    """
+
+    def __init__(self, reddit, routing, job="default", restart=False, workers=BACKFILL_WORKERS,
+                 batch_size=BACKFILL_BATCH_SIZE, flush_interval=BACKFILL_FLUSH_INTERVAL,
+                 more_budget=BACKFILL_MORE_COMMENTS_BUDGET, reply=False, store=None, index=None):
+        self.reddit = reddit
+        self.routing = routing
+        self.store = store or get_store()
+        self.index = index or get_synced_index()
+        self.bridged = get_bridged_posts()
+        self.workers = workers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.more_budget = more_budget
+        self.reply = reply
+        self.job = job
+        # (threads done, highest submission ID up to which every thread is done)
+        self.position = None if restart else self.store.get_backfill_checkpoint(job)
+        self._saved = self.position
+        self._results = []
+        self._rows = 0
+        self._last_flush = time.monotonic()
+        self.stats = {"threads": 0, "failed": 0, "posts": 0, "comments": 0}
+
+    def pending(self, submissions):
+        """
+        Returns the submissions past the checkpoint, deduplicated, in Reddit ID order.
+        """
+        after = reddit_id_to_int(self.position[1]) if self.position is not None else -1
+        by_key = {}
+        for submission in submissions:
+            key = reddit_id_to_int(submission.id)
+            if key > after:
+                by_key.setdefault(key, submission)
+        return [by_key[key] for key in sorted(by_key)]
+
+    # --- Workers -------------------------------------------------------------
+
+    def bridge_thread(self, submission):
+        """
+        Creates the submission's Lemmy post and copies its comments; an already
+        bridged submission is only revived for the sync loop. Runs on a worker
+        thread; only a new post's (held) mapping is written here.
+        """
+        result = ThreadResult(submission.id)
+        with get_rate_limiter().priority(BACKGROUND):
+            try:
+                route = self.routing.route_for(submission)
+                if route is None:
+                    print(f"[WARN] Backfill: r/{submission.subreddit.display_name} has no route; "
+                          f"skipping submission {submission.id}.")
+                    result.ok = True
+                    return result
+                with self.bridged.single_flight(submission.id):
+                    post = self.bridged.lookup(submission.id)
+                    if post is None and route.sync_only:
+                        print(f"[WARN] Backfill: {route} has no community; skipping submission {submission.id}.")
+                        result.ok = True
+                        return result
+                    bridged_before = post is not None
+                    if post is None:
+                        post, result.created = self._create_post(submission, route)
+                result.mapping_id = self.store.get_mapping_by_reddit_submission(submission.id)[0][0]
+                # Held: created above, or by a run of this job that crashed
+                # before its flush (a lost race leaves the winner's mapping alone).
+                result.held = result.created or (bridged_before and self.store.is_mapping_held(result.mapping_id))
+                if not result.held:
+                    # Bridged before or by someone else: the sync loop copies its
+                    # comments, so two writers never race on one thread.
+                    self.store.revive_mapping(submission.id)
+                    result.ok = True
+                    return result
+                lemmy = self.routing.lemmy_client_for_instance(post.lemmy_instance)
+                copied = set() if result.created else self._recover_copies(lemmy, post, result)
+                result.post = post
+                self._copy_comments(submission, lemmy, post, result, copied)
+            except Exception as e:
+                record_error("backfill")
+                print(f"[ERROR] Backfill: Failed to bridge submission {submission.id}: {e}")
+        return result
+
+    def _create_post(self, submission, route):
+        """
+        Creates the submission's Lemmy post and stores its mapping. Returns
+        (BridgedPost, created); if another process mapped the submission first,
+        the new post is deleted and that process's post is returned.
+        """
+        lemmy = self.routing.lemmy_client(route)
+        response = lemmy.create_post(
+            community_id=route.community_id, title=submission.title, body=backfill_post_body(submission)
+        )
+        post_id = response.get("post_view", {}).get("post", {}).get("id")
+        if post_id is None:
+            raise RuntimeError(f"Could not find 'id' in Lemmy post response: {response}")
+        POSTS_CREATED.inc()
+        self.store.insert_mapping(submission.id, None, post_id, route.subreddit, lemmy.base_url, held=True)
+        post = self.bridged.lookup(submission.id)
+        if post.lemmy_post_id != post_id:
+            print(f"[WARN] Backfill: Submission {submission.id} was bridged concurrently as Lemmy post "
+                  f"{post.lemmy_post_id}; deleting duplicate post {post_id}.")
+            try:
+                lemmy.delete_post(post_id)
+            except Exception as e:
+                record_error("backfill")
+                print(f"[ERROR] Backfill: Failed to delete duplicate Lemmy post {post_id}: {e}")
+            return post, False
+        print(f"Backfill: Created Lemmy post {post_id} for submission {submission.id}")
+        if self.reply:
+            try:
+                submission.reply(bridge_reply_text(lemmy_post_url(post)))
+            except Exception as e:
+                record_error("backfill")
+                print(f"[ERROR] Backfill: Failed to reply on Reddit to submission {submission.id}: {e}")
+        return post, True
+
+    def _recover_copies(self, lemmy, post, result):
+        """
+        Adds the bot's Lemmy copies in a held post (left by a run that crashed
+        before recording them) to result.pairs. Returns their Reddit comment IDs.
+        """
+        copied = set()
+        for comment in lemmy.iter_comments(post.lemmy_post_id, sort="Old"):
+            reddit_comment_id = bridged_reddit_id(comment, lemmy.username)
+            if reddit_comment_id is not None and reddit_comment_id not in copied:
+                copied.add(reddit_comment_id)
+                result.pairs.append((reddit_comment_id, comment.get("comment_view", comment)["comment"]["id"]))
+        result.recovered = len(result.pairs)
+        if copied:
+            print(f"Backfill: Recovered {len(copied)} copied comments of submission {result.submission_id}.")
+        return copied
+
+    def _copy_comments(self, submission, lemmy, post, result, copied):
+        # Batch by batch: the comments loaded with the submission, then one batch
+        # per expanded "load more" branch. Branch comments can be older than the
+        # cursor, so they don't move it.
+        advance = CursorAdvance(None)
+        failed_branches = []
+        scope = mapping_scope(result.mapping_id)
+        for comments, branch in walk_comment_tree(self.reddit, submission, scope, self.more_budget):
+            if branch is None:
+                self._copy_batch(comments, lemmy, post, result, advance, copied)
+            else:
+                branch_advance = CursorAdvance(None)
+                self._copy_batch(comments, lemmy, post, result, branch_advance, copied)
+                if branch_advance.blocked:
+                    failed_branches.append(branch.key)
+        if failed_branches:
+            # Reset after the walk, which marks them expanded: a resumed run (or
+            # the sync loop) expands them again right away.
+            self.store.reset_comment_branches(scope, failed_branches)
+        result.cursor = advance.position
+        result.ok = not (advance.blocked or failed_branches)
+
+    def _copy_batch(self, comments, lemmy, post, result, advance, copied):
+        comments = reddit_comments_after(comments, None)
+        unsynced = self.index.unsynced_reddit_ids(comment.id for comment in comments)
+        for comment in comments:
+            position = (comment.created_utc, comment.id)
+            if comment.id not in unsynced or comment.id in copied or is_own_reddit_comment(self.reddit, comment):
+                advance.done(position)
+                continue
+            try:
+                lemmy_response = lemmy.create_comment(
+                    post_id=post.lemmy_post_id, content=format_reddit_comment_for_lemmy(comment)
+                )
+                lemmy_comment_id = extract_lemmy_comment_id(lemmy_response)
+            except Exception as e:
+                record_error(REDDIT_TO_LEMMY)
+                print(f"Error syncing Reddit comment {comment.id}: {e}")
+                lemmy_comment_id = None
+            if lemmy_comment_id:
+                result.pairs.append((comment.id, lemmy_comment_id))
+                advance.done(position)
+                COMMENTS_SYNCED.inc(direction=REDDIT_TO_LEMMY)
+            else:
+                advance.failed(position, REDDIT_TO_LEMMY, comment.id)
+
+    # --- Bookkeeping (main thread) -------------------------------------------
+
+    def _finished(self, result):
+        self.stats["threads"] += 1
+        self.stats["failed"] += not result.ok
+        self.stats["posts"] += result.created
+        self.stats["comments"] += len(result.pairs) - result.recovered
+        if result.post is not None:
+            self._results.append(result)
+            self._rows += 1 + len(result.pairs)
+
+    def flush(self, force=False):
+        """
+        Writes the finished threads' comment mappings and cursors and the
+        checkpoint in one transaction, once --batch-size rows are pending or
+        --flush-interval seconds have passed (or if `force`). The same
+        transaction releases the threads' mappings to the sync loop.
+        """
+        if not self._results and self.position == self._saved:
+            return
+        due = self._rows >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval
+        if not force and not due:
+            return
+        results, self._results, self._rows = self._results, [], 0
+        pairs = [pair for result in results for pair in result.pairs]
+        with self.store.transaction() as conn:
+            for result in results:
+                # A held post's comments are all copied up to the cursor, so the
+                # sync loop can start there instead of re-reading the thread.
+                if result.cursor is not None:
+                    self.store._upsert_cursor(
+                        conn, mapping_scope(result.mapping_id), REDDIT_TO_LEMMY, result.cursor
+                    )
+            self.store._insert_comment_pairs(conn, pairs)
+            self.store._release_mappings(conn, [result.mapping_id for result in results])
+            if self.position is not None and self.position != self._saved:
+                self.store._upsert_backfill_checkpoint(conn, self.job, self.position)
+        self.index.add(pairs)
+        self._saved = self.position
+        self._last_flush = time.monotonic()
+        print(f"Backfill: {self.stats['threads']} threads done ({self.stats['failed']} failed), "
+              f"{self.stats['posts']} posts created, {self.stats['comments']} comments copied.")
+
+    def run(self, submissions):
+        """
+        Bridges every submission past the checkpoint. Returns the stats dict.
+        """
+        pending = self.pending(submissions)
+        done_before = self.position[0] if self.position is not None else 0
+        if self.position is not None:
+            print(f"Backfill: resuming job {self.job} after submission {self.position[1]} "
+                  f"({done_before} threads done before).")
+        print(f"Backfill: {len(pending)} threads to bridge with {self.workers} workers.")
+
+        # The checkpoint follows the longest run of finished threads from the start
+        # of `pending` and stops at the first failed one.
+        finished = {}
+        next_number = 0
+        blocked = False
+        todo = deque(enumerate(pending))
+        in_flight = {}
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="backfill")
+        try:
+            while todo or in_flight:
+                # Only a few threads are queued ahead, so an interrupt leaves little to finish.
+                while todo and len(in_flight) < self.workers * 2:
+                    number, submission = todo.popleft()
+                    in_flight[executor.submit(self.bridge_thread, submission)] = number
+                done, _ = wait(in_flight, timeout=self.flush_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    finished[in_flight.pop(future)] = result.ok
+                    self._finished(result)
+                while not blocked and next_number in finished:
+                    if not finished.pop(next_number):
+                        blocked = True
+                        break
+                    self.position = (done_before + next_number + 1, pending[next_number].id)
+                    next_number += 1
+                self.flush()
+        except KeyboardInterrupt:
+            print("Backfill: interrupted; finishing the threads in progress...")
+            for future in in_flight:
+                if not future.cancel():
+                    self._finished(future.result())
+        finally:
+            executor.shutdown(wait=True)
+            self.flush(force=True)
+        return self.stats
+
+def resolve_submissions(reddit, args):
+    """
+    Returns the submissions named on the command line, in a file, or by a
+    subreddit listing or search.
+    """
+    values = list(args.submissions)
+    if args.file:
+        with open(args.file, encoding="utf-8") as file:
+            values.extend(line for line in file if line.strip() and not line.lstrip().startswith("#"))
+    submissions = [reddit.submission(id=parse_submission_id(value)) for value in values]
+    if args.query or args.listing:
+        subreddit = reddit.subreddit(args.subreddit or config.SUBREDDIT_NAME)
+        with get_rate_limiter().priority(BACKGROUND):
+            if args.query:
+                listing = subreddit.search(args.query, sort=args.sort, time_filter=args.time_filter, limit=args.limit)
+            elif args.listing in ("top", "controversial"):
+                listing = getattr(subreddit, args.listing)(time_filter=args.time_filter, limit=args.limit)
+            else:
+                listing = getattr(subreddit, args.listing)(limit=args.limit)
+            submissions.extend(listing)
+    return submissions
+
+def main():
+    parser = argparse.ArgumentParser(description="Bridge existing Reddit threads and their comments to Lemmy.")
+    parser.add_argument("submissions", nargs="*", help="submission IDs, fullnames or URLs")
+    parser.add_argument("--file", help="file with one submission ID or URL per line")
+    parser.add_argument("--listing", choices=("new", "hot", "top", "controversial"),
+                        help="bridge a subreddit listing")
+    parser.add_argument("--query", help="bridge the results of a subreddit search")
+    parser.add_argument("--subreddit", help="subreddit for --listing/--query (default: SUBREDDIT_NAME)")
+    parser.add_argument("--sort", default="new", help="search sort for --query")
+    parser.add_argument("--time-filter", default="all", help="time filter for --query and top/controversial")
+    parser.add_argument("--limit", type=int, default=1000, help="max submissions from --listing/--query")
+    parser.add_argument("--job", default="default", help="checkpoint name; use a new one for an unrelated import")
+    parser.add_argument("--restart", action="store_true", help="ignore the job's checkpoint")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS, help="threads bridged in parallel")
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE, help="rows per database transaction")
+    parser.add_argument("--flush-interval", type=float, default=BACKFILL_FLUSH_INTERVAL,
+                        help="max seconds between database flushes")
+    parser.add_argument("--more-budget", type=int, default=BACKFILL_MORE_COMMENTS_BUDGET,
+                        help="'load more comments' links expanded per thread; the sync loop expands the rest")
+    parser.add_argument("--reply", action="store_true", help="reply on Reddit with the Lemmy link")
+    args = parser.parse_args()
+    if not (args.submissions or args.file or args.listing or args.query):
+        parser.error("name submissions, a --file, a --listing or a --query")
+
+    reddit = get_reddit_client()
+    # Every configured route, whatever shard this process would own.
+    routing = RoutingTable(shard_index=0, shard_count=1)
+    backfill = Backfill(
+        reddit, routing, args.job, args.restart, args.workers, args.batch_size, args.flush_interval,
+        args.more_budget, args.reply
+    )
+    stats = backfill.run(resolve_submissions(reddit, args))
+    print(f"Backfill complete: {stats['threads']} threads ({stats['failed']} failed), "
+          f"{stats['posts']} posts created, {stats['comments']} comments copied.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# benchmark_triggers.py
+#
+# Micro-benchmark for trigger_matcher.py.
+#
+#   python benchmark_triggers.py --record corpus.jsonl --count 5000 --subreddit all
+#       records live comments (body + subreddit) from the Reddit comment stream
+#   python benchmark_triggers.py --corpus corpus.jsonl
+#       measures how many comments/second the matcher scans on that corpus
+#
+# Without --corpus a synthetic corpus is generated, so the benchmark also runs
+# offline. The naive per-phrase substring check is measured alongside for comparison.
+
+import argparse
+import json
+import random
+import time
+
+import config
+from trigger_matcher import TriggerMatcher, TRIGGER_PHRASES, SUBREDDIT_TRIGGERS, TRIGGER_OPT_OUT
+
+WORDS = (
+    "the a lemmy reddit link post comment thread bridge federation instance community moderator "
+    "upvote karma server link! lemmylink fediverse kbin mastodon thanks agreed source edit"
+).split()
+
+def record_corpus(path, count, subreddit_name):
+    """
+    Appends `count` comments from the live comment stream to a JSONL corpus.
+    """
+    from reddit_client import get_reddit_client
+
+    subreddit = get_reddit_client().subreddit(subreddit_name)
+    with open(path, "a", encoding="utf-8") as corpus:
+        for recorded, comment in enumerate(subreddit.stream.comments(skip_existing=True), start=1):
+            corpus.write(json.dumps({"body": comment.body, "subreddit": comment.subreddit.display_name}) + "\n")
+            if recorded >= count:
+                break
+    print(f"Recorded {count} comments from r/{subreddit_name} to {path}")
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as corpus:
+        return [json.loads(line) for line in corpus if line.strip()]
+
+def synthetic_corpus(count, trigger_rate, seed=1):
+    rng = random.Random(seed)
+    phrases = list(TRIGGER_PHRASES) or ["LemmyLink!"]
+    comments = []
+    for _ in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(5, 120))]
+        if rng.random() < trigger_rate:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(phrases).upper())
+        comments.append({"body": " ".join(words), "subreddit": "all"})
+    return comments
+
+def naive_match(phrases, body):
+    folded = body.casefold()
+    return any(phrase in folded for phrase in phrases)
+
+def run(label, func, corpus, repeat):
+    best = None
+    hits = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        hits = sum(1 for comment in corpus if func(comment))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    chars = sum(len(comment["body"]) for comment in corpus)
+    print(f"{label:<10} {len(corpus) / best:>12,.0f} comments/s {chars / best / 1e6:>8.1f} MB/s  {hits} triggers")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the trigger matcher.")
+    parser.add_argument("--corpus", help="JSONL corpus of {'body', 'subreddit'} objects")
+    parser.add_argument("--record", metavar="PATH", help="record live comments to PATH instead of benchmarking")
+    parser.add_argument("--count", type=int, default=20000, help="comments to record or synthesize")
+    parser.add_argument("--subreddit", default=config.SUBREDDIT_NAME, help="subreddit to record from")
+    parser.add_argument("--trigger-rate", type=float, default=0.001, help="trigger share in the synthetic corpus")
+    parser.add_argument("--extra-phrases", type=int, default=0, help="add this many random trigger phrases")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.record:
+        record_corpus(args.record, args.count, args.subreddit)
+        return
+
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.count, args.trigger_rate)
+    rng = random.Random(2)
+    triggers = list(TRIGGER_PHRASES) + [
+        f"{rng.choice(WORDS)}{rng.randint(0, 9999)}!" for _ in range(args.extra_phrases)
+    ]
+    matcher = TriggerMatcher(triggers=triggers)
+    phrases = [phrase.casefold() for phrase in triggers]
+    print(f"{len(corpus)} comments, {len(matcher.entries)} phrases "
+          f"({len(SUBREDDIT_TRIGGERS)} subreddit-specific sets, {len(TRIGGER_OPT_OUT)} opt-outs)")
+    run("matcher", lambda comment: matcher.match_text(comment["body"], comment.get("subreddit")), corpus, args.repeat)
+    run("naive", lambda comment: naive_match(phrases, comment["body"]), corpus, args.repeat)
+
+if __name__ == "__main__":
+    main()
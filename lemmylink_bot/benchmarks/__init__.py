@@ -0,0 +1 @@
+# Offline benchmarks; run them from the lemmylink_bot directory (see bench_sync.py).
@@ -0,0 +1,200 @@
+# benchmarks/bench_sync.py
+#
+# Offline benchmark of the sync path and BridgeManager against a local fake
+# Lemmy server (fake_lemmy.py) and fake PRAW objects (fake_reddit.py). Run from
+# the lemmylink_bot directory:
+#
+#   python -m benchmarks.bench_sync --mappings 10 1000 10000
+#
+# Every size runs in its own subprocess with a throwaway database, so the
+# process-wide singletons (store, synced index) and memory figures start clean.
+# Reported per cycle: wall time, Lemmy HTTP requests, Reddit API calls, SQLite
+# statements and peak Python memory. Cycle 1 syncs every seeded comment;
+# later cycles show the steady state where nothing is new.
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from contextlib import redirect_stdout
+
+from benchmarks.fake_lemmy import FakeLemmy
+from benchmarks.fake_reddit import FakeReddit
+
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def install_config(base_url, args):
+    """
+    Installs a `config` module pointing the bot at the fake server. Must run
+    before any bot module is imported, since they read config at import time.
+    """
+    config = types.ModuleType("config")
+    config.REDDIT_CLIENT_ID = config.REDDIT_CLIENT_SECRET = "bench"
+    config.REDDIT_USERNAME = "lemmylink_bot"
+    config.REDDIT_PASSWORD = "bench"
+    config.REDDIT_USER_AGENT = "lemmylink-bench"
+    config.SUBREDDIT_NAME = "bench"
+    config.LEMMY_BASE_URL = base_url
+    config.LEMMY_USERNAME = "bench"
+    config.LEMMY_PASSWORD = "bench"
+    config.LEMMY_COMMUNITY_ID = 1
+    config.LEMMY_BACKOFF_BASE = 0.01
+    config.RATE_LIMITS = {}  # no pacing against the local fake
+    config.OUTBOX_ENABLED = False
+    config.SYNCED_INDEX_MODE = args.index_mode
+    config.LEMMY_SYNC_MODE = args.lemmy_sync_mode
+    sys.modules["config"] = config
+
+def measure(label, func, fake, reddit, statements, trace_memory=True):
+    fake.reset_counters()
+    reddit.calls.clear()
+    statements[0] = 0
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        func()
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {
+        "label": label,
+        "seconds": round(elapsed, 3),
+        "lemmy_requests": fake.request_count(),
+        "reddit_requests": reddit.request_count(),
+        "db_statements": statements[0],
+        "peak_mb": round(peak / 1e6, 2),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+def run_scenario(args):
+    """
+    Seeds one scenario, runs the measured cycles and prints one JSON line per result.
+    """
+    fake = FakeLemmy(latency=args.latency_ms / 1000, error_rate=args.error_rate)
+    base_url = fake.start()
+    install_config(base_url, args)
+
+    from lemmy_client import LemmyClient
+    from mapping_store import get_store
+    from bridge_manager import BridgeManager
+    from bidirectional_sync import sync_reddit_to_lemmy_comments, sync_lemmy_to_reddit
+    from sync_snapshot import SyncSnapshot
+
+    reddit = FakeReddit()
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        store = get_store()  # applies migrations, which log to stdout
+    rows = []
+    for number in range(args.mappings):
+        submission = reddit.add_submission(
+            "bench", f"Thread {number}", comment_count=args.reddit_comments, page_size=args.page_size
+        )
+        post = fake.add_post(1, f"Thread {number}")
+        for comment_number in range(args.lemmy_comments):
+            fake.add_comment(post["id"], f"Lemmy comment {comment_number}")
+        rows.append((submission.id, submission.id, post["id"]))
+    with store.transaction() as conn:
+        for row in rows:
+            store._insert_mapping(conn, *row)
+
+    lemmy = LemmyClient()
+    lemmy.ensure_login()
+    statements = [0]
+
+    def count_statement(_):
+        statements[0] += 1
+    store.conn.set_trace_callback(count_statement)
+
+    snapshot = SyncSnapshot(reddit)
+
+    def sync_cycle():
+        snapshot.start_cycle()
+        sync_reddit_to_lemmy_comments(reddit, lemmy, snapshot=snapshot)
+        sync_lemmy_to_reddit(reddit, lemmy, snapshot=snapshot)
+
+    results = []
+    for cycle in range(1, args.cycles + 1):
+        results.append(measure(f"sync cycle {cycle}", sync_cycle, fake, reddit, statements, args.trace_memory))
+
+    if args.triggers:
+        bridge_manager = BridgeManager(lemmy_client=lemmy)
+        triggers = [
+            reddit.add_submission("bench", f"Trigger {number}", selftext="LemmyLink!") for number in range(args.triggers)
+        ]
+
+        def bridge_all():
+            for trigger in triggers:
+                bridge_manager.handle_trigger(trigger)
+        results.append(measure(f"{args.triggers} triggers", bridge_all, fake, reddit, statements, args.trace_memory))
+
+    fake.stop()
+    for result in results:
+        result["mappings"] = args.mappings
+        print(json.dumps(result))
+
+def scenario_argv(args, mappings):
+    return [
+        sys.executable, "-m", "benchmarks.bench_sync", "--run-one",
+        "--mappings", str(mappings),
+        "--reddit-comments", str(args.reddit_comments),
+    ] + ([] if args.page_size is None else ["--page-size", str(args.page_size)]) + [
+        "--lemmy-comments", str(args.lemmy_comments),
+        "--cycles", str(args.cycles),
+        "--triggers", str(args.triggers),
+        "--latency-ms", str(args.latency_ms),
+        "--error-rate", str(args.error_rate),
+        "--index-mode", args.index_mode,
+        "--lemmy-sync-mode", args.lemmy_sync_mode,
+    ] + ([] if args.trace_memory else ["--no-trace-memory"])
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the sync path against local fakes.")
+    parser.add_argument("--mappings", type=int, nargs="+", default=[10, 1000], help="mapping counts to run")
+    parser.add_argument("--reddit-comments", type=int, default=5, help="comments per Reddit thread")
+    parser.add_argument("--page-size", type=int, default=None,
+                        help="Reddit comments loaded with a submission; the rest sit behind 'load more' links")
+    parser.add_argument("--lemmy-comments", type=int, default=5, help="comments per Lemmy post")
+    parser.add_argument("--cycles", type=int, default=2, help="sync cycles per scenario")
+    parser.add_argument("--triggers", type=int, default=20, help="BridgeManager triggers per scenario")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="fake Lemmy latency per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake Lemmy requests failing with 503")
+    parser.add_argument("--index-mode", default="set", choices=("set", "array"))
+    parser.add_argument("--lemmy-sync-mode", default="per_post", choices=("per_post", "community"))
+    parser.add_argument("--no-trace-memory", dest="trace_memory", action="store_false",
+                        help="skip tracemalloc (faster timings; peak_mb is reported as 0)")
+    parser.add_argument("--json", action="store_true", help="print raw JSON lines instead of a table")
+    parser.add_argument("--run-one", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        args.mappings = args.mappings[0]
+        run_scenario(args)
+        return
+
+    columns = ("mappings", "label", "seconds", "lemmy_requests", "reddit_requests", "db_statements", "peak_mb",
+               "max_rss_mb")
+    if not args.json:
+        print("  ".join(f"{column:>15}" for column in columns))
+    for mappings in args.mappings:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, LEMMYLINK_DB=os.path.join(tmp, "bench.db"))
+            output = subprocess.run(
+                scenario_argv(args, mappings), cwd=BOT_DIR, env=env, capture_output=True, text=True, check=True
+            ).stdout
+        for line in output.splitlines():
+            if args.json:
+                print(line)
+            else:
+                result = json.loads(line)
+                print("  ".join(f"{result[column]:>15}" for column in columns))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+# benchmarks/fake_lemmy.py
+#
+# In-process stand-in for a Lemmy instance. It implements just the endpoints the
+# bot uses (login, create post/comment, post comments, comment list) on a
+# ThreadingHTTPServer, with optional per-request latency and injected 503s, and
+# counts every request so benchmarks can report requests per cycle.
+
+import base64
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+def _fake_jwt(username):
+    claims = {"sub": username, "exp": int(time.time()) + 86400}
+    payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).decode().rstrip("=")
+    return f"eyJhbGciOiJIUzI1NiJ9.{payload}.fake"
+
+class FakeLemmy:
+    """
+    Fake Lemmy server. start() returns the base URL to put in LEMMY_BASE_URL.
+    `latency` is seconds per request, or a function (method, path) -> seconds.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.posts = {}
+        self.comments = {}
+        self.comments_by_post = {}
+        self.creators = {}  # comment_id -> author name
+        self.requests = Counter()
+        self.tokens = set()
+        self.usernames = {}  # token -> username
+        self._next_post_id = 1
+        self._next_comment_id = 1
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    # --- Data ----------------------------------------------------------------
+
+    def add_post(self, community_id, name, body=""):
+        with self._lock:
+            post_id = self._next_post_id
+            self._next_post_id += 1
+            self.posts[post_id] = {"id": post_id, "community_id": community_id, "name": name, "body": body}
+            self.comments_by_post[post_id] = []
+            return self.posts[post_id]
+
+    def add_comment(self, post_id, content, parent_id=None, creator="lemmy_user"):
+        with self._lock:
+            comment_id = self._next_comment_id
+            self._next_comment_id += 1
+            path = "0" if parent_id is None else f"{self.comments[parent_id]['path']}"
+            comment = {
+                "id": comment_id,
+                "post_id": post_id,
+                "content": content,
+                "path": f"{path}.{comment_id}",
+                "published": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+            self.comments[comment_id] = comment
+            self.creators[comment_id] = creator
+            self.comments_by_post.setdefault(post_id, []).append(comment_id)
+            return comment
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests.clear()
+
+    def request_count(self):
+        with self._lock:
+            return sum(self.requests.values())
+
+    # --- Server --------------------------------------------------------------
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(self))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    # --- Endpoints -----------------------------------------------------------
+    # Each returns (status, body dict).
+
+    def _login(self, body, token):
+        username = body.get("username_or_email", "bot")
+        jwt = _fake_jwt(username)
+        with self._lock:
+            self.tokens.add(jwt)
+            self.usernames[jwt] = username
+        return 200, {"jwt": jwt}
+
+    def _create_post(self, body, token):
+        if token not in self.tokens:
+            return 401, {"error": "not_logged_in"}
+        post = self.add_post(body["community_id"], body["name"], body.get("body", ""))
+        return 200, {"post_view": {"post": post}}
+
+    def _delete_post(self, body, token):
+        if token not in self.tokens:
+            return 401, {"error": "not_logged_in"}
+        with self._lock:
+            post = self.posts.get(body["post_id"])
+            if post is None:
+                return 404, {"error": "couldnt_find_post"}
+            post["deleted"] = body.get("deleted", True)
+        return 200, {"post_view": {"post": post}}
+
+    def _create_comment(self, body, token):
+        if token not in self.tokens:
+            return 401, {"error": "not_logged_in"}
+        if body["post_id"] not in self.posts:
+            return 404, {"error": "couldnt_find_post"}
+        comment = self.add_comment(body["post_id"], body["content"], body.get("parent_id"), self.usernames[token])
+        return 200, {"comment_view": {
+            "comment": comment, "creator": {"name": self.usernames[token]}, "post": self.posts[body["post_id"]]
+        }}
+
+    def _post_comments(self, params, token):
+        post_id = int(params["post_id"])
+        if post_id not in self.posts:
+            return 404, {"error": "couldnt_find_post"}
+        with self._lock:
+            views = [
+                {"comment_view": {"comment": self.comments[cid], "creator": {"name": self.creators[cid]}}}
+                for cid in self.comments_by_post[post_id]
+            ]
+        return 200, {"comments": views}
+
+    def _comment_list(self, params, token):
+        limit = int(params.get("limit", 10))
+        page = int(params.get("page", 1))
+        with self._lock:
+            if "post_id" in params:
+                post_id = int(params["post_id"])
+                if post_id not in self.posts:
+                    return 404, {"error": "couldnt_find_post"}
+                ids = list(self.comments_by_post[post_id])
+            else:
+                community_id = int(params["community_id"]) if "community_id" in params else None
+                ids = [
+                    cid for cid, comment in self.comments.items()
+                    if community_id is None or self.posts[comment["post_id"]]["community_id"] == community_id
+                ]
+            if params.get("sort", "New") == "New":
+                ids.sort(reverse=True)
+            else:
+                ids.sort()
+            page_ids = ids[(page - 1) * limit:page * limit]
+            views = [
+                {
+                    "comment": self.comments[cid], "creator": {"name": self.creators[cid]},
+                    "post": self.posts[self.comments[cid]["post_id"]],
+                }
+                for cid in page_ids
+            ]
+        return 200, {"comments": views}
+
+def _make_handler(fake):
+    routes = {
+        ("POST", "/api/v3/user/login"): fake._login,
+        ("POST", "/api/v3/post"): fake._create_post,
+        ("POST", "/api/v3/post/delete"): fake._delete_post,
+        ("POST", "/api/v3/comment"): fake._create_comment,
+        ("GET", "/api/v3/post/comments"): fake._post_comments,
+        ("GET", "/api/v3/comment/list"): fake._comment_list,
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, so the client's connection pool is exercised
+        disable_nagle_algorithm = True  # headers and body are separate writes
+
+        def _handle(self, method):
+            url = urlparse(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            with fake._lock:
+                fake.requests[(method, url.path)] += 1
+            latency = fake.latency(method, url.path) if callable(fake.latency) else fake.latency
+            if latency:
+                time.sleep(latency)
+
+            handler = routes.get((method, url.path))
+            auth = self.headers.get("Authorization", "")
+            token = auth[len("Bearer "):] if auth.startswith("Bearer ") else None
+            if handler is None:
+                status, body = 404, {"error": "not_found"}
+            elif fake.error_rate and fake.random.random() < fake.error_rate:
+                status, body = 503, {"error": "injected"}
+            elif method == "GET":
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                status, body = handler(params, token)
+            else:
+                status, body = handler(json.loads(raw or b"{}"), token)
+
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
@@ -0,0 +1,201 @@
+# benchmarks/fake_reddit.py
+#
+# Minimal stand-ins for the PRAW objects the bot touches (Reddit, Subreddit,
+# Submission, Comment, CommentForest), backed by synthetic comment trees. Every
+# call that would be an API request on real PRAW is counted in FakeReddit.calls.
+# With a page size, only that many comments come with the submission; the rest
+# hide behind real praw MoreComments objects served by FakeReddit.post().
+
+import itertools
+import random
+import time
+from collections import Counter, deque
+
+from praw.models import MoreComments
+
+MORECHILDREN_LIMIT = 100  # child IDs per "load more" link, as on Reddit
+
+BASE36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+def to_base36(number):
+    digits = ""
+    while True:
+        number, remainder = divmod(number, 36)
+        digits = BASE36[remainder] + digits
+        if number == 0:
+            return digits
+
+class FakeRedditor:
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+class FakeSubreddit:
+    def __init__(self, display_name):
+        self.display_name = display_name
+
+class FakeComment:
+    def __init__(self, reddit, comment_id, submission, body, author, created_utc, parent=None):
+        self._reddit = reddit
+        self.id = comment_id
+        self.fullname = f"t1_{comment_id}"
+        self.submission = submission
+        self.link_id = submission.fullname
+        self.parent_id = parent.fullname if parent is not None else submission.fullname
+        self.subreddit = submission.subreddit
+        self.body = body
+        self.author = FakeRedditor(author)
+        self.created_utc = created_utc
+        self.permalink = f"/r/{submission.subreddit.display_name}/comments/{submission.id}/_/{comment_id}/"
+        self.replies = []
+
+    def reply(self, body):
+        self._reddit.calls["comment.reply"] += 1
+        comment = self._reddit._new_comment(self.submission, body, self._reddit.config.username, parent=self)
+        self.replies.append(comment)
+        return comment
+
+class FakeCommentForest:
+    def __init__(self, submission):
+        self._submission = submission
+
+    def __iter__(self):
+        return iter(self._submission._top_level)
+
+    def replace_more(self, limit=32):
+        self._submission._reddit.calls["comments.replace_more"] += 1
+        return []
+
+    def list(self):
+        # PRAW flattens the tree breadth-first.
+        result = []
+        level = list(self._submission._top_level)
+        while level:
+            result.extend(level)
+            level = [reply for comment in level for reply in getattr(comment, "replies", [])]
+        return result
+
+class FakeSubmission:
+    def __init__(self, reddit, submission_id, subreddit, title, selftext="", author="op"):
+        self._reddit = reddit
+        self.id = submission_id
+        self.fullname = f"t3_{submission_id}"
+        self.subreddit = subreddit
+        self.title = title
+        self.selftext = selftext
+        self.author = FakeRedditor(author)
+        self.created_utc = time.time()
+        self.permalink = f"/r/{subreddit.display_name}/comments/{submission_id}/"
+        self.url = f"https://www.reddit.com{self.permalink}"
+        self.shortlink = f"https://redd.it/{submission_id}"
+        self.comment_sort = "confidence"
+        self._top_level = []
+
+    @property
+    def comments(self):
+        # Real PRAW fetches the whole tree on first access of a lazy submission.
+        self._reddit.calls["submission.comments"] += 1
+        return FakeCommentForest(self)
+
+    def reply(self, body):
+        self._reddit.calls["submission.reply"] += 1
+        comment = self._reddit._new_comment(self, body, self._reddit.config.username)
+        self._top_level.append(comment)
+        return comment
+
+class _FakeConfig:
+    def __init__(self, username):
+        self.username = username
+
+class FakeReddit:
+    """
+    Fake praw.Reddit holding synthetic submissions and comment trees.
+    """
+
+    def __init__(self, username="lemmylink_bot", seed=0):
+        self.config = _FakeConfig(username)
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.submissions = {}
+        self.comments = {}
+        self._ids = itertools.count(36 ** 5)  # 6-character base36 IDs like real ones
+
+    def _new_comment(self, submission, body, author, parent=None):
+        comment_id = to_base36(next(self._ids))
+        comment = FakeComment(self, comment_id, submission, body, author, time.time(), parent)
+        self.comments[comment_id] = comment
+        return comment
+
+    def add_submission(self, subreddit_name, title, selftext="", comment_count=0, reply_share=0.5, page_size=None):
+        """
+        Creates a submission with a synthetic comment tree of `comment_count`
+        comments; about `reply_share` of them are replies to earlier comments.
+        With `page_size`, only the first `page_size` comments (breadth-first) are
+        loaded with the submission.
+        """
+        submission_id = to_base36(next(self._ids))
+        submission = FakeSubmission(self, submission_id, FakeSubreddit(subreddit_name), title, selftext)
+        self.submissions[submission_id] = submission
+        thread = []
+        for number in range(comment_count):
+            author = f"user{self.random.randrange(1000)}"
+            body = f"Synthetic comment {number} on {submission_id}"
+            if thread and self.random.random() < reply_share:
+                parent = self.random.choice(thread)
+                comment = self._new_comment(submission, body, author, parent)
+                parent.replies.append(comment)
+            else:
+                comment = self._new_comment(submission, body, author)
+                submission._top_level.append(comment)
+            thread.append(comment)
+        if page_size is not None:
+            self._paginate(submission, page_size)
+        return submission
+
+    def _paginate(self, submission, page_size):
+        # Visible comments keep their place; each parent's first hidden children
+        # are replaced by MoreComments links (their subtrees come along on expansion).
+        visible = 0
+        queue = deque([(submission, submission._top_level)])
+        while queue:
+            parent, replies = queue.popleft()
+            hidden = []
+            for comment in list(replies):
+                if visible < page_size:
+                    visible += 1
+                    queue.append((comment, comment.replies))
+                else:
+                    hidden.append(comment)
+            if not hidden:
+                continue
+            del replies[len(replies) - len(hidden):]
+            for start in range(0, len(hidden), MORECHILDREN_LIMIT):
+                chunk = hidden[start:start + MORECHILDREN_LIMIT]
+                replies.append(MoreComments(self, {
+                    "parent_id": parent.fullname,
+                    "children": [comment.id for comment in chunk],
+                    "count": len(chunk),
+                    "id": chunk[0].id,
+                }))
+
+    def post(self, path, data=None):
+        # Only /api/morechildren is needed (MoreComments.comments()).
+        self.calls["more.comments"] += 1
+        return [self.comments[comment_id] for comment_id in data["children"].split(",")]
+
+    def submission(self, id):
+        self.calls["reddit.submission"] += 1
+        return self.submissions[id]
+
+    def comment(self, id):
+        self.calls["reddit.comment"] += 1
+        return self.comments[id]
+
+    def subreddit(self, display_name):
+        return FakeSubreddit(display_name)
+
+    def request_count(self):
+        # Lazy object construction is free on real PRAW; fetches and replies are requests.
+        return sum(count for name, count in self.calls.items() if not name.startswith("reddit."))
@@ -0,0 +1,426 @@
+# benchmarks/replay.py
+#
+# Replays a traffic recording (see capture.py) against the local fakes, to load
+# test a change with production-shaped traffic. Run from the lemmylink_bot
+# directory:
+#
+#   python -m benchmarks.replay capture.jsonl.gz --speed 60
+#
+# The recorded submission and comment stream items are fed, on their recorded
+# schedule compressed by --speed, through main.watch_submissions and
+# main.watch_comments: trigger matching, BridgeManager and (with
+# --reddit-sync-mode stream) the comment forwarder. Each item is added to the
+# fake Reddit thread it belongs to as it is streamed, so a sync thread running
+# both directions every --sync-interval recorded seconds sees the threads grow.
+# Lemmy comments written by other users in the recording appear on the fake
+# Lemmy server when they were first seen; their posts are matched to the
+# replay's posts by creation order (comments on posts bridged before the
+# recording started are skipped). Fake Lemmy latency is sampled from what was
+# recorded for each endpoint.
+#
+# Reported: throughput and latency percentiles of stream item handling, lag
+# behind the recorded schedule, sync cycles and Lemmy requests.
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import redirect_stdout
+
+from benchmarks.bench_sync import install_config
+from benchmarks.fake_lemmy import FakeLemmy
+from benchmarks.fake_reddit import FakeComment, FakeReddit, FakeSubmission, FakeSubreddit
+
+BOT_COMMENT_PREFIX = "From Reddit user "
+
+def percentiles(samples):
+    """
+    Returns count, p50, p90, p99 and max of `samples` (seconds) in milliseconds.
+    """
+    ordered = sorted(samples)
+
+    def rank(share):
+        return round(ordered[min(len(ordered) - 1, int(share * len(ordered)))] * 1000, 2)
+    if not ordered:
+        return {"count": 0, "p50_ms": 0, "p90_ms": 0, "p99_ms": 0, "max_ms": 0}
+    return {
+        "count": len(ordered),
+        "p50_ms": rank(0.5),
+        "p90_ms": rank(0.9),
+        "p99_ms": rank(0.99),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+class Recording:
+    """
+    A capture file split into what the replay needs.
+    """
+
+    def __init__(self, path):
+        from capture import read_events, SUBMISSION, COMMENT, LEMMY
+
+        self.reddit_username = None
+        self.lemmy_username = None
+        self.submissions = []  # (t, event)
+        self.comments = []  # (t, event)
+        self.lemmy_latency = defaultdict(list)  # (method, path) -> recorded latencies
+        self.lemmy_comments = []  # (t, recorded post ID, recorded comment ID, recorded parent ID, content)
+        self.post_order = {}  # recorded ID of a post the bot created -> its position (1, 2, ...)
+        own_comments = set()
+        seen = set()
+        for event in read_events(path):
+            kind = event["type"]
+            if kind == "start":
+                self.reddit_username = event.get("reddit_username")
+                self.lemmy_username = event.get("lemmy_username")
+            elif kind == SUBMISSION:
+                self.submissions.append((event["t"], event))
+            elif kind == COMMENT:
+                self.comments.append((event["t"], event))
+            elif kind == LEMMY:
+                self.lemmy_latency[(event["method"], event["path"])].append(event["latency"])
+                self._read_lemmy(event, own_comments, seen)
+        if self.reddit_username:
+            # The bot's own Reddit replies come back through the stream; the replay makes its own.
+            own = self.reddit_username.lower()
+            self.comments = [(t, event) for t, event in self.comments if (event["author"] or "").lower() != own]
+        events = self.submissions + self.comments + self.lemmy_comments
+        self.start = min((event[0] for event in events), default=0.0)
+        self.end = max((event[0] for event in events), default=0.0)
+
+    def _read_lemmy(self, event, own_comments, seen):
+        body = event.get("body")
+        if not isinstance(body, dict) or event["status"] != 200:
+            return
+        if event["method"] == "POST" and event["path"] == "/api/v3/post":
+            post_id = body.get("post_view", {}).get("post", {}).get("id")
+            if post_id is not None:
+                self.post_order.setdefault(post_id, len(self.post_order) + 1)
+        elif event["method"] == "POST" and event["path"] == "/api/v3/comment":
+            comment_id = body.get("comment_view", {}).get("comment", {}).get("id")
+            if comment_id is not None:
+                own_comments.add(comment_id)
+        elif event["method"] == "GET" and "comments" in body:
+            for entry in body["comments"]:
+                view = entry.get("comment_view", entry)
+                comment = view.get("comment", {})
+                creator = view.get("creator", {}).get("name")
+                if comment.get("id") is None or comment["id"] in seen or comment["id"] in own_comments:
+                    continue
+                seen.add(comment["id"])
+                if comment.get("content", "").startswith(BOT_COMMENT_PREFIX):
+                    continue
+                if creator and self.lemmy_username and creator.lower() == self.lemmy_username.lower():
+                    continue
+                path = comment.get("path", "0").split(".")
+                parent_id = int(path[-2]) if len(path) > 2 else None
+                self.lemmy_comments.append((event["t"], comment["post_id"], comment["id"], parent_id, comment["content"]))
+
+    def latency_sampler(self, seed=0):
+        """
+        Returns a FakeLemmy latency function drawing from the recorded latencies
+        of each endpoint (0 for endpoints that were never recorded).
+        """
+        rng = random.Random(seed)
+        lock = threading.Lock()
+
+        def sample(method, path):
+            samples = self.lemmy_latency.get((method, path))
+            if not samples:
+                return 0.0
+            with lock:
+                return rng.choice(samples)
+        return sample
+
+class ReplayClock:
+    """
+    Maps recorded times onto the wall clock, `speed` times faster.
+    """
+
+    def __init__(self, recorded_start, speed):
+        self.recorded_start = recorded_start
+        self.speed = speed
+        self.started = time.time()
+
+    def due(self, recorded_time):
+        return self.started + (recorded_time - self.recorded_start) / self.speed
+
+    def wait_until(self, recorded_time, stop_event, poll=0.5):
+        """
+        Sleeps until `recorded_time` is due. Returns False if the wait was cut
+        short by stop_event, True if it is due; waits longer than `poll` return
+        None so streams can yield an idle None.
+        """
+        remaining = self.due(recorded_time) - time.time()
+        if remaining <= 0:
+            return True
+        if stop_event.wait(min(remaining, poll)):
+            return False
+        return None if remaining > poll else True
+
+class ReplayThreads:
+    """
+    Builds the fake Reddit threads from recorded stream items as they are streamed.
+    """
+
+    def __init__(self, reddit):
+        self.reddit = reddit
+        self._lock = threading.Lock()
+
+    def _submission(self, submission_id, subreddit):
+        submission = self.reddit.submissions.get(submission_id)
+        if submission is None:
+            submission = FakeSubmission(self.reddit, submission_id, FakeSubreddit(subreddit), f"Thread {submission_id}")
+            self.reddit.submissions[submission_id] = submission
+        return submission
+
+    def add_submission(self, event):
+        with self._lock:
+            submission = self._submission(event["id"], event["subreddit"])
+            submission.title = event["title"]
+            submission.selftext = event["selftext"] or ""
+            submission.author.name = event["author"] or "[deleted]"
+            submission.url = event["url"] or submission.url
+            submission.created_utc = time.time()
+            return submission
+
+    def add_comment(self, event):
+        with self._lock:
+            submission = self._submission(event["link_id"].split("_", 1)[-1], event["subreddit"])
+            # A reply to a comment from before the recording becomes a top-level comment.
+            parent = None
+            if event["parent_id"].startswith("t1_"):
+                parent = self.reddit.comments.get(event["parent_id"].split("_", 1)[-1])
+            comment = FakeComment(
+                self.reddit, event["id"], submission, event["body"], event["author"] or "[deleted]", time.time(), parent
+            )
+            (parent.replies if parent is not None else submission._top_level).append(comment)
+            self.reddit.comments[comment.id] = comment
+            return comment
+
+class ReplayStream:
+    """
+    subreddit.stream stand-in yielding recorded items on the replay clock, with
+    None while idle (like pause_after=0). It measures how long the consumer takes
+    to handle each item and how far behind schedule the item was yielded.
+    """
+
+    def __init__(self, items, clock, build, stop_event, stats):
+        self.items = items
+        self.clock = clock
+        self.build = build
+        self.stop_event = stop_event
+        self.stats = stats
+
+    def __call__(self, skip_existing=True, pause_after=None):
+        for recorded_time, event in self.items:
+            while True:
+                due = self.clock.wait_until(recorded_time, self.stop_event)
+                if due is False:
+                    return
+                if due:
+                    break
+                yield None
+            item = self.build(event)
+            self.stats["lag"].append(max(0.0, time.time() - self.clock.due(recorded_time)))
+            started = time.perf_counter()
+            yield item
+            self.stats["item"].append(time.perf_counter() - started)
+
+class _ReplayStreams:
+    def __init__(self, submissions, comments):
+        self.submissions = submissions
+        self.comments = comments
+
+class ReplaySubreddit(FakeSubreddit):
+    """
+    Subreddit whose streams replay a recording; the catch-up listings are empty.
+    """
+
+    def __init__(self, display_name, submissions, comments):
+        super().__init__(display_name)
+        self.stream = _ReplayStreams(submissions, comments)
+
+    def new(self, limit=None):
+        return []
+
+    def comments(self, limit=None):
+        return []
+
+def replay(args):
+    """
+    Replays the recording and returns the report dict.
+    """
+    fake = FakeLemmy()
+    base_url = fake.start()
+    install_config(base_url, args)
+    config = sys.modules["config"]
+    config.REDDIT_SYNC_MODE = args.reddit_sync_mode
+    # The forwarder's mapping reload runs on the replay clock too (default 30s).
+    config.MAPPING_REFRESH_INTERVAL = 30 / args.speed
+
+    recording = Recording(args.recording)
+    if args.lemmy_latency == "recorded":
+        fake.latency = recording.latency_sampler()
+    else:
+        fake.latency = float(args.lemmy_latency) / 1000
+
+    from lemmy_client import LemmyClient
+    from mapping_store import get_store
+    from bridge_manager import BridgeManager
+    from bidirectional_sync import sync_reddit_to_lemmy_comments, sync_lemmy_to_reddit
+    from sync_snapshot import SyncSnapshot
+    from stream_sync import RedditCommentForwarder
+    from main import watch_submissions, watch_comments
+
+    stats = {"item": [], "lag": [], "sync_cycle": [], "lemmy_request": []}
+    reddit = FakeReddit()
+    threads = ReplayThreads(reddit)
+    get_store()
+    lemmy = LemmyClient()
+    lemmy.ensure_login()
+    lemmy.on_request = lambda method, path, status, seconds: stats["lemmy_request"].append(seconds)
+    bridge_manager = BridgeManager(lemmy_client=lemmy)
+    forwarder = RedditCommentForwarder(reddit, lemmy) if args.reddit_sync_mode == "stream" else None
+
+    stop_event = threading.Event()
+    clock = ReplayClock(recording.start, args.speed)
+    subreddit = ReplaySubreddit(
+        config.SUBREDDIT_NAME,
+        ReplayStream(recording.submissions, clock, threads.add_submission, stop_event, stats),
+        ReplayStream(recording.comments, clock, threads.add_comment, stop_event, stats),
+    )
+    snapshot = SyncSnapshot(reddit)
+
+    def sync_cycle():
+        started = time.perf_counter()
+        snapshot.start_cycle()
+        if forwarder is None:
+            sync_reddit_to_lemmy_comments(reddit, lemmy, snapshot=snapshot)
+        sync_lemmy_to_reddit(reddit, lemmy, snapshot=snapshot)
+        stats["sync_cycle"].append(time.perf_counter() - started)
+
+    def run_sync(done):
+        while not done.wait(args.sync_interval / args.speed):
+            sync_cycle()
+
+    injected = [0, 0]  # Lemmy comments injected, skipped
+
+    def inject_lemmy_comments(streams_done):
+        # A comment on a post the replay hasn't created yet waits until it has, or
+        # until the streams are done (then the post will never exist).
+        pending = deque(recording.lemmy_comments)
+        waiting = []
+        replayed_ids = {}
+        while (pending or waiting) and not stop_event.is_set():
+            still_waiting = []
+            for entry in waiting:
+                post_id, comment_id, parent_id, content = entry
+                if post_id not in fake.posts:
+                    still_waiting.append(entry)
+                    continue
+                comment = fake.add_comment(post_id, content, replayed_ids.get(parent_id))
+                replayed_ids[comment_id] = comment["id"]
+                injected[0] += 1
+            waiting = still_waiting
+            if not pending:
+                if streams_done.is_set():
+                    break
+                stop_event.wait(0.05)
+                continue
+            if clock.wait_until(pending[0][0], stop_event):
+                _, post_id, comment_id, parent_id, content = pending.popleft()
+                position = recording.post_order.get(post_id)
+                if position is None:
+                    injected[1] += 1
+                else:
+                    waiting.append((position, comment_id, parent_id, content))
+        injected[1] += len(waiting)
+
+    streams_done = threading.Event()
+    sync_done = threading.Event()
+    streams = [
+        threading.Thread(target=watch_submissions, args=(subreddit, bridge_manager, stop_event)),
+        threading.Thread(target=watch_comments, args=(subreddit, bridge_manager, forwarder, stop_event)),
+    ]
+    injector = threading.Thread(target=inject_lemmy_comments, args=(streams_done,))
+    syncer = threading.Thread(target=run_sync, args=(sync_done,))
+    started = time.perf_counter()
+    for worker in streams + [injector, syncer]:
+        worker.start()
+    try:
+        for worker in streams:
+            worker.join()
+        streams_done.set()
+        injector.join()
+    except KeyboardInterrupt:
+        stop_event.set()
+        for worker in streams + [injector]:
+            worker.join()
+    sync_done.set()
+    syncer.join()
+    sync_cycle()  # a last cycle so comments streamed after the previous one are synced too
+    elapsed = time.perf_counter() - started
+    fake.stop()
+
+    items = len(recording.submissions) + len(recording.comments)
+    return {
+        "recorded_seconds": round(recording.end - recording.start, 1),
+        "replay_seconds": round(elapsed, 2),
+        "speed": args.speed,
+        "submissions": len(recording.submissions),
+        "comments": len(recording.comments),
+        "items_per_second": round(items / elapsed, 1) if elapsed else 0.0,
+        "lemmy_posts": len(fake.posts),
+        "lemmy_comments_injected": injected[0],
+        "lemmy_comments_skipped": injected[1],
+        "lemmy_requests": fake.request_count(),
+        "reddit_requests": reddit.request_count(),
+        "reddit_replies": reddit.calls["comment.reply"] + reddit.calls["submission.reply"],
+        "sync_cycles": len(stats["sync_cycle"]),
+        "latency": {name: percentiles(samples) for name, samples in stats.items()},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a traffic recording against local fakes.")
+    parser.add_argument("recording", help="capture file written with CAPTURE_FILE / LEMMYLINK_CAPTURE")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay this many times faster than recorded")
+    parser.add_argument("--sync-interval", type=float, default=60.0, help="recorded seconds between sync cycles")
+    parser.add_argument("--lemmy-latency", default="recorded",
+                        help="fake Lemmy latency: 'recorded' (sampled per endpoint) or milliseconds")
+    parser.add_argument("--index-mode", default="set", choices=("set", "array"))
+    parser.add_argument("--lemmy-sync-mode", default="per_post", choices=("per_post", "community"))
+    parser.add_argument("--reddit-sync-mode", default="poll", choices=("poll", "stream"))
+    parser.add_argument("--verbose", action="store_true", help="show the bot's log output")
+    parser.add_argument("--json", action="store_true", help="print the report as one JSON object")
+    args = parser.parse_args()
+
+    # A throwaway database and no re-capture of the replay itself.
+    os.environ.pop("LEMMYLINK_CAPTURE", None)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["LEMMYLINK_DB"] = os.path.join(tmp, "replay.db")
+        if args.verbose:
+            report = replay(args)
+        else:
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                report = replay(args)
+
+    if args.json:
+        print(json.dumps(report))
+        return
+    for key, value in report.items():
+        if key != "latency":
+            print(f"{key:>24}  {value}")
+    columns = ("count", "p50_ms", "p90_ms", "p99_ms", "max_ms")
+    print()
+    print(f"{'latency':>24}  " + "  ".join(f"{column:>10}" for column in columns))
+    for name, result in report["latency"].items():
+        print(f"{name:>24}  " + "  ".join(f"{result[column]:>10}" for column in columns))
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,114 @@
 # bidirectional_sync.py
 
 import time
+from collections import defaultdict
+
+import config
 from reddit_client import get_reddit_client
 from lemmy_client import LemmyClient
-from mapping_db import get_all_mappings
-from comment_mapping_db import (
-    get_comment_mapping_by_reddit_comment,
-    get_comment_mapping_by_lemmy_comment,
-    insert_comment_mapping
+from mapping_store import get_store
+from synced_index import get_synced_index
+from outbox import lemmy_comment_job, reddit_reply_job
+from sync_snapshot import SyncSnapshot
+from metrics import COMMENTS_SYNCED, SYNC_CYCLE, record_error, start_metrics_server
+from poll_scheduler import PollScheduler, POLL_SCHEDULER_ENABLED
+from sync_cursors import (
+    REDDIT_TO_LEMMY,
+    LEMMY_TO_REDDIT,
+    CursorAdvance,
+    mark_stalled,
+    mapping_scope,
+    community_scope,
+    reddit_comments_after,
+    lemmy_cursor,
+    lemmy_comments_after
 )
 
-def sync_reddit_to_lemmy_comments(reddit, lemmy):
+# "per_post" lists each mapped Lemmy post; "community" lists new comments across
+# config.LEMMY_COMMUNITY_ID once per cycle and routes them to their mappings.
+LEMMY_SYNC_MODE = getattr(config, "LEMMY_SYNC_MODE", "per_post")
+
+# "poll" walks every mapped Reddit thread each cycle; "stream" leaves Reddit-to-Lemmy
+# to stream_sync.py (run it alongside this script) and only polls Lemmy here.
+REDDIT_SYNC_MODE = getattr(config, "REDDIT_SYNC_MODE", "poll")
+
+# In poll mode with per-post Lemmy sync both directions visit the same mappings, so
+# the Reddit direction can fetch a thread's Lemmy comments up front (to detect
+# echoes) and the Lemmy direction reuses them: no extra requests.
+SHARED_LEMMY_FETCH = REDDIT_SYNC_MODE == "poll" and LEMMY_SYNC_MODE == "per_post"
+
+def is_own_reddit_comment(reddit, comment):
     """
-    For each mapped Reddit submission, sync any new Reddit comments to Lemmy.
+    Returns True if the Reddit comment was written by the bot account itself.
     """
-    mappings = get_all_mappings()
-    if not mappings:
-        print("No post mappings found. Skipping Reddit-to-Lemmy sync.")
-        return
+    return bool(comment.author) and comment.author.name.lower() == reddit.config.username.lower()
 
-    for mapping in mappings:
-        # Assuming mapping record structure: (id, reddit_submission_id, reddit_trigger_comment_id, lemmy_post_id, created_at)
-        reddit_submission_id = mapping[1]
-        lemmy_post_id = mapping[3]
+def format_reddit_comment_for_lemmy(comment):
+    """
+    Builds the Lemmy comment body for a Reddit comment.
+    """
+    return (
+        f"From Reddit user [/u/{comment.author}](https://reddit.com/user/{comment.author})"
+        f"([Link to Reddit Comment](https://www.reddit.com{comment.permalink}))\n\n{comment.body}"
+    )
 
-        submission = reddit.submission(id=reddit_submission_id)
-        submission.comments.replace_more(limit=0)
-        all_comments = submission.comments.list()
+def extract_lemmy_comment_id(lemmy_response):
+    """
+    Extracts the new comment ID from a Lemmy create_comment response (or None).
+    """
+    return (
+        lemmy_response.get("comment_view", {})
+                      .get("comment", {})
+                      .get("id")
+    )
 
-        print(f"Processing Reddit submission {reddit_submission_id}: Found {len(all_comments)} comments.")
+def extract_lemmy_comment_data(comment):
+    """
+    Returns the inner comment dict of a Lemmy comment list entry (or {}).
+    """
+    # /api/v3/post/comments entries wrap the view in "comment_view";
+    # /api/v3/comment/list entries are the comment view itself.
+    return comment.get("comment_view", comment).get("comment", {})
 
-        for comment in all_comments:
+def sync_reddit_thread_to_lemmy(reddit, lemmy, index, comments, lemmy_post_id, scope=None, cursor=None,
+                                outbox=None, echoes=None):
+    """
+    Syncs the not-yet-mapped comments among `comments` (one Reddit thread) to a Lemmy post.
+    Only comments past the thread's cursor are considered; already-synced IDs are
+    answered by the in-memory SyncedIndex. The new mappings and the advanced cursor
+    are written in a single transaction once the thread is done.
+    With an Outbox, comments are enqueued as jobs (in that same transaction)
+    instead of being posted inline. `echoes` maps Reddit comment IDs that already
+    have a Lemmy copy to that copy's ID; those are only recorded.
+    """
+    echoes = echoes or {}
+    pending = reddit_comments_after(comments, cursor)
+    unsynced = index.unsynced_reddit_ids(comment.id for comment in pending)
+    advance = CursorAdvance(cursor)
+    new_pairs = []
+    jobs = []
+    try:
+        for comment in pending:
+            position = (comment.created_utc, comment.id)
             # Skip if already synced or if it's the bot's own comment.
-            if get_comment_mapping_by_reddit_comment(comment.id) is not None:
+            if comment.id not in unsynced or is_own_reddit_comment(reddit, comment):
+                advance.done(position)
                 continue
-            if comment.author and comment.author.name.lower() == reddit.config.username.lower():
+            if comment.id in echoes:
+                new_pairs.append((comment.id, echoes[comment.id]))
+                advance.done(position)
+                continue
+
+            if outbox is not None:
+                jobs.append(lemmy_comment_job(
+                    comment.id, lemmy_post_id, format_reddit_comment_for_lemmy(comment), lemmy.base_url
+                ))
+                advance.done(position)
                 continue
 
             try:
                 # For MVP, post as a top-level comment on Lemmy.
-                content = (
-                    f"From Reddit user [/u/{comment.author}](https://reddit.com/user/{comment.author})"
-                    f"([Link to Reddit Comment](https://www.reddit.com{comment.permalink}))\n\n{comment.body}"
-                )
+                content = format_reddit_comment_for_lemmy(comment)
 
                 lemmy_response = lemmy.create_comment(
                     post_id=lemmy_post_id,
@@ -50,69 +116,292 @@ def sync_reddit_to_lemmy_comments(reddit, lemmy):
                     parent_id=None  # Extend later to support nested replies.
                 )
                 # Extract Lemmy comment ID.
-                lemmy_comment_id = (
-                    lemmy_response.get("comment_view", {})
-                                  .get("comment", {})
-                                  .get("id")
-                )
+                lemmy_comment_id = extract_lemmy_comment_id(lemmy_response)
                 if lemmy_comment_id:
-                    insert_comment_mapping(comment.id, lemmy_comment_id)
+                    new_pairs.append((comment.id, lemmy_comment_id))
+                    advance.done(position)
+                    COMMENTS_SYNCED.inc(direction=REDDIT_TO_LEMMY)
                     print(f"Synced Reddit comment {comment.id} to Lemmy comment {lemmy_comment_id}")
                 else:
+                    advance.failed(position, REDDIT_TO_LEMMY, comment.id)
                     print(f"Failed to extract Lemmy comment ID for Reddit comment {comment.id}. Response: {lemmy_response}")
             except Exception as e:
+                advance.failed(position, REDDIT_TO_LEMMY, comment.id)
+                record_error(REDDIT_TO_LEMMY)
                 print(f"Error syncing Reddit comment {comment.id}: {e}")
+    finally:
+        moved = scope is not None and advance.moved
+        index.record(new_pairs, (scope, REDDIT_TO_LEMMY, advance.position) if moved else None, jobs)
+        if scope is not None and advance.blocked:
+            mark_stalled(scope)
+
+def sync_lemmy_thread_to_reddit(index, submission, lemmy_comments, scope=None, cursor=None, outbox=None,
+                                echoes=None):
+    """
+    Syncs the not-yet-mapped comments among `lemmy_comments` (one Lemmy post) to a Reddit submission.
+    Only comments with an ID above the thread's cursor are considered. With an
+    Outbox, replies are enqueued as jobs instead of being posted inline. `echoes`
+    maps Lemmy comment IDs that must not be posted (the bot's own copies) to
+    their Reddit comment ID; those are only recorded.
+    """
+    echoes = echoes or {}
+    cursor = lemmy_cursor(cursor)
+    pending = lemmy_comments_after(
+        [extract_lemmy_comment_data(comment) for comment in lemmy_comments], cursor
+    )
+    unsynced = index.unsynced_lemmy_ids(data["id"] for data in pending)
+    advance = CursorAdvance(cursor)
+    new_pairs = []
+    jobs = []
+    try:
+        for comment_data in pending:
+            lemmy_comment_id = comment_data["id"]
+            # Skip if already synced
+            if lemmy_comment_id not in unsynced:
+                advance.done((None, lemmy_comment_id))
+                continue
+            if lemmy_comment_id in echoes:
+                new_pairs.append((echoes[lemmy_comment_id], lemmy_comment_id))
+                advance.done((None, lemmy_comment_id))
+                continue
+            if outbox is not None:
+                jobs.append(reddit_reply_job(submission.fullname, comment_data.get("content", ""), lemmy_comment_id))
+                advance.done((None, lemmy_comment_id))
+                continue
+
+            try:
+                # Extract the content from the nested comment data.
+                content = comment_data.get("content", "")
+                reddit_comment = submission.reply(content)
+                new_pairs.append((reddit_comment.id, lemmy_comment_id))
+                advance.done((None, lemmy_comment_id))
+                COMMENTS_SYNCED.inc(direction=LEMMY_TO_REDDIT)
+                print(f"Synced Lemmy comment {lemmy_comment_id} to Reddit comment {reddit_comment.id}")
+            except Exception as e:
+                advance.failed((None, lemmy_comment_id), LEMMY_TO_REDDIT, lemmy_comment_id)
+                record_error(LEMMY_TO_REDDIT)
+                print(f"Error syncing Lemmy comment {lemmy_comment_id}: {e}")
+    finally:
+        moved = scope is not None and advance.moved
+        index.record(new_pairs, (scope, LEMMY_TO_REDDIT, advance.position) if moved else None, jobs)
+        if scope is not None and advance.blocked:
+            mark_stalled(scope)
+    return advance
+
+def sync_reddit_to_lemmy_comments(reddit, lemmy, outbox=None, mappings=None, snapshot=None):
+    """
+    For each mapped Reddit submission, sync any new Reddit comments to Lemmy.
+    `mappings` limits the pass to some mappings (e.g. one instance's, see routing.py).
+    Pass the cycle's SyncSnapshot to share fetches with the Lemmy direction.
+    """
+    store = get_store()
+    # Without a shared snapshot the Lemmy direction would fetch again.
+    shared_lemmy_fetch = SHARED_LEMMY_FETCH and snapshot is not None
+    snapshot = snapshot or SyncSnapshot(reddit)
+    if mappings is None:
+        mappings = snapshot.mappings()
+    if not mappings:
+        print("No post mappings found. Skipping Reddit-to-Lemmy sync.")
+        return
+    index = get_synced_index()
+    scopes = [mapping_scope(mapping[0]) for mapping in mappings]
+    cursors = store.get_cursors(REDDIT_TO_LEMMY, scopes)
+    lemmy_cursors = store.get_cursors(LEMMY_TO_REDDIT, scopes) if shared_lemmy_fetch else {}
+
+    for mapping in mappings:
+        # Mapping record structure: (id, reddit_submission_id, reddit_trigger_comment_id, lemmy_post_id,
+        # created_at, subreddit, lemmy_instance)
+        scope = mapping_scope(mapping[0])
+        reddit_submission_id = mapping[1]
+        lemmy_post_id = mapping[3]
+
+        if shared_lemmy_fetch:
+            snapshot.lemmy_comments(lemmy, mapping, lemmy_cursor(lemmy_cursors.get(scope)))
+        echoes = snapshot.reddit_echoes(lemmy, mapping)
+        try:
+            submission = reddit.submission(id=reddit_submission_id)
+            for comments, branch in snapshot.reddit_batches(mapping, submission):
+                if branch is None:
+                    print(f"Processing Reddit submission {reddit_submission_id}: Found {len(comments)} comments.")
+                    sync_reddit_thread_to_lemmy(
+                        reddit, lemmy, index, comments, lemmy_post_id, scope, cursors.get(scope), outbox, echoes
+                    )
+                else:
+                    # Branch comments can be older than the cursor, so they are checked
+                    # against the synced index only and don't move the cursor.
+                    print(f"Processing Reddit submission {reddit_submission_id}: Found {len(comments)} comments "
+                          f"in 'load more' branch {branch.key}.")
+                    sync_reddit_thread_to_lemmy(
+                        reddit, lemmy, index, comments, lemmy_post_id, outbox=outbox, echoes=echoes
+                    )
+        except Exception as e:
+            # A deleted submission or a PRAW error skips this thread only; its
+            # cursor stays where the last synced comment left it.
+            record_error("reddit_fetch")
+            print(f"Error fetching Reddit submission {reddit_submission_id}: {e}")
 
-def sync_lemmy_to_reddit_comments(reddit, lemmy):
+def sync_lemmy_to_reddit_comments(reddit, lemmy, outbox=None, mappings=None, snapshot=None):
     """
     For each mapped post, sync any new Lemmy comments to Reddit.
     """
-    mappings = get_all_mappings()
+    store = get_store()
+    snapshot = snapshot or SyncSnapshot(reddit)
+    if mappings is None:
+        mappings = snapshot.mappings()
     if not mappings:
         print("No post mappings found. Skipping Lemmy-to-Reddit sync.")
         return
+    index = get_synced_index()
+    cursors = store.get_cursors(LEMMY_TO_REDDIT, [mapping_scope(mapping[0]) for mapping in mappings])
 
     for mapping in mappings:
+        scope = mapping_scope(mapping[0])
         reddit_submission_id = mapping[1]
         lemmy_post_id = mapping[3]
-        submission = reddit.submission(id=reddit_submission_id)
-
+        cursor = lemmy_cursor(cursors.get(scope))
+        page_scope = scope
         try:
-            lemmy_comments = lemmy.get_comments(lemmy_post_id)
+            submission = reddit.submission(id=reddit_submission_id)
         except Exception as e:
-            print(f"Error fetching comments from Lemmy for post {lemmy_post_id}: {e}")
+            record_error("reddit_fetch")
+            print(f"Error fetching Reddit submission {reddit_submission_id}: {e}")
             continue
 
-        print(f"Processing Lemmy post {lemmy_post_id}: Found {len(lemmy_comments)} comments.")
+        for lemmy_comments in snapshot.lemmy_pages(lemmy, mapping, cursor):
+            print(f"Processing Lemmy post {lemmy_post_id}: Found {len(lemmy_comments)} new comments.")
+            advance = sync_lemmy_thread_to_reddit(
+                index, submission, lemmy_comments, page_scope, cursor, outbox,
+                snapshot.lemmy_echoes(lemmy, mapping, lemmy_comments)
+            )
+            if advance.blocked:
+                # The cursor stays before the failed comment; later pages are
+                # still synced, deduplicated by the synced index.
+                page_scope = None
+            else:
+                cursor = advance.position
 
-        for comment in lemmy_comments:
-            # Drill into the nested structure: assume each comment dict contains a "comment_view" key
-            comment_data = comment.get("comment_view", {}).get("comment", {})
-            lemmy_comment_id = comment_data.get("id")
-            if not lemmy_comment_id:
-                continue
-            # Skip if already synced
-            if get_comment_mapping_by_lemmy_comment(lemmy_comment_id) is not None:
-                continue
+def sync_lemmy_to_reddit_community(reddit, lemmy, community_id=None, outbox=None, mappings=None, snapshot=None):
+    """
+    Syncs new Lemmy comments to Reddit by listing the whole community newest-first
+    back to the last-seen comment ID, instead of one request per mapped post. Each
+    comment is routed to its mapping through a lemmy_post_id -> mapping index.
+    """
+    community_id = community_id or config.LEMMY_COMMUNITY_ID
+    store = get_store()
+    snapshot = snapshot or SyncSnapshot(reddit)
+    if mappings is None:
+        mappings = snapshot.mappings()
+    if not mappings:
+        print("No post mappings found. Skipping Lemmy-to-Reddit sync.")
+        return
 
-            try:
-                # Extract the content from the nested comment data.
-                content = comment_data.get("content", "")
-                reddit_comment = submission.reply(content)
-                insert_comment_mapping(reddit_comment.id, lemmy_comment_id)
-                print(f"Synced Lemmy comment {lemmy_comment_id} to Reddit comment {reddit_comment.id}")
-            except Exception as e:
-                print(f"Error syncing Lemmy comment {lemmy_comment_id}: {e}")
+    scope = community_scope(community_id)
+    community_cursor = lemmy_cursor(store.get_cursor(scope, LEMMY_TO_REDDIT))
+    if community_cursor is None:
+        # First run: remember the newest comment in the community *before* a full
+        # per-post pass, so nothing posted in between is missed next cycle.
+        try:
+            newest = next(lemmy.iter_comments(community_id=community_id, sort="New", limit=1), None)
+        except Exception as e:
+            record_error("lemmy_fetch")
+            print(f"Error fetching comments from Lemmy community {community_id}: {e}")
+            return
+        sync_lemmy_to_reddit_comments(reddit, lemmy, outbox, mappings, snapshot)
+        if newest is not None:
+            store.set_cursor(scope, LEMMY_TO_REDDIT, (None, extract_lemmy_comment_data(newest)["id"]))
+        return
+
+    try:
+        new_comments = list(lemmy.iter_comments(
+            community_id=community_id, sort="New", stop_at_id=community_cursor[1]
+        ))
+    except Exception as e:
+        record_error("lemmy_fetch")
+        print(f"Error fetching comments from Lemmy community {community_id}: {e}")
+        return
+    if not new_comments:
+        return
+
+    mapping_by_post = {mapping[3]: mapping for mapping in mappings}
+    comments_by_post = defaultdict(list)
+    for comment in new_comments:
+        post_id = extract_lemmy_comment_data(comment).get("post_id")
+        if post_id in mapping_by_post:
+            comments_by_post[post_id].append(comment)
+
+    print(f"Processing Lemmy community {community_id}: Found {len(new_comments)} new comments "
+          f"in {len(comments_by_post)} mapped posts.")
+    index = get_synced_index()
+    cursors = store.get_cursors(
+        LEMMY_TO_REDDIT, [mapping_scope(mapping_by_post[post_id][0]) for post_id in comments_by_post]
+    )
+    newest_id = max(extract_lemmy_comment_data(comment)["id"] for comment in new_comments)
+    safe_position = (None, newest_id)
+    for post_id, comments in comments_by_post.items():
+        mapping = mapping_by_post[post_id]
+        mapping_scope_key = mapping_scope(mapping[0])
+        try:
+            submission = reddit.submission(id=mapping[1])
+        except Exception as e:
+            record_error("reddit_fetch")
+            print(f"Error fetching Reddit submission {mapping[1]}: {e}")
+            # Its comments are fetched again next cycle.
+            safe_position = min(safe_position, community_cursor)
+            continue
+        advance = sync_lemmy_thread_to_reddit(
+            index, submission, comments, mapping_scope_key, cursors.get(mapping_scope_key), outbox,
+            snapshot.lemmy_echoes(lemmy, mapping, comments)
+        )
+        if advance.blocked:
+            # Don't move the community cursor past a comment that still has to be retried.
+            stuck_at = advance.position or community_cursor
+            safe_position = min(safe_position, stuck_at)
+
+    if safe_position > community_cursor:
+        store.set_cursor(scope, LEMMY_TO_REDDIT, safe_position)
+
+def sync_lemmy_to_reddit(reddit, lemmy, outbox=None, mappings=None, community_ids=None, snapshot=None):
+    """
+    Runs the Lemmy-to-Reddit direction in the configured LEMMY_SYNC_MODE:
+    "community" (one paginated listing per community) or "per_post".
+    An empty `community_ids` (an instance that only has sync-only routes, see
+    routing.py) falls back to "per_post".
+    """
+    snapshot = snapshot or SyncSnapshot(reddit)
+    if community_ids is None:
+        community_ids = [config.LEMMY_COMMUNITY_ID]
+    if LEMMY_SYNC_MODE == "community" and community_ids:
+        for community_id in community_ids:
+            sync_lemmy_to_reddit_community(reddit, lemmy, community_id, outbox, mappings, snapshot)
+    else:
+        sync_lemmy_to_reddit_comments(reddit, lemmy, outbox, mappings, snapshot)
 
 if __name__ == "__main__":
     # Initialize clients.
     reddit = get_reddit_client()
     lemmy = LemmyClient()
-    lemmy.login()
+    lemmy.ensure_login()
+    start_metrics_server()
+    scheduler = PollScheduler() if POLL_SCHEDULER_ENABLED else None
+    snapshot = SyncSnapshot(reddit)
 
     while True:
         print("Starting bidirectional comment sync...")
-        sync_reddit_to_lemmy_comments(reddit, lemmy)
-        sync_lemmy_to_reddit_comments(reddit, lemmy)
+        with SYNC_CYCLE.time():
+            snapshot.start_cycle()
+            if scheduler is None:
+                if REDDIT_SYNC_MODE != "stream":
+                    sync_reddit_to_lemmy_comments(reddit, lemmy, snapshot=snapshot)
+                sync_lemmy_to_reddit(reddit, lemmy, snapshot=snapshot)
+            else:
+                due = scheduler.due()
+                before = scheduler.cursor_positions(due)
+                try:
+                    if REDDIT_SYNC_MODE != "stream":
+                        sync_reddit_to_lemmy_comments(reddit, lemmy, mappings=due, snapshot=snapshot)
+                    lemmy_mappings = scheduler.active_mappings() if LEMMY_SYNC_MODE == "community" else due
+                    sync_lemmy_to_reddit(reddit, lemmy, mappings=lemmy_mappings, snapshot=snapshot)
+                finally:
+                    scheduler.complete(due, before)
         print("Bidirectional sync complete. Waiting 60 seconds before next check...")
         time.sleep(60)
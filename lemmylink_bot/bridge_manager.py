@@ -2,24 +2,41 @@
 
 from lemmy_client import LemmyClient
 import config
-from mapping_db import insert_mapping
+from mapping_store import get_store
+from outbox import lemmy_post_job, reddit_reply_job, bridge_reply_text
+from bridged_posts import get_bridged_posts, lemmy_post_url
+from ratelimit import get_rate_limiter, HIGH
+from metrics import POSTS_CREATED, record_error
 
 class BridgeManager:
     """
     The BridgeManager encapsulates logic to 'bridge' a Reddit thread (post or comment) to Lemmy.
     It creates a new post on Lemmy when triggered and then replies on Reddit.
+    A thread is bridged once: later triggers in it reuse its Lemmy post.
     """
 
-    def __init__(self):
-        self.lemmy_client = LemmyClient()
-        self.lemmy_client.login()
-        print("BridgeManager: Logged in to Lemmy.")
+    def __init__(self, lemmy_client=None, outbox=None, route=None):
+        # A shared, already logged-in client can be passed in (see runtime.py).
+        if lemmy_client is None:
+            lemmy_client = LemmyClient()
+            lemmy_client.ensure_login()
+            print("BridgeManager: Logged in to Lemmy.")
+        self.lemmy_client = lemmy_client
+        self.store = get_store()
+        # With an Outbox, the Lemmy post and the Reddit reply are queued as durable
+        # jobs instead of being performed inline.
+        self.outbox = outbox
+        # The routing.Route this manager bridges for; None means the single
+        # subreddit/community pair from config.py.
+        self.route = route
+        self.bridged = get_bridged_posts()
 
     def handle_trigger(self, trigger):
         """
         Called when "LemmyLink!" is detected in a Reddit submission or comment.
         This function:
-         - Creates a corresponding post on Lemmy.
+         - Creates a corresponding post on Lemmy, unless the submission already
+           has one (then that post is reused).
          - Replies on Reddit with the Lemmy post link.
          - Stores a mapping between the Reddit submission and the Lemmy post.
         """
@@ -42,6 +59,58 @@ class BridgeManager:
             print("Unknown trigger type; skipping.")
             return
 
+        existing = self.bridged.lookup(submission.id)
+        if existing is None and self.outbox is None:
+            # Concurrent triggers in one thread: the first creates the post, the
+            # others wait here and then reuse it.
+            with self.bridged.single_flight(submission.id):
+                existing = self.bridged.lookup(submission.id)
+                if existing is None:
+                    self._create_post(trigger, submission, reddit_trigger_id, reddit_post_title, trigger_text)
+                    return
+        if existing is not None:
+            self._reply_with_existing(trigger, submission.id, reddit_trigger_id, existing)
+            return
+        self._create_post(trigger, submission, reddit_trigger_id, reddit_post_title, trigger_text)
+
+    def _reply_with_existing(self, trigger, reddit_submission_id, reddit_trigger_id, post):
+        """
+        Replies to a trigger in an already bridged thread with the existing Lemmy post link.
+        """
+        if post.reddit_trigger_id == reddit_trigger_id:
+            return  # the trigger that bridged the thread (e.g. replayed after a restart)
+        url = lemmy_post_url(post)
+        print(f"BridgeManager: Submission {reddit_submission_id} is already bridged as Lemmy post "
+              f"{post.lemmy_post_id}; reusing it for trigger {reddit_trigger_id}")
+        # A new trigger in a thread that went quiet: poll it again.
+        self.store.revive_mapping(reddit_submission_id)
+        if self.outbox is not None:
+            self.outbox.enqueue(reddit_reply_job(trigger.fullname, bridge_reply_text(url, existing=True)))
+            return
+        try:
+            with get_rate_limiter().priority(HIGH):
+                trigger.reply(bridge_reply_text(url, existing=True))
+            print(f"BridgeManager: Replied to trigger {reddit_trigger_id} with Lemmy link {url}")
+        except Exception as e:
+            record_error("bridge")
+            print(f"[ERROR] BridgeManager: Failed to reply on Reddit: {e}")
+
+    def _delete_duplicate(self, lemmy_post_id):
+        """
+        Deletes a Lemmy post that lost the race for a submission's mapping.
+        """
+        try:
+            self.lemmy_client.delete_post(lemmy_post_id)
+            print(f"BridgeManager: Deleted duplicate Lemmy post {lemmy_post_id}")
+        except Exception as e:
+            record_error("bridge")
+            print(f"[ERROR] BridgeManager: Failed to delete duplicate Lemmy post {lemmy_post_id}: {e}")
+
+    def _create_post(self, trigger, submission, reddit_trigger_id, reddit_post_title, trigger_text):
+        """
+        Creates the Lemmy post for a thread (or queues it), stores the mapping and
+        replies to the trigger with the link.
+        """
         # You can combine the post link and title into a single markdown link.
         post_link_line = f"**Original Reddit Post:** [{submission.title}]({submission.url or submission.shortlink})"
 
@@ -54,39 +123,64 @@ class BridgeManager:
             f"Link to Comment: https://www.reddit.com{trigger.permalink}"
         )
 
+        if self.route is not None and self.route.sync_only:
+            print(f"[WARN] BridgeManager: {self.route} has no community; "
+                  f"not creating a Lemmy post for trigger {reddit_trigger_id}")
+            return
+
         # Create the post on Lemmy.
-        community_id = config.LEMMY_COMMUNITY_ID
-        try:
-            post_response = self.lemmy_client.create_post(
-                community_id=community_id,
-                title=reddit_post_title,
-                body=body_text
+        community_id = self.route.community_id if self.route is not None else config.LEMMY_COMMUNITY_ID
+        subreddit = self.route.subreddit if self.route is not None else None
+        lemmy_instance = self.lemmy_client.base_url if self.route is not None else None
+        if self.outbox is not None:
+            job = lemmy_post_job(
+                submission.id, reddit_trigger_id, trigger.fullname, community_id, reddit_post_title, body_text,
+                subreddit, lemmy_instance
             )
-            print(f"BridgeManager: Lemmy post response: {post_response}")
-
-            # Extract the post ID (using your existing logic).
-            post_view = post_response.get("post_view", {})
-            post_data = post_view.get("post", {})
-            if post_data and "id" in post_data:
-                new_post_id = post_data["id"]
-                lemmy_post_url = f"{config.LEMMY_BASE_URL}/post/{new_post_id}"
-
-                # Store the mapping.
-                # Note: your mapping table has columns for reddit_submission_id and reddit_trigger_comment_id.
-                # For a submission trigger, you can store the submission id in both fields or set the trigger comment field to NULL.
-                mapping_id = insert_mapping(submission.id, reddit_trigger_id, new_post_id)
-                print(f"BridgeManager: Mapping record created with ID {mapping_id}")
-
-                # Reply on Reddit with the Lemmy post link.
-                reply_text = (
-                    "LemmyLink bot here!\n\n"
-                    f"I've created a corresponding post on Lemmy: {lemmy_post_url}\n\n"
-                    "Stay tuned for future updates (e.g., comment syncing)!"
+            if self.outbox.enqueue(job):
+                print(f"BridgeManager: Queued Lemmy post for trigger {reddit_trigger_id}")
+            return
+
+        try:
+            # Trigger replies may use the rate limiter's high-priority reserve.
+            with get_rate_limiter().priority(HIGH):
+                post_response = self.lemmy_client.create_post(
+                    community_id=community_id,
+                    title=reddit_post_title,
+                    body=body_text
                 )
-                trigger.reply(reply_text)
-                print(f"BridgeManager: Replied to trigger {reddit_trigger_id} with Lemmy link {lemmy_post_url}")
-            else:
-                print(f"[ERROR] BridgeManager: Could not find 'id' in Lemmy post response: {post_response}")
+                print(f"BridgeManager: Lemmy post response: {post_response}")
+
+                # Extract the post ID (using your existing logic).
+                post_view = post_response.get("post_view", {})
+                post_data = post_view.get("post", {})
+                if post_data and "id" in post_data:
+                    new_post_id = post_data["id"]
+                    POSTS_CREATED.inc()
+
+                    # Store the mapping.
+                    # Note: your mapping table has columns for reddit_submission_id and reddit_trigger_comment_id.
+                    # For a submission trigger, you can store the submission id in both fields or set the trigger comment field to NULL.
+                    mapping_id = self.store.insert_mapping(
+                        submission.id, reddit_trigger_id, new_post_id, subreddit, lemmy_instance
+                    )
+                    print(f"BridgeManager: Mapping record created with ID {mapping_id}")
+                    # Another process may have mapped the submission first; link to its post.
+                    post = self.bridged.lookup(submission.id)
+                    if post.lemmy_post_id != new_post_id:
+                        print(f"[WARN] BridgeManager: Submission {submission.id} was bridged concurrently as "
+                              f"Lemmy post {post.lemmy_post_id}; deleting duplicate post {new_post_id}.")
+                        self._delete_duplicate(new_post_id)
+                        self.store.revive_mapping(submission.id)
+                    url = lemmy_post_url(post)
+
+                    # Reply on Reddit with the Lemmy post link.
+                    trigger.reply(bridge_reply_text(url))
+                    print(f"BridgeManager: Replied to trigger {reddit_trigger_id} with Lemmy link {url}")
+                else:
+                    record_error("bridge")
+                    print(f"[ERROR] BridgeManager: Could not find 'id' in Lemmy post response: {post_response}")
 
         except Exception as e:
+            record_error("bridge")
             print(f"[ERROR] BridgeManager: Failed to create Lemmy post or reply on Reddit: {e}")
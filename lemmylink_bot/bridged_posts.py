@@ -0,0 +1,96 @@
+# bridged_posts.py
+#
+# Process-wide view of which Reddit submissions are already bridged, so repeated
+# triggers in one thread reuse its Lemmy post instead of creating another one.
+# Lookups hit an in-memory dict first and fall back to the mapping table's unique
+# index on reddit_submission_id; hits are cached (a submission's post never
+# changes), misses are not (triggers are rare).
+#
+# Concurrent triggers for the same submission are coalesced with a
+# per-submission lock ("single flight"): the first one creates the post while the
+# others wait, then find it and only reply with its link. Across processes the
+# UNIQUE constraint keeps the mapping table to one row per submission.
+
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+import config
+from mapping_store import get_store
+
+BridgedPost = namedtuple("BridgedPost", ["lemmy_post_id", "lemmy_instance", "reddit_trigger_id"])
+
+def bridged_post_of(mapping):
+    """
+    Returns the BridgedPost of a mapping row.
+    """
+    return BridgedPost(mapping[3], mapping[6], mapping[2])
+
+def lemmy_post_url(post):
+    """
+    Returns the URL of a BridgedPost on its Lemmy instance.
+    """
+    return f"{(post.lemmy_instance or config.LEMMY_BASE_URL).rstrip('/')}/post/{post.lemmy_post_id}"
+
+class BridgedPosts:
+    """
+    reddit_submission_id -> BridgedPost cache with per-submission single-flight locks.
+    """
+
+    def __init__(self, store=None):
+        self.store = store or get_store()
+        self._lock = threading.Lock()
+        self._posts = {}
+        self._flights = {}  # reddit_submission_id -> [lock, number of holders and waiters]
+
+    def lookup(self, reddit_submission_id):
+        """
+        Returns the BridgedPost of a submission, or None if it isn't bridged.
+        """
+        with self._lock:
+            post = self._posts.get(reddit_submission_id)
+        if post is not None:
+            return post
+        mappings = self.store.get_mapping_by_reddit_submission(reddit_submission_id)
+        if not mappings:
+            return None
+        return self.remember(reddit_submission_id, mappings[0])
+
+    def remember(self, reddit_submission_id, mapping):
+        """
+        Caches a submission's mapping row and returns its BridgedPost.
+        """
+        post = bridged_post_of(mapping)
+        with self._lock:
+            return self._posts.setdefault(reddit_submission_id, post)
+
+    @contextmanager
+    def single_flight(self, reddit_submission_id):
+        """
+        Holds the submission's lock; concurrent callers for the same submission
+        run one at a time.
+        """
+        with self._lock:
+            flight = self._flights.setdefault(reddit_submission_id, [threading.Lock(), 0])
+            flight[1] += 1
+        try:
+            with flight[0]:
+                yield
+        finally:
+            with self._lock:
+                flight[1] -= 1
+                if flight[1] == 0:
+                    del self._flights[reddit_submission_id]
+
+_bridged_posts = None
+_bridged_posts_lock = threading.Lock()
+
+def get_bridged_posts():
+    """
+    Returns the process-wide BridgedPosts.
+    """
+    global _bridged_posts
+    with _bridged_posts_lock:
+        if _bridged_posts is None:
+            _bridged_posts = BridgedPosts(get_store())
+        return _bridged_posts
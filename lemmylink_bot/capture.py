@@ -0,0 +1,166 @@
+# capture.py
+#
+# Traffic capture for offline load tests. With CAPTURE_FILE set (or the
+# LEMMYLINK_CAPTURE environment variable, per process) the bot appends every
+# stream item it handles and every Lemmy/Reddit API response it receives to a
+# gzip-compressed JSON Lines file, one event per line:
+#
+#   {"t": <unix time>, "type": "submission" | "comment", "id": ..., ...item fields}
+#   {"t": ..., "type": "lemmy" | "reddit", "method": ..., "path": ..., "params": ...,
+#    "status": ..., "latency": ..., "body": <response JSON or null>}
+#
+# benchmarks/replay.py feeds such a recording back through the bot against local
+# stand-ins. Each process start appends a new gzip member; gzip readers read the
+# members as one stream. Lines are flushed every CAPTURE_FLUSH_INTERVAL seconds,
+# so a crash loses at most that much (and leaves a truncated last line, which
+# read_events() skips). Login requests are recorded without bodies so no
+# password or token ends up in the file.
+
+import atexit
+import gzip
+import json
+import os
+import threading
+import time
+
+import config
+
+CAPTURE_FILE = os.environ.get("LEMMYLINK_CAPTURE") or getattr(config, "CAPTURE_FILE", None)
+# Reddit comment trees can be large; set to False to record only status and latency.
+CAPTURE_REDDIT_BODIES = getattr(config, "CAPTURE_REDDIT_BODIES", True)
+CAPTURE_FLUSH_INTERVAL = getattr(config, "CAPTURE_FLUSH_INTERVAL", 5)
+
+SUBMISSION = "submission"
+COMMENT = "comment"
+LEMMY = "lemmy"
+REDDIT = "reddit"
+
+# Paths whose request and response bodies carry credentials.
+REDACTED_PATHS = ("/api/v3/user/login", "/api/v1/access_token")
+
+def _author(item):
+    return item.author.name if item.author is not None else None
+
+def submission_event(submission):
+    """
+    Returns the recorded fields of a Reddit submission.
+    """
+    return {
+        "id": submission.id,
+        "fullname": submission.fullname,
+        "subreddit": submission.subreddit.display_name,
+        "author": _author(submission),
+        "title": submission.title,
+        "selftext": submission.selftext,
+        "url": submission.url,
+        "permalink": submission.permalink,
+        "created_utc": submission.created_utc,
+    }
+
+def comment_event(comment):
+    """
+    Returns the recorded fields of a Reddit comment.
+    """
+    return {
+        "id": comment.id,
+        "fullname": comment.fullname,
+        "subreddit": comment.subreddit.display_name,
+        "link_id": comment.link_id,
+        "parent_id": comment.parent_id,
+        "author": _author(comment),
+        "body": comment.body,
+        "permalink": comment.permalink,
+        "created_utc": comment.created_utc,
+    }
+
+class Recorder:
+    """
+    Appends events to a gzip JSON Lines file. Thread-safe.
+    """
+
+    def __init__(self, path, flush_interval=CAPTURE_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, "at", encoding="utf-8")
+        self._last_flush = time.monotonic()
+
+    def record(self, event_type, **fields):
+        line = json.dumps({"t": time.time(), "type": event_type, **fields}, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            now = time.monotonic()
+            if now - self._last_flush >= self.flush_interval:
+                self._file.flush()
+                self._last_flush = now
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+def get_recorder():
+    """
+    Returns the process-wide Recorder, or None when capture is off.
+    """
+    global _recorder
+    if not CAPTURE_FILE:
+        return None
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = Recorder(CAPTURE_FILE)
+            # Closing writes the gzip trailer; without it the member reads as truncated.
+            atexit.register(_recorder.close)
+            print(f"Capture: recording stream items and API responses to {CAPTURE_FILE}")
+            # The bot's own accounts, so a replay can tell its comments from everyone else's.
+            _recorder.record(
+                "start", reddit_username=getattr(config, "REDDIT_USERNAME", None),
+                lemmy_username=getattr(config, "LEMMY_USERNAME", None)
+            )
+        return _recorder
+
+def record_item(kind, item):
+    """
+    Records a stream item ("submission" or "comment") if capture is on.
+    """
+    recorder = get_recorder()
+    if recorder is None:
+        return
+    recorder.record(kind, **(submission_event(item) if kind == SUBMISSION else comment_event(item)))
+
+def record_response(api, method, path, status, latency, response=None, params=None, payload=None, body=True):
+    """
+    Records an API response if capture is on. The body is taken from `payload`
+    (already decoded) or else from `response`, a requests.Response; pass
+    body=False to record only status and latency.
+    """
+    recorder = get_recorder()
+    if recorder is None:
+        return
+    if not body or path in REDACTED_PATHS:
+        payload = None
+    elif payload is None and response is not None:
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = None
+    recorder.record(
+        api, method=method, path=path, params=params, status=status, latency=round(latency, 6), body=payload
+    )
+
+def read_events(path):
+    """
+    Yields the events of a recording in file order, skipping a truncated last line.
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        try:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+        except EOFError:
+            # The last gzip member was cut off by a crash.
+            return
@@ -0,0 +1,117 @@
+# comment_tree.py
+#
+# Breadth-first walk of a Reddit comment tree that follows "load more comments"
+# links within a budget, instead of replace_more(limit=0) + list(), which drops
+# every such branch and materializes the whole flattened tree at once.
+#
+# Comments are handed out in batches: first the ones that came with the
+# submission, then one batch per expanded branch, so only one batch is alive at a
+# time. Branches that don't fit into this cycle's budget are stored as plain IDs
+# (parent ID, child IDs, count) in the comment_branch table and expanded on later
+# cycles, least recently expanded first, so every branch is eventually synced.
+
+import heapq
+import time
+from collections import deque, namedtuple
+
+from praw.models import MoreComments
+
+import config
+from mapping_store import get_store
+
+# "Load more" branches expanded per thread per cycle (one API request each).
+MORE_COMMENTS_BUDGET = getattr(config, "REDDIT_MORE_COMMENTS_BUDGET", 4)
+# An already expanded branch is expanded again (to catch new replies inside it)
+# after this many seconds; never-expanded branches always come first.
+MORE_COMMENTS_REFRESH = getattr(config, "REDDIT_MORE_COMMENTS_REFRESH", 3600)
+
+Branch = namedtuple("Branch", ["key", "parent_id", "children", "count", "expanded_at"])
+
+def branch_of(more):
+    """
+    Returns the Branch (IDs only) of a MoreComments object. "Continue this
+    thread" links have no children and are keyed by their parent.
+    """
+    children = list(more.children)
+    key = f"{more.parent_id}:{children[0] if children else '_'}"
+    return Branch(key, more.parent_id, children, more.count, None)
+
+def more_comments(reddit, submission, branch):
+    """
+    Rebuilds a MoreComments object from a stored Branch.
+    """
+    more = MoreComments(reddit, {
+        "parent_id": branch.parent_id,
+        "children": list(branch.children),
+        "count": branch.count,
+        "id": branch.children[0] if branch.children else "_",
+    })
+    more.submission = submission
+    return more
+
+def _breadth_first(items, branches):
+    """
+    Walks Comments and MoreComments breadth-first and returns the comments.
+    MoreComments are not expanded but recorded in `branches` by key.
+    """
+    comments = []
+    queue = deque(items)
+    while queue:
+        item = queue.popleft()
+        if isinstance(item, MoreComments):
+            branch = branch_of(item)
+            branches.setdefault(branch.key, branch)
+            continue
+        comments.append(item)
+        queue.extend(item.replies)
+    return comments
+
+def walk_comment_tree(reddit, submission, scope, budget=MORE_COMMENTS_BUDGET, store=None):
+    """
+    Yields (comments, branch) batches for a submission: first the comments loaded
+    with it (branch None), then the comments of up to `budget` expanded "load
+    more" branches. `scope` keys the stored branches (the mapping's cursor scope).
+    Newly seen and expanded branches are saved when the walk ends.
+    """
+    store = store or get_store()
+    now = time.time()
+    known = {row[0]: Branch(*row) for row in store.get_comment_branches(scope)}
+    discovered = {}
+    expanded = {}
+    try:
+        yield _breadth_first(submission.comments, discovered), None
+
+        heap = []
+        queued = set()
+
+        def push(branch):
+            expanded_at = known[branch.key].expanded_at if branch.key in known else None
+            if branch.key in queued:
+                return
+            if expanded_at is not None and now - expanded_at < MORE_COMMENTS_REFRESH:
+                return
+            queued.add(branch.key)
+            heapq.heappush(heap, (expanded_at or 0, -branch.count, branch.key, branch))
+
+        for branch in list(known.values()) + list(discovered.values()):
+            push(branch)
+
+        while heap and budget > 0:
+            _, _, _, branch = heapq.heappop(heap)
+            budget -= 1
+            try:
+                items = more_comments(reddit, submission, branch).comments()
+            except Exception as e:
+                print(f"Error expanding Reddit comment branch {branch.key} of {submission.id}: {e}")
+                break
+            found = {}
+            comments = _breadth_first(items, found)
+            expanded[branch.key] = branch._replace(expanded_at=now)
+            for nested in found.values():
+                discovered.setdefault(nested.key, nested)
+                push(nested)
+            yield comments, branch
+    finally:
+        updates = dict(discovered)
+        updates.update(expanded)
+        store.save_comment_branches(scope, updates.values())
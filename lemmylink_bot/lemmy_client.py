@@ -1,47 +1,253 @@
 # lemmy_client.py
 
+import base64
+import json
+import random
+import threading
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
 import config
+from ratelimit import get_rate_limiter
+from metrics import LEMMY_API_LATENCY
+from mapping_store import get_store
+from capture import CAPTURE_FILE, LEMMY, record_response
+
+# Comment listing defaults (Lemmy caps `limit` at 50 per page).
+COMMENT_PAGE_SIZE = getattr(config, "LEMMY_COMMENT_PAGE_SIZE", 50)
+COMMENT_SORT = getattr(config, "LEMMY_COMMENT_SORT", "New")
+COMMENT_MAX_DEPTH = getattr(config, "LEMMY_COMMENT_MAX_DEPTH", None)
+
+# HTTP status codes that are worth retrying: rate limiting and transient server errors.
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Persist the login JWT in the mapping DB so restarts reuse it instead of logging in
+# again; a cached token is dropped this many seconds before its `exp` claim.
+TOKEN_CACHE_ENABLED = getattr(config, "LEMMY_TOKEN_CACHE", True)
+TOKEN_REFRESH_MARGIN = 300
+
+def comment_list_params(page, post_id=None, community_id=None, sort=COMMENT_SORT, limit=COMMENT_PAGE_SIZE,
+                        max_depth=COMMENT_MAX_DEPTH):
+    """
+    Returns the query parameters for one page of /api/v3/comment/list.
+    """
+    params = {"sort": sort, "limit": limit, "page": page, "type_": "All"}
+    if post_id is not None:
+        params["post_id"] = post_id
+    if community_id is not None:
+        params["community_id"] = community_id
+    if max_depth is not None:
+        params["max_depth"] = max_depth
+    return params
+
+def comment_page(comments, stop_at_id, limit):
+    """
+    Cuts a /api/v3/comment/list page at the first comment with an ID of
+    `stop_at_id` or lower. Returns (comments before it, whether this was the
+    last page to fetch).
+    """
+    for position, comment in enumerate(comments):
+        comment_id = comment.get("comment_view", comment).get("comment", {}).get("id")
+        if stop_at_id is not None and comment_id is not None and comment_id <= stop_at_id:
+            return comments[:position], True
+    return comments, len(comments) < limit
+
+def jwt_expiry(token):
+    """
+    Returns the `exp` claim of a JWT (epoch seconds), or None if the token has no
+    expiry or cannot be decoded. The signature is not checked.
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+        return float(exp) if exp is not None else None
+    except (IndexError, ValueError, TypeError, AttributeError):
+        return None
+
+def token_is_fresh(expires_at):
+    return expires_at is None or expires_at - TOKEN_REFRESH_MARGIN > time.time()
 
 class LemmyClient:
-    def __init__(self):
-        self.base_url = config.LEMMY_BASE_URL
-        self.username = config.LEMMY_USERNAME
-        self.password = config.LEMMY_PASSWORD
+    def __init__(self, base_url=None, username=None, password=None):
+        # Defaults to the instance and account from config.py; routes on other
+        # instances pass their own (see routing.py).
+        self.base_url = base_url or config.LEMMY_BASE_URL
+        self.username = username or config.LEMMY_USERNAME
+        self.password = password or config.LEMMY_PASSWORD
         self.jwt_token = None  # Will store the auth token after login
+        self.jwt_expires_at = None
+        self._login_lock = threading.Lock()
+
+        # Connection pool / retry settings (all optional in config.py).
+        self.pool_size = getattr(config, "LEMMY_POOL_SIZE", 10)
+        self.timeout = getattr(config, "LEMMY_TIMEOUT", (5, 30))  # (connect, read) seconds
+        self.max_retries = getattr(config, "LEMMY_MAX_RETRIES", 3)
+        self.backoff_base = getattr(config, "LEMMY_BACKOFF_BASE", 0.5)
+        self.backoff_max = getattr(config, "LEMMY_BACKOFF_MAX", 30.0)
+
+        # One long-lived session so every call reuses keep-alive sockets from the pool
+        # instead of doing a fresh TCP+TLS handshake.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # Latency of the most recent request (seconds) and an optional callback
+        # invoked as on_request(method, path, status_code, latency) after every attempt.
+        self.last_latency = None
+        self.on_request = None
+
+        # Shared token buckets (see ratelimit.py).
+        self.rate_limiter = get_rate_limiter()
+
+    def close(self):
+        """
+        Closes the pooled HTTP session.
+        """
+        self.session.close()
+
+    def _auth_headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.jwt_token}"}
+
+    def _backoff_delay(self, attempt: int, response=None) -> float:
+        """
+        Returns how long to sleep before retry number `attempt` (starting at 1).
+        Honors a numeric Retry-After header, otherwise uses full-jitter exponential backoff.
+        """
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), self.backoff_max)
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+    @staticmethod
+    def _rate_limit_kind(method: str, path: str) -> str:
+        if path == "/api/v3/user/login":
+            return "login"
+        return "read" if method == "GET" else "write"
+
+    def _request(self, method: str, path: str, auth: bool = False, **kwargs):
+        """
+        Sends a request, with the JWT attached if `auth` is set. A missing token is
+        obtained first (see ensure_login), and if Lemmy rejects the token with a 401
+        the client logs in again once and replays the request.
+        """
+        if not auth:
+            return self._send(method, path, **kwargs)
+        self.ensure_login()
+        token = self.jwt_token
+        response = self._send(method, path, headers=self._auth_headers(), **kwargs)
+        if response.status_code == 401:
+            print("LemmyClient: JWT rejected (401); logging in again.")
+            self._relogin(token)
+            response = self._send(method, path, headers=self._auth_headers(), **kwargs)
+        return response
+
+    def _send(self, method: str, path: str, **kwargs):
+        """
+        Sends a request through the pooled session, retrying on connection errors,
+        429 and 5xx responses with jittered exponential backoff. Every attempt first
+        takes a token from the shared rate limiter and reports the response back to it.
+        Returns the final requests.Response (raise_for_status is left to the caller).
+        """
+        url = f"{self.base_url}{path}"
+        kwargs.setdefault("timeout", self.timeout)
+        kind = self._rate_limit_kind(method, path)
+        endpoint = f"{method} {path}"
+        attempt = 0
+        while True:
+            attempt += 1
+            self.rate_limiter.acquire("lemmy", kind, endpoint=endpoint)
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self._record_latency(method, path, None, time.monotonic() - start)
+                if attempt > self.max_retries:
+                    raise
+                time.sleep(self._backoff_delay(attempt))
+                continue
+
+            latency = time.monotonic() - start
+            self._record_latency(method, path, response.status_code, latency)
+            if CAPTURE_FILE:
+                record_response(LEMMY, method, path, response.status_code, latency, response, kwargs.get("params"))
+            self.rate_limiter.observe("lemmy", kind, response.status_code, response.headers, endpoint)
+            if response.status_code in RETRY_STATUS_CODES and attempt <= self.max_retries:
+                # On 429 the limiter has already paused the bucket for Retry-After.
+                if response.status_code != 429:
+                    time.sleep(self._backoff_delay(attempt, response))
+                continue
+            return response
+
+    def _record_latency(self, method, path, status_code, latency):
+        self.last_latency = latency
+        LEMMY_API_LATENCY.observe(latency, method=method, endpoint=path, status=status_code or "error")
+        if self.on_request is not None:
+            self.on_request(method, path, status_code, latency)
+
+    def _load_cached_token(self) -> bool:
+        if not TOKEN_CACHE_ENABLED:
+            return False
+        cached = get_store().get_auth_token(self.base_url, self.username)
+        if cached is None or not token_is_fresh(cached[1]):
+            return False
+        self.jwt_token, self.jwt_expires_at = cached
+        return True
+
+    def ensure_login(self):
+        """
+        Makes sure a usable JWT is loaded: reuses the in-memory or cached token while
+        it is fresh and only calls /api/v3/user/login when there is none.
+        """
+        with self._login_lock:
+            if self.jwt_token and token_is_fresh(self.jwt_expires_at):
+                return
+            if self._load_cached_token():
+                print("LemmyClient: Reusing cached Lemmy login.")
+                return
+            self.login()
+
+    def _relogin(self, stale_token):
+        with self._login_lock:
+            # Another thread may already have replaced the rejected token.
+            if self.jwt_token != stale_token:
+                return
+            if TOKEN_CACHE_ENABLED:
+                get_store().delete_auth_token(self.base_url, self.username)
+            self.login()
 
     def login(self):
         """
-        Logs into Lemmy with the username/password from config and stores the JWT token.
+        Logs into Lemmy with the username/password from config and stores the JWT token
+        (in memory and, unless LEMMY_TOKEN_CACHE is off, in the mapping DB).
         """
-        login_endpoint = f"{self.base_url}/api/v3/user/login"
         payload = {
             "username_or_email": self.username,
             "password": self.password
         }
 
         try:
-            response = requests.post(login_endpoint, json=payload)
+            response = self._request("POST", "/api/v3/user/login", json=payload)
             response.raise_for_status()
             json_data = response.json()
 
             # Lemmy returns: { "jwt": "<token>" } on success
             self.jwt_token = json_data["jwt"]
+            self.jwt_expires_at = jwt_expiry(self.jwt_token)
         except Exception as e:
             raise RuntimeError(f"Failed to login to Lemmy: {e}")
+        if TOKEN_CACHE_ENABLED:
+            get_store().set_auth_token(self.base_url, self.username, self.jwt_token, self.jwt_expires_at)
 
     def create_post(self, community_id: int, title: str, body: str = "") -> dict:
         """
         Creates a new post in Lemmy under the given community_id with the provided title and body.
         Returns the JSON response from Lemmy, which includes the post link/ID.
         """
-        if not self.jwt_token:
-            raise RuntimeError("No JWT token found. Call login() first.")
-
-        create_post_endpoint = f"{self.base_url}/api/v3/post"
-        headers = {
-            "Authorization": f"Bearer {self.jwt_token}"
-        }
         payload = {
             "community_id": community_id,
             "name": title,
@@ -49,12 +255,21 @@ class LemmyClient:
         }
 
         try:
-            response = requests.post(create_post_endpoint, json=payload, headers=headers)
+            response = self._request("POST", "/api/v3/post", json=payload, auth=True)
             response.raise_for_status()
             return response.json()  # Should contain "post": {...}
         except Exception as e:
             raise RuntimeError(f"Failed to create post on Lemmy: {e}")
 
+    def delete_post(self, post_id: int) -> dict:
+        """
+        Deletes one of the bot's posts (e.g. a duplicate from a lost race).
+        Returns the JSON response from Lemmy.
+        """
+        response = self._request("POST", "/api/v3/post/delete", json={"post_id": post_id, "deleted": True}, auth=True)
+        response.raise_for_status()
+        return response.json()
+
     def create_comment(self, post_id: int, content: str, parent_id: int = None) -> dict:
         """
         Creates a comment on a Lemmy post.
@@ -65,8 +280,6 @@ class LemmyClient:
         Returns:
             dict: The JSON response from the Lemmy API.
         """
-        create_comment_endpoint = f"{self.base_url}/api/v3/comment"
-        headers = {"Authorization": f"Bearer {self.jwt_token}"}
         payload = {
             "post_id": post_id,
             "content": content,
@@ -74,7 +287,7 @@ class LemmyClient:
         if parent_id is not None:
             payload["parent_id"] = parent_id
 
-        response = requests.post(create_comment_endpoint, json=payload, headers=headers)
+        response = self._request("POST", "/api/v3/comment", json=payload, auth=True)
         response.raise_for_status()
         return response.json()
 
@@ -83,13 +296,50 @@ class LemmyClient:
         Retrieves comments for a given Lemmy post.
         Returns a list of comment dicts. If the post isn't found, returns an empty list.
         """
-        get_comments_endpoint = f"{self.base_url}/api/v3/post/comments"
         params = {"post_id": post_id}
-        headers = {"Authorization": f"Bearer {self.jwt_token}"}
-        response = requests.get(get_comments_endpoint, params=params, headers=headers)
+        response = self._request("GET", "/api/v3/post/comments", params=params, auth=True)
         if response.status_code == 404:
             print(f"Warning: Post {post_id} not found on Lemmy (404 returned).")
             return []
         response.raise_for_status()
         json_data = response.json()
         return json_data.get("comments", [])
+
+    def iter_comment_pages(self, post_id: int = None, sort: str = COMMENT_SORT, limit: int = COMMENT_PAGE_SIZE,
+                           max_depth: int = COMMENT_MAX_DEPTH, stop_at_id: int = None, community_id: int = None):
+        """
+        Yields /api/v3/comment/list results one page (a non-empty list) at a time,
+        so large threads are never truncated to one page or held in memory at once.
+        Args:
+            post_id (int, optional): List the comments of this Lemmy post.
+            sort (str): Lemmy comment sort ("New", "Old", "Hot", "Top").
+            limit (int): Comments per page.
+            max_depth (int, optional): Maximum reply depth to return.
+            stop_at_id (int, optional): With sort="New", stop as soon as a comment with
+                this ID or lower is reached (i.e. everything newer than a known ID).
+            community_id (int, optional): List comments across a whole community instead.
+        Yields:
+            list: The comment entries of one page, as returned by Lemmy.
+        """
+        page = 1
+        while True:
+            params = comment_list_params(page, post_id, community_id, sort, limit, max_depth)
+            response = self._request("GET", "/api/v3/comment/list", params=params, auth=True)
+            if response.status_code == 404:
+                print(f"Warning: Post {post_id} / community {community_id} not found on Lemmy (404 returned).")
+                return
+            response.raise_for_status()
+            comments, last = comment_page(response.json().get("comments", []), stop_at_id, limit)
+            if comments:
+                yield comments
+            if last:
+                return
+            page += 1
+
+    def iter_comments(self, post_id: int = None, sort: str = COMMENT_SORT, limit: int = COMMENT_PAGE_SIZE,
+                      max_depth: int = COMMENT_MAX_DEPTH, stop_at_id: int = None, community_id: int = None):
+        """
+        Yields the comments of iter_comment_pages() one at a time.
+        """
+        for page in self.iter_comment_pages(post_id, sort, limit, max_depth, stop_at_id, community_id):
+            yield from page
@@ -1,9 +1,73 @@
 # main.py
 
+import threading
+
 from reddit_client import get_reddit_client
 from bridge_manager import BridgeManager
+from trigger_matcher import get_trigger_matcher
+from metrics import TRIGGERS, record_error, start_metrics_server
+from stream_checkpoint import checkpointed_stream, SUBMISSIONS, COMMENTS
+from capture import CAPTURE_FILE, SUBMISSION, COMMENT, record_item
 import config
 
+def watch_submissions(subreddit, bridge_manager, stop_event=None):
+    """
+    Monitors new submissions (posts) in the subreddit for trigger phrases
+    (see trigger_matcher.py), resuming from the last checkpoint (see
+    stream_checkpoint.py). Returns once stop_event is set.
+    """
+    matcher = get_trigger_matcher()
+    # The stream yields None between polls so the stop event is checked regularly.
+    # A RouteDispatcher handles triggers on its worker threads; the checkpoint
+    # waits for them (see stream_checkpoint.py).
+    progress = getattr(bridge_manager, "progress", {}).get(SUBMISSIONS)
+    for submission in checkpointed_stream(subreddit, SUBMISSIONS, progress=progress):
+        if stop_event is not None and stop_event.is_set():
+            return
+        if submission is None:
+            continue
+        if CAPTURE_FILE:
+            record_item(SUBMISSION, submission)
+        # Check if a trigger phrase is in the post title or body
+        match = matcher.match_submission(submission)
+        if match is not None:
+            TRIGGERS.inc(source="submission")
+            print(f"[DEBUG] Trigger '{match.phrase}' found in post {submission.id} {match.field} "
+                  f"at {match.start} by {submission.author}")
+            bridge_manager.handle_trigger(submission)
+
+def watch_comments(subreddit, bridge_manager, forwarder=None, stop_event=None):
+    """
+    Monitors new comments in the subreddit for trigger phrases. If a
+    RedditCommentForwarder is given, every other comment is offered to it so the
+    same stream also drives Reddit-to-Lemmy comment sync.
+    """
+    matcher = get_trigger_matcher()
+    if forwarder is not None:
+        forwarder.refresh_mappings(force=True)
+    progress = getattr(bridge_manager, "progress", {}).get(COMMENTS)
+    for comment in checkpointed_stream(subreddit, COMMENTS, progress=progress):
+        if stop_event is not None and stop_event.is_set():
+            return
+        if forwarder is not None:
+            forwarder.refresh_mappings()
+        if comment is None:
+            continue
+        if CAPTURE_FILE:
+            record_item(COMMENT, comment)
+        # If a trigger phrase is in the comment body
+        match = matcher.match_comment(comment)
+        if match is not None:
+            TRIGGERS.inc(source="comment")
+            print(f"[DEBUG] Trigger '{match.phrase}' found in comment {comment.id} at {match.start} by {comment.author}")
+            bridge_manager.handle_trigger(comment)
+        elif forwarder is not None:
+            try:
+                forwarder.handle(comment)
+            except Exception as e:
+                record_error("forward")
+                print(f"Error forwarding Reddit comment {comment.id}: {e}")
+
 def main():
     # Initialize Reddit
     reddit = get_reddit_client()
@@ -14,21 +78,15 @@ def main():
 
     # Initialize BridgeManager (which logs into Lemmy)
     bridge_manager = BridgeManager()
+    start_metrics_server()
 
-    # Monitor new submissions (posts) in the subreddit
-    for submission in subreddit.stream.submissions(skip_existing=True):
-        # Check if the trigger phrase is in the post title or body
-        if "LemmyLink!" in submission.title or "LemmyLink!" in submission.selftext:
-            print(f"[DEBUG] Trigger found in post {submission.id} by {submission.author}")
-            bridge_manager.handle_trigger(submission)
-
-    # Use PRAW's streaming feature to get new comments as they appear
-    for comment in subreddit.stream.comments(skip_existing=True):
-        # If the trigger phrase is in the comment body (case-sensitive)
-        if "LemmyLink!" in comment.body:
-            print(f"[DEBUG] Trigger phrase found in comment {comment.id} by {comment.author}")
-            bridge_manager.handle_trigger(comment)
+    # Both streams block, so run the submission stream in its own thread;
+    # otherwise the comment stream below would never be reached.
+    submissions_thread = threading.Thread(
+        target=watch_submissions, args=(subreddit, bridge_manager), daemon=True
+    )
+    submissions_thread.start()
+    watch_comments(subreddit, bridge_manager)
 
 if __name__ == "__main__":
     main()
-    
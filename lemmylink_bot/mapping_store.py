@@ -0,0 +1,660 @@
+# mapping_store.py
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import SQLITE_LATENCY
+from migrations import migrate
+from reddit_ids import reddit_id_to_int, int_to_reddit_id, encode_reddit_id, decode_reddit_id
+
+# The database file will be created in the same directory as this file, unless the
+# LEMMYLINK_DB environment variable points elsewhere (e.g. for benchmarks).
+DATABASE_FILE = os.environ.get("LEMMYLINK_DB") or os.path.join(os.path.dirname(__file__), "mapping.db")
+
+# Max bound parameters per IN (...) query; stays under SQLITE_MAX_VARIABLE_NUMBER
+# on older SQLite builds (999).
+IN_CHUNK_SIZE = 500
+
+# poll_state.next_poll_at of a mapping held from the comment sync (see "Poll schedule").
+HELD = -1
+
+# Pragmas applied to every connection. WAL lets the trigger listener and the sync
+# loop read while the other writes, and synchronous=NORMAL is durable in WAL mode
+# except for the last transactions before a power loss.
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 10000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",  # ~16 MB page cache
+    "PRAGMA mmap_size = 67108864",  # 64 MB
+)
+
+class MappingStore:
+    """
+    Holds one long-lived SQLite connection for the whole process and exposes all
+    post/comment mapping queries. The connection is shared between threads and
+    guarded by a lock; other processes coordinate through SQLite's WAL locking.
+    """
+
+    def __init__(self, database_file=DATABASE_FILE):
+        self.database_file = database_file
+        self._lock = threading.RLock()
+        # isolation_level=None: we issue BEGIN/COMMIT ourselves (see transaction()).
+        self.conn = sqlite3.connect(
+            database_file,
+            timeout=10,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        for pragma in PRAGMAS:
+            self.conn.execute(pragma)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs the enclosed statements in one write transaction and yields the connection.
+        BEGIN IMMEDIATE takes the write lock up front, so two processes never deadlock
+        trying to upgrade a read lock.
+        """
+        with self._lock:
+            start = time.perf_counter()
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            SQLITE_LATENCY.observe(time.perf_counter() - start, operation="transaction")
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            start = time.perf_counter()
+            rows = self.conn.execute(sql, params).fetchall()
+            SQLITE_LATENCY.observe(time.perf_counter() - start, operation="query")
+            return rows
+
+    def _query_one(self, sql, params=()):
+        with self._lock:
+            start = time.perf_counter()
+            row = self.conn.execute(sql, params).fetchone()
+            SQLITE_LATENCY.observe(time.perf_counter() - start, operation="query")
+            return row
+
+    def create_tables(self):
+        """
+        Brings the schema up to date by applying any pending migrations (see migrations.py).
+        """
+        with self._lock:
+            migrate(self.conn)
+
+    # --- Post mappings -------------------------------------------------------
+    # Reddit IDs are stored as integers (see reddit_ids.py); rows are returned with
+    # them decoded back to base36 strings.
+
+    @staticmethod
+    def _mapping_row(row):
+        return (row[0], int_to_reddit_id(row[1]), decode_reddit_id(row[2])) + tuple(row[3:])
+
+    @staticmethod
+    def _insert_mapping(conn, reddit_submission_id, reddit_trigger_comment_id, lemmy_post_id,
+                        subreddit=None, lemmy_instance=None, held=False):
+        submission_key = reddit_id_to_int(reddit_submission_id)
+        cur = conn.execute(
+            """
+            INSERT INTO mapping (reddit_submission_id, reddit_trigger_comment_id, lemmy_post_id, subreddit, lemmy_instance)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (reddit_submission_id) DO NOTHING
+            """,
+            (submission_key, encode_reddit_id(reddit_trigger_comment_id), lemmy_post_id, subreddit, lemmy_instance),
+        )
+        if cur.rowcount == 0:
+            return conn.execute("SELECT id FROM mapping WHERE reddit_submission_id = ?", (submission_key,)).fetchone()[0]
+        conn.execute(
+            "INSERT INTO poll_state (mapping_id, next_poll_at, last_activity_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (mapping_id) DO NOTHING",
+            (cur.lastrowid, HELD if held else 0, time.time()),
+        )
+        return cur.lastrowid
+
+    @staticmethod
+    def _revive_mapping(conn, reddit_submission_id):
+        # next_poll_at = 0 marks the row as not yet scheduled, like a new
+        # mapping's, so running PollSchedulers pick it up again.
+        cur = conn.execute(
+            """
+            UPDATE poll_state SET archived = 0, next_poll_at = 0, interval = NULL, last_activity_at = ?
+            WHERE archived = 1 AND mapping_id = (SELECT id FROM mapping WHERE reddit_submission_id = ?)
+            """,
+            (time.time(), reddit_id_to_int(reddit_submission_id)),
+        )
+        return cur.rowcount > 0
+
+    def revive_mapping(self, reddit_submission_id):
+        """
+        Puts a submission's archived mapping back on the poll schedule (e.g. when
+        a new trigger reuses its post). Returns True if it was archived.
+        """
+        with self.transaction() as conn:
+            return self._revive_mapping(conn, reddit_submission_id)
+
+    def insert_mapping(self, reddit_submission_id, reddit_trigger_comment_id, lemmy_post_id,
+                       subreddit=None, lemmy_instance=None, held=False):
+        """
+        Insert a mapping record and return its row ID. `subreddit` and
+        `lemmy_instance` record the route the mapping belongs to (see routing.py).
+        A submission has at most one mapping: if it is already mapped, the
+        existing row is kept and its ID returned. A `held` mapping is not synced
+        until it is released (see backfill.py).
+        """
+        with self.transaction() as conn:
+            return self._insert_mapping(
+                conn, reddit_submission_id, reddit_trigger_comment_id, lemmy_post_id, subreddit, lemmy_instance, held
+            )
+
+    @classmethod
+    def _mapping_for_submission(cls, conn, reddit_submission_id):
+        row = conn.execute(
+            "SELECT * FROM mapping WHERE reddit_submission_id = ?", (reddit_id_to_int(reddit_submission_id),)
+        ).fetchone()
+        return None if row is None else cls._mapping_row(row)
+
+    def get_mapping_by_reddit_submission(self, reddit_submission_id):
+        """
+        Retrieve mapping records for a given Reddit submission ID.
+        """
+        rows = self._query(
+            "SELECT * FROM mapping WHERE reddit_submission_id = ?", (reddit_id_to_int(reddit_submission_id),)
+        )
+        return [self._mapping_row(row) for row in rows]
+
+    def get_all_mappings(self, include_held=True):
+        """
+        Retrieve all mapping records; without `include_held`, only those the
+        comment sync may poll.
+        """
+        if include_held:
+            return [self._mapping_row(row) for row in self._query("SELECT * FROM mapping")]
+        rows = self._query(
+            "SELECT m.* FROM mapping m LEFT JOIN poll_state p ON p.mapping_id = m.id "
+            "WHERE p.next_poll_at IS NULL OR p.next_poll_at >= 0"
+        )
+        return [self._mapping_row(row) for row in rows]
+
+    def get_mappings_after(self, last_row_id):
+        """
+        Retrieve mapping records with a row ID above `last_row_id`, oldest first.
+        """
+        rows = self._query("SELECT * FROM mapping WHERE id > ? ORDER BY id", (last_row_id,))
+        return [self._mapping_row(row) for row in rows]
+
+    def count_mappings(self):
+        """
+        Returns the number of post mappings.
+        """
+        return self._query_one("SELECT COUNT(*) FROM mapping")[0]
+
+    # --- Comment mappings ----------------------------------------------------
+
+    @staticmethod
+    def _comment_mapping_row(row):
+        if row is None:
+            return None
+        return (row[0], int_to_reddit_id(row[1])) + tuple(row[2:])
+
+    def insert_comment_mapping(self, reddit_comment_id, lemmy_comment_id):
+        """
+        Insert a comment mapping record and return its row ID. If either comment
+        is already mapped, nothing is written and the existing row's ID is returned.
+        """
+        reddit_key = reddit_id_to_int(reddit_comment_id)
+        with self.transaction() as conn:
+            cur = conn.execute(
+                "INSERT INTO comment_mapping (reddit_comment_id, lemmy_comment_id) VALUES (?, ?) ON CONFLICT DO NOTHING",
+                (reddit_key, lemmy_comment_id),
+            )
+            if cur.rowcount:
+                return cur.lastrowid
+            return conn.execute(
+                "SELECT id FROM comment_mapping WHERE reddit_comment_id = ? OR lemmy_comment_id = ?",
+                (reddit_key, lemmy_comment_id),
+            ).fetchone()[0]
+
+    def get_comment_mapping_by_reddit_comment(self, reddit_comment_id):
+        """
+        Retrieve a comment mapping record by Reddit comment ID (or None).
+        """
+        return self._comment_mapping_row(self._query_one(
+            "SELECT * FROM comment_mapping WHERE reddit_comment_id = ?", (reddit_id_to_int(reddit_comment_id),)
+        ))
+
+    def get_comment_mapping_by_lemmy_comment(self, lemmy_comment_id):
+        """
+        Retrieve a comment mapping record by Lemmy comment ID (or None).
+        """
+        return self._comment_mapping_row(self._query_one(
+            "SELECT * FROM comment_mapping WHERE lemmy_comment_id = ?", (lemmy_comment_id,)
+        ))
+
+    def _select_existing(self, column, ids):
+        ids = list(dict.fromkeys(ids))
+        found = set()
+        for start in range(0, len(ids), IN_CHUNK_SIZE):
+            chunk = ids[start:start + IN_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._query(
+                f"SELECT {column} FROM comment_mapping WHERE {column} IN ({placeholders})", chunk
+            )
+            found.update(row[0] for row in rows)
+        return found
+
+    def get_synced_reddit_comment_ids(self, reddit_comment_ids):
+        """
+        Returns the subset of the given Reddit comment IDs that already have a mapping.
+        """
+        found = self._select_existing("reddit_comment_id", map(reddit_id_to_int, reddit_comment_ids))
+        return {int_to_reddit_id(number) for number in found}
+
+    def get_synced_lemmy_comment_ids(self, lemmy_comment_ids):
+        """
+        Returns the subset of the given Lemmy comment IDs that already have a mapping.
+        """
+        return self._select_existing("lemmy_comment_id", lemmy_comment_ids)
+
+    def get_comment_mapping_ids_after(self, last_row_id, limit, encoded=False):
+        """
+        Returns up to `limit` (id, reddit_comment_id, lemmy_comment_id) rows with id > last_row_id.
+        With `encoded`, Reddit IDs are returned as stored (integers) instead of base36.
+        """
+        rows = self._query(
+            "SELECT id, reddit_comment_id, lemmy_comment_id FROM comment_mapping WHERE id > ? ORDER BY id LIMIT ?",
+            (last_row_id, limit),
+        )
+        if encoded:
+            return rows
+        return [self._comment_mapping_row(row) for row in rows]
+
+    def iter_comment_mapping_ids(self, column, batch_size):
+        """
+        Yields every value of a comment_mapping ID column ("reddit_comment_id", as
+        stored integers, or "lemmy_comment_id") in ascending order, in lists of up
+        to `batch_size`. The column's unique index supplies the order. Reads
+        through a connection of its own, so a long warm-load never holds the
+        shared one.
+        """
+        if column not in ("reddit_comment_id", "lemmy_comment_id"):
+            raise ValueError(f"Not a comment_mapping ID column: {column!r}")
+        conn = sqlite3.connect(self.database_file, timeout=10)
+        try:
+            cursor = conn.execute(f"SELECT {column} FROM comment_mapping ORDER BY {column}")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield [row[0] for row in rows]
+        finally:
+            conn.close()
+
+    def insert_comment_mappings(self, pairs):
+        """
+        Inserts many (reddit_comment_id, lemmy_comment_id) pairs in one transaction.
+        Pairs that are already mapped are ignored. Returns the number of rows inserted.
+        """
+        return self.record_synced(pairs)
+
+    # --- Sync cursors --------------------------------------------------------
+
+    def get_cursors(self, direction, scopes=None):
+        """
+        Returns {scope: (last_created_utc, last_id)} for every cursor of a direction,
+        or only for the given scopes.
+        """
+        if scopes is None:
+            rows = self._query(
+                "SELECT scope, last_created_utc, last_id FROM sync_cursor WHERE direction = ?", (direction,)
+            )
+        else:
+            scopes = list(dict.fromkeys(scopes))
+            rows = []
+            for start in range(0, len(scopes), IN_CHUNK_SIZE):
+                chunk = scopes[start:start + IN_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows.extend(self._query(
+                    f"SELECT scope, last_created_utc, last_id FROM sync_cursor "
+                    f"WHERE direction = ? AND scope IN ({placeholders})",
+                    [direction] + chunk,
+                ))
+        return {scope: (last_created_utc, last_id) for scope, last_created_utc, last_id in rows}
+
+    def get_cursor(self, scope, direction):
+        """
+        Returns (last_created_utc, last_id) for one cursor, or None.
+        """
+        row = self._query_one(
+            "SELECT last_created_utc, last_id FROM sync_cursor WHERE scope = ? AND direction = ?",
+            (scope, direction),
+        )
+        return tuple(row) if row else None
+
+    @staticmethod
+    def _upsert_cursor(conn, scope, direction, position):
+        last_created_utc, last_id = position
+        conn.execute(
+            """
+            INSERT INTO sync_cursor (scope, direction, last_created_utc, last_id)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (scope, direction) DO UPDATE SET
+                last_created_utc = excluded.last_created_utc,
+                last_id = excluded.last_id,
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            (scope, direction, last_created_utc, None if last_id is None else str(last_id)),
+        )
+
+    def set_cursor(self, scope, direction, position):
+        """
+        Stores a cursor position (last_created_utc, last_id).
+        """
+        with self.transaction() as conn:
+            self._upsert_cursor(conn, scope, direction, position)
+
+    @staticmethod
+    def _insert_comment_pairs(conn, pairs):
+        before = conn.total_changes
+        conn.executemany(
+            "INSERT INTO comment_mapping (reddit_comment_id, lemmy_comment_id) VALUES (?, ?) ON CONFLICT DO NOTHING",
+            [(reddit_id_to_int(reddit_comment_id), lemmy_comment_id) for reddit_comment_id, lemmy_comment_id in pairs],
+        )
+        return conn.total_changes - before
+
+    def record_synced(self, pairs, cursor=None, jobs=()):
+        """
+        Inserts comment mapping pairs, enqueues outbox jobs given as (kind, key, payload)
+        and, optionally, advances a cursor given as (scope, direction, position) --
+        all in one transaction.
+        """
+        pairs = list(pairs)
+        jobs = list(jobs)
+        if not pairs and not jobs and cursor is None:
+            return 0
+        with self.transaction() as conn:
+            inserted = self._insert_comment_pairs(conn, pairs)
+            for kind, key, payload in jobs:
+                self._enqueue_job(conn, kind, key, payload)
+            if cursor is not None:
+                self._upsert_cursor(conn, *cursor)
+            return inserted
+
+    # --- Outbox --------------------------------------------------------------
+
+    @staticmethod
+    def _enqueue_job(conn, kind, key, payload, run_at=None):
+        cur = conn.execute(
+            """
+            INSERT INTO outbox (kind, idempotency_key, payload, next_run_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (idempotency_key) DO UPDATE SET
+                payload = excluded.payload, status = 'pending', attempts = 0,
+                next_run_at = excluded.next_run_at, lease_until = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE outbox.status = 'dead'
+            """,
+            (kind, key, json.dumps(payload), time.time() if run_at is None else run_at),
+        )
+        return cur.rowcount > 0
+
+    def enqueue_job(self, kind, key, payload):
+        """
+        Adds a job to the outbox. A job whose idempotency key already exists is
+        ignored, unless it is dead: then it is revived with a fresh attempt budget.
+        Returns True if a job was added or revived.
+        """
+        with self.transaction() as conn:
+            return self._enqueue_job(conn, kind, key, payload)
+
+    def claim_jobs(self, limit, lease_seconds):
+        """
+        Claims up to `limit` due jobs (pending, or running with an expired lease) and
+        returns them as (id, kind, idempotency_key, payload dict, attempts) tuples.
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            rows = conn.execute(
+                """
+                SELECT id, kind, idempotency_key, payload, attempts FROM outbox
+                WHERE (status = 'pending' AND next_run_at <= ?)
+                   OR (status = 'running' AND lease_until < ?)
+                ORDER BY next_run_at
+                LIMIT ?
+                """,
+                (now, now, limit),
+            ).fetchall()
+            conn.executemany(
+                """
+                UPDATE outbox SET status = 'running', attempts = attempts + 1,
+                    lease_until = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+                """,
+                [(now + lease_seconds, row[0]) for row in rows],
+            )
+        return [(job_id, kind, key, json.loads(payload), attempts + 1)
+                for job_id, kind, key, payload, attempts in rows]
+
+    def complete_job(self, job_id, apply=None):
+        """
+        Marks a job done. `apply(conn)`, if given, runs in the same transaction so the
+        job's mapping rows (and any follow-up jobs) are written atomically with it.
+        """
+        with self.transaction() as conn:
+            result = apply(conn) if apply is not None else None
+            conn.execute(
+                "UPDATE outbox SET status = 'done', lease_until = NULL, last_error = NULL, "
+                "updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (job_id,),
+            )
+            return result
+
+    def fail_job(self, job_id, error, next_run_at=None):
+        """
+        Records a failed attempt. The job is retried at `next_run_at`, or marked
+        'dead' when next_run_at is None.
+        """
+        status = "dead" if next_run_at is None else "pending"
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE outbox SET status = ?, next_run_at = COALESCE(?, next_run_at), lease_until = NULL, "
+                "last_error = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (status, next_run_at, str(error)[:1000], job_id),
+            )
+
+    def count_jobs(self, status="pending"):
+        """
+        Returns the number of outbox jobs with the given status.
+        """
+        return self._query_one("SELECT COUNT(*) FROM outbox WHERE status = ?", (status,))[0]
+
+    # --- Comment branches ----------------------------------------------------
+
+    def get_comment_branches(self, scope):
+        """
+        Returns (branch_key, parent_id, children, count, expanded_at) for the
+        known "load more" branches of a thread; children is a list of comment IDs.
+        """
+        rows = self._query(
+            "SELECT branch_key, parent_id, children, count, expanded_at FROM comment_branch WHERE scope = ?",
+            (scope,),
+        )
+        return [
+            (key, parent_id, children.split(",") if children else [], count, expanded_at)
+            for key, parent_id, children, count, expanded_at in rows
+        ]
+
+    def save_comment_branches(self, scope, branches):
+        """
+        Upserts (branch_key, parent_id, children, count, expanded_at) rows in one
+        transaction. An expanded_at of None keeps the stored expansion time.
+        """
+        rows = [
+            (scope, key, parent_id, ",".join(children), count, expanded_at)
+            for key, parent_id, children, count, expanded_at in branches
+        ]
+        if not rows:
+            return
+        with self.transaction() as conn:
+            conn.executemany(
+                """
+                INSERT INTO comment_branch (scope, branch_key, parent_id, children, count, expanded_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (scope, branch_key) DO UPDATE SET
+                    parent_id = excluded.parent_id,
+                    children = excluded.children,
+                    count = excluded.count,
+                    expanded_at = COALESCE(excluded.expanded_at, comment_branch.expanded_at)
+                """,
+                rows,
+            )
+
+    def reset_comment_branches(self, scope, branch_keys):
+        """
+        Marks branches as never expanded, so the next walk expands them first.
+        """
+        with self.transaction() as conn:
+            conn.executemany(
+                "UPDATE comment_branch SET expanded_at = NULL WHERE scope = ? AND branch_key = ?",
+                [(scope, key) for key in branch_keys],
+            )
+
+    # --- Backfill checkpoints ------------------------------------------------
+
+    def get_backfill_checkpoint(self, job):
+        """
+        Returns (threads done, last submission ID) of a backfill job, or None.
+        """
+        row = self._query_one(
+            "SELECT threads_done, last_submission_id FROM backfill_checkpoint WHERE job = ?", (job,)
+        )
+        return None if row is None else (row[0], int_to_reddit_id(row[1]))
+
+    @staticmethod
+    def _upsert_backfill_checkpoint(conn, job, position):
+        threads_done, last_submission_id = position
+        conn.execute(
+            """
+            INSERT INTO backfill_checkpoint (job, threads_done, last_submission_id)
+            VALUES (?, ?, ?)
+            ON CONFLICT (job) DO UPDATE SET
+                threads_done = excluded.threads_done,
+                last_submission_id = excluded.last_submission_id,
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            (job, threads_done, reddit_id_to_int(last_submission_id)),
+        )
+
+    # --- Poll schedule -------------------------------------------------------
+    # A poll_state row with next_poll_at = HELD belongs to a mapping whose
+    # comments are still being copied (and recorded) by a backfill: the sync
+    # leaves it alone until _release_mappings() makes it due.
+
+    def is_mapping_held(self, mapping_id):
+        """
+        Returns True if a mapping is held from the comment sync.
+        """
+        row = self._query_one("SELECT next_poll_at FROM poll_state WHERE mapping_id = ?", (mapping_id,))
+        return row is not None and row[0] == HELD
+
+    @staticmethod
+    def _release_mappings(conn, mapping_ids):
+        # next_poll_at = 0: due now, and picked up by running PollSchedulers.
+        conn.executemany(
+            "UPDATE poll_state SET next_poll_at = 0, last_activity_at = ? WHERE mapping_id = ? AND next_poll_at = ?",
+            [(time.time(), mapping_id, HELD) for mapping_id in mapping_ids],
+        )
+
+    def get_active_poll_states(self, after_mapping_id=0):
+        """
+        Returns (mapping row, next_poll_at, interval, last_activity_at) for every
+        mapping that is not archived or held and either has an ID above
+        `after_mapping_id` or was never scheduled (next_poll_at = 0: new, revived
+        or released).
+        """
+        rows = self._query(
+            """
+            SELECT m.*, p.next_poll_at, p.interval, p.last_activity_at
+            FROM poll_state p JOIN mapping m ON m.id = p.mapping_id
+            WHERE p.archived = 0 AND p.next_poll_at >= 0 AND (p.mapping_id > ? OR p.next_poll_at = 0)
+            ORDER BY p.mapping_id
+            """,
+            (after_mapping_id,),
+        )
+        return [(self._mapping_row(row[:-3]), row[-3], row[-2], row[-1]) for row in rows]
+
+    def save_poll_states(self, states):
+        """
+        Stores many (mapping_id, next_poll_at, interval, last_activity_at, archived)
+        rows in one transaction.
+        """
+        states = [(next_poll_at, interval, last_activity_at, int(archived), mapping_id)
+                  for mapping_id, next_poll_at, interval, last_activity_at, archived in states]
+        if not states:
+            return
+        with self.transaction() as conn:
+            conn.executemany(
+                "UPDATE poll_state SET next_poll_at = ?, interval = ?, last_activity_at = ?, archived = ? "
+                "WHERE mapping_id = ?",
+                states,
+            )
+
+    # --- Auth tokens ---------------------------------------------------------
+
+    def get_auth_token(self, base_url, username):
+        """
+        Returns (jwt, expires_at) for the cached login, or None.
+        """
+        row = self._query_one(
+            "SELECT jwt, expires_at FROM auth_token WHERE base_url = ? AND username = ?", (base_url, username)
+        )
+        return tuple(row) if row else None
+
+    def set_auth_token(self, base_url, username, jwt, expires_at=None):
+        with self.transaction() as conn:
+            conn.execute(
+                """
+                INSERT INTO auth_token (base_url, username, jwt, expires_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (base_url, username) DO UPDATE SET
+                    jwt = excluded.jwt,
+                    expires_at = excluded.expires_at,
+                    updated_at = CURRENT_TIMESTAMP
+                """,
+                (base_url, username, jwt, expires_at),
+            )
+
+    def delete_auth_token(self, base_url, username):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM auth_token WHERE base_url = ? AND username = ?", (base_url, username))
+
+_store = None
+_store_pid = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """
+    Returns the process-wide MappingStore, creating it (and the schema) on first use.
+    A forked child gets its own connection rather than inheriting the parent's.
+    """
+    global _store, _store_pid
+    with _store_lock:
+        if _store is None or _store_pid != os.getpid():
+            _store = MappingStore()
+            _store.create_tables()
+            _store_pid = os.getpid()
+        return _store
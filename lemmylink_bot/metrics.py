@@ -0,0 +1,317 @@
+# metrics.py
+#
+# In-process metrics: counters, histograms and gauges rendered in the Prometheus
+# text format by a small HTTP endpoint (stdlib only), plus a sampling profiler
+# that can be switched on and off at runtime through the same endpoint:
+#
+#   GET /metrics          Prometheus scrape
+#   GET /profile/start    start sampling all threads
+#   GET /profile/stop     stop sampling
+#   GET /profile          collapsed stacks ("frame;frame;frame count"), usable
+#                         with flamegraph.pl / speedscope
+
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import config
+
+# Set METRICS_PORT = None to disable the endpoint. Processes sharing one host
+# (shards, or main.py next to bidirectional_sync.py) each need their own port:
+# the LEMMYLINK_METRICS_PORT environment variable overrides the config.
+METRICS_ADDRESS = getattr(config, "METRICS_ADDRESS", "127.0.0.1")
+METRICS_PORT = getattr(config, "METRICS_PORT", 9464)
+if os.environ.get("LEMMYLINK_METRICS_PORT"):
+    METRICS_PORT = int(os.environ["LEMMYLINK_METRICS_PORT"])
+PROFILER_INTERVAL = getattr(config, "PROFILER_INTERVAL", 0.01)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CYCLE_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Gauge(_Metric):
+    """
+    A value that is either set directly or computed at scrape time (set_function).
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        self._function = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(self.labelnames, labels)] = value
+
+    def set_function(self, function):
+        self._function = function
+
+    def render(self):
+        lines = self._header()
+        if self._function is not None:
+            try:
+                lines.append(f"{self.name} {self._function()}")
+            except Exception as e:
+                lines.append(f"# {self.name} unavailable: {e}")
+            return lines
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, [("le", repr(float(bound)))])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+# --- Bot metrics -------------------------------------------------------------
+
+TRIGGERS = REGISTRY.register(Counter(
+    "lemmylink_triggers_total", "Trigger phrases detected on Reddit.", ["source"]))
+POSTS_CREATED = REGISTRY.register(Counter(
+    "lemmylink_posts_created_total", "Lemmy posts created for triggers."))
+COMMENTS_SYNCED = REGISTRY.register(Counter(
+    "lemmylink_comments_synced_total", "Comments mirrored, by direction.", ["direction"]))
+ERRORS = REGISTRY.register(Counter(
+    "lemmylink_errors_total", "Errors caught and logged, by component.", ["component"]))
+
+LEMMY_API_LATENCY = REGISTRY.register(Histogram(
+    "lemmylink_lemmy_request_seconds", "Lemmy API request latency (per attempt).", ["method", "endpoint", "status"]))
+REDDIT_API_LATENCY = REGISTRY.register(Histogram(
+    "lemmylink_reddit_request_seconds", "Reddit API request latency.", ["method", "status"]))
+SQLITE_LATENCY = REGISTRY.register(Histogram(
+    "lemmylink_sqlite_seconds", "SQLite query and transaction latency.", ["operation"]))
+SYNC_CYCLE = REGISTRY.register(Histogram(
+    "lemmylink_sync_cycle_seconds", "Duration of a full sync cycle.", buckets=CYCLE_BUCKETS))
+
+MAPPINGS = REGISTRY.register(Gauge(
+    "lemmylink_mappings", "Number of bridged Reddit submission / Lemmy post mappings."))
+OUTBOX_DEPTH = REGISTRY.register(Gauge(
+    "lemmylink_outbox_pending", "Outbox jobs waiting to run."))
+POLL_ACTIVE = REGISTRY.register(Gauge(
+    "lemmylink_poll_active_mappings", "Mappings still polled by the adaptive scheduler (not archived)."))
+
+def record_error(component):
+    ERRORS.inc(component=component)
+
+# --- Sampling profiler -------------------------------------------------------
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads every `interval` seconds from a background
+    thread and counts identical stacks. Cheap enough to switch on in production
+    for a few cycles; off by default.
+    """
+
+    def __init__(self, interval=PROFILER_INTERVAL):
+        self.interval = interval
+        self.samples = StackCounter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=None):
+        with self._lock:
+            if self.running:
+                return False
+            if interval:
+                self.interval = interval
+            self.samples.clear()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        with self._lock:
+            if not self.running:
+                return False
+            self._stop.set()
+            self._thread.join()
+            return True
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def report(self, limit=None):
+        """
+        Returns the samples as collapsed stacks, most frequent first.
+        """
+        items = self.samples.most_common(limit)
+        return "".join(f"{stack} {count}\n" for stack, count in items)
+
+PROFILER = SamplingProfiler()
+
+# --- HTTP endpoint -----------------------------------------------------------
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path == "/metrics":
+            self._reply(200, REGISTRY.render(), "text/plain; version=0.0.4")
+        elif url.path == "/profile/start":
+            interval = float(params["interval"][0]) if "interval" in params else None
+            started = PROFILER.start(interval)
+            self._reply(200, "profiler started\n" if started else "profiler already running\n")
+        elif url.path == "/profile/stop":
+            self._reply(200, "profiler stopped\n" if PROFILER.stop() else "profiler not running\n")
+        elif url.path == "/profile":
+            limit = int(params["limit"][0]) if "limit" in params else None
+            self._reply(200, PROFILER.report(limit))
+        else:
+            self._reply(404, "not found\n")
+
+    def _reply(self, status, text, content_type="text/plain"):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_server = None
+
+def start_metrics_server(address=METRICS_ADDRESS, port=METRICS_PORT):
+    """
+    Serves /metrics and the profiler controls from a daemon thread.
+    Returns the server, or None if disabled (port None) or already running.
+    """
+    global _server
+    if port is None or _server is not None:
+        return None
+    try:
+        _server = ThreadingHTTPServer((address, port), _MetricsHandler)
+    except OSError as e:
+        # Metrics are optional; a taken port must not keep the bot from running.
+        print(f"[ERROR] Metrics: could not listen on {address}:{port}: {e}")
+        return None
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Metrics: serving http://{address}:{_server.server_address[1]}/metrics")
+    return _server
@@ -0,0 +1,364 @@
+# migrations.py
+#
+# Versioned schema migrations for mapping.db. The schema version lives in
+# SQLite's PRAGMA user_version; MappingStore.create_tables() upgrades every
+# database to the latest version on startup. Each migration has an `up` and a
+# `down` step and runs in its own BEGIN IMMEDIATE transaction that re-checks the
+# version first, so several processes starting at once apply it exactly once.
+#
+#   python migrations.py            # upgrade to the latest version
+#   python migrations.py --to 1     # upgrade or downgrade to version 1
+#   python migrations.py --status   # print the current version
+
+import argparse
+from collections import namedtuple
+
+from reddit_ids import encode_reddit_id, decode_reddit_id
+
+Migration = namedtuple("Migration", ["version", "name", "up", "down"])
+
+# --- 1: baseline -------------------------------------------------------------
+# The schema as it existed before versioning. Unversioned databases of any age
+# are brought up to it: missing tables/indexes are created, mapping columns
+# added later are appended, duplicate comment mappings are removed so the unique
+# indexes can be built, and mappings get their poll schedule rows.
+
+BASELINE_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS mapping (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        reddit_submission_id TEXT NOT NULL,
+        reddit_trigger_comment_id TEXT,
+        lemmy_post_id INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        subreddit TEXT,
+        lemmy_instance TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS comment_mapping (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        reddit_comment_id TEXT NOT NULL,
+        lemmy_comment_id INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_comment_mapping_reddit ON comment_mapping (reddit_comment_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_comment_mapping_lemmy ON comment_mapping (lemmy_comment_id)",
+    # Per-mapping sync high-water marks (see sync_cursors.py).
+    """
+    CREATE TABLE IF NOT EXISTS sync_cursor (
+        scope TEXT NOT NULL,
+        direction TEXT NOT NULL,
+        last_created_utc REAL,
+        last_id TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (scope, direction)
+    )
+    """,
+    # Durable queue of outbound writes (see outbox.py).
+    """
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        idempotency_key TEXT NOT NULL UNIQUE,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_run_at REAL NOT NULL,
+        lease_until REAL,
+        last_error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_run_at)",
+    # Cached Lemmy login tokens, so restarts don't have to log in again.
+    """
+    CREATE TABLE IF NOT EXISTS auth_token (
+        base_url TEXT NOT NULL,
+        username TEXT NOT NULL,
+        jwt TEXT NOT NULL,
+        expires_at REAL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (base_url, username)
+    )
+    """,
+    # Adaptive poll schedule of each mapping (see poll_scheduler.py). Archived
+    # mappings are no longer polled; the partial index keeps loading the active
+    # ones independent of how many have been archived.
+    """
+    CREATE TABLE IF NOT EXISTS poll_state (
+        mapping_id INTEGER PRIMARY KEY,
+        next_poll_at REAL NOT NULL DEFAULT 0,
+        interval REAL,
+        last_activity_at REAL,
+        archived INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_poll_state_active ON poll_state (mapping_id) WHERE archived = 0",
+    # "Load more comments" branches of Reddit threads, stored as IDs only, so the
+    # tree walk can resume them on later cycles (see comment_tree.py).
+    """
+    CREATE TABLE IF NOT EXISTS comment_branch (
+        scope TEXT NOT NULL,
+        branch_key TEXT NOT NULL,
+        parent_id TEXT NOT NULL,
+        children TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        expanded_at REAL,
+        PRIMARY KEY (scope, branch_key)
+    )
+    """,
+    # Not unique: existing databases can contain several mappings per submission.
+    "CREATE INDEX IF NOT EXISTS idx_mapping_reddit_submission ON mapping (reddit_submission_id)",
+)
+
+# Columns added to the mapping table after its first release, as (name, type).
+# NULL means the default route (config.SUBREDDIT_NAME / config.LEMMY_BASE_URL),
+# see routing.py.
+MAPPING_ADDED_COLUMNS = (
+    ("subreddit", "TEXT"),
+    ("lemmy_instance", "TEXT"),
+)
+
+# Databases created before the unique indexes existed may hold duplicate comment
+# mappings; keep the oldest row of each so the indexes can be built.
+DEDUPE_COMMENT_MAPPINGS = (
+    """
+    DELETE FROM comment_mapping WHERE id NOT IN (
+        SELECT MIN(id) FROM comment_mapping GROUP BY reddit_comment_id
+    )
+    """,
+    """
+    DELETE FROM comment_mapping WHERE id NOT IN (
+        SELECT MIN(id) FROM comment_mapping GROUP BY lemmy_comment_id
+    )
+    """,
+)
+
+BASELINE_TABLES = ("mapping", "comment_mapping", "sync_cursor", "outbox", "auth_token", "poll_state", "comment_branch")
+
+def _table_exists(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()
+
+def _baseline_up(conn):
+    has_unique_index = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_comment_mapping_reddit'"
+    ).fetchone()
+    has_poll_state = _table_exists(conn, "poll_state")
+    for statement in BASELINE_SCHEMA:
+        if statement.lstrip().startswith("CREATE UNIQUE INDEX") and not has_unique_index:
+            for dedupe in DEDUPE_COMMENT_MAPPINGS:
+                conn.execute(dedupe)
+            has_unique_index = True
+        conn.execute(statement)
+    mapping_columns = {row[1] for row in conn.execute("PRAGMA table_info(mapping)")}
+    for name, column_type in MAPPING_ADDED_COLUMNS:
+        if name not in mapping_columns:
+            conn.execute(f"ALTER TABLE mapping ADD COLUMN {name} {column_type}")
+    if not has_poll_state:
+        # Mappings created before the scheduler existed: due now, with their
+        # creation time as the last activity.
+        conn.execute(
+            "INSERT OR IGNORE INTO poll_state (mapping_id, last_activity_at) "
+            "SELECT id, CAST(strftime('%s', created_at) AS REAL) FROM mapping"
+        )
+
+def _baseline_down(conn):
+    for table in BASELINE_TABLES:
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+
+# --- 2: integer Reddit IDs and unique keys ------------------------------------
+# Reddit IDs become INTEGER columns (decoded from base36, see reddit_ids.py) and
+# the natural keys become UNIQUE constraints, so inserts can be idempotent
+# upserts. Of several mappings of one submission, the oldest is kept (the sync
+# already treated it as the mapping of that submission); the others are logged
+# along with their Lemmy posts, and their cursors, branches and poll schedule
+# are removed.
+
+def _rebuild(conn, table, create_sql, columns, select_sql):
+    conn.execute(create_sql.format(table=f"{table}_new"))
+    conn.execute(f"INSERT INTO {table}_new ({', '.join(columns)}) {select_sql}")
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+MAPPING_COLUMNS = (
+    "id", "reddit_submission_id", "reddit_trigger_comment_id", "lemmy_post_id", "created_at", "subreddit",
+    "lemmy_instance",
+)
+COMMENT_MAPPING_COLUMNS = ("id", "reddit_comment_id", "lemmy_comment_id", "created_at")
+
+def _integer_ids_up(conn):
+    conn.create_function("reddit_id_to_int", 1, encode_reddit_id, deterministic=True)
+    duplicates = conn.execute(
+        "SELECT id, reddit_submission_id, lemmy_post_id FROM mapping "
+        "WHERE id NOT IN (SELECT MIN(id) FROM mapping GROUP BY reddit_submission_id) ORDER BY id"
+    ).fetchall()
+    for mapping_id, reddit_submission_id, lemmy_post_id in duplicates:
+        print(f"[WARN] Migrations: dropping duplicate mapping {mapping_id} of submission {reddit_submission_id} "
+              f"(Lemmy post {lemmy_post_id}); the oldest mapping of the submission is kept.")
+    ids = [(mapping_id,) for mapping_id, _, _ in duplicates]
+    # Scopes as built by sync_cursors.mapping_scope().
+    scopes = [(f"mapping:{mapping_id}",) for mapping_id, _, _ in duplicates]
+    conn.executemany("DELETE FROM sync_cursor WHERE scope = ?", scopes)
+    conn.executemany("DELETE FROM comment_branch WHERE scope = ?", scopes)
+    conn.executemany("DELETE FROM poll_state WHERE mapping_id = ?", ids)
+    _rebuild(
+        conn, "mapping",
+        """
+        CREATE TABLE {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            reddit_submission_id INTEGER NOT NULL UNIQUE,
+            reddit_trigger_comment_id INTEGER,
+            lemmy_post_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            subreddit TEXT,
+            lemmy_instance TEXT
+        )
+        """,
+        MAPPING_COLUMNS,
+        """
+        SELECT id, reddit_id_to_int(reddit_submission_id), reddit_id_to_int(reddit_trigger_comment_id),
+               lemmy_post_id, created_at, subreddit, lemmy_instance
+        FROM mapping WHERE id IN (SELECT MIN(id) FROM mapping GROUP BY reddit_submission_id)
+        """,
+    )
+    _rebuild(
+        conn, "comment_mapping",
+        """
+        CREATE TABLE {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            reddit_comment_id INTEGER NOT NULL UNIQUE,
+            lemmy_comment_id INTEGER NOT NULL UNIQUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        COMMENT_MAPPING_COLUMNS,
+        "SELECT id, reddit_id_to_int(reddit_comment_id), lemmy_comment_id, created_at FROM comment_mapping",
+    )
+
+def _integer_ids_down(conn):
+    conn.create_function("int_to_reddit_id", 1, decode_reddit_id, deterministic=True)
+    _rebuild(
+        conn, "mapping",
+        BASELINE_SCHEMA[0].replace("IF NOT EXISTS mapping", "{table}"),
+        MAPPING_COLUMNS,
+        """
+        SELECT id, int_to_reddit_id(reddit_submission_id), int_to_reddit_id(reddit_trigger_comment_id),
+               lemmy_post_id, created_at, subreddit, lemmy_instance
+        FROM mapping
+        """,
+    )
+    _rebuild(
+        conn, "comment_mapping",
+        BASELINE_SCHEMA[1].replace("IF NOT EXISTS comment_mapping", "{table}"),
+        COMMENT_MAPPING_COLUMNS,
+        "SELECT id, int_to_reddit_id(reddit_comment_id), lemmy_comment_id, created_at FROM comment_mapping",
+    )
+    for statement in BASELINE_SCHEMA:
+        if "INDEX" in statement and ("ON mapping " in statement or "ON comment_mapping " in statement):
+            conn.execute(statement)
+
+# --- 3: backfill checkpoints ---------------------------------------------------
+# Progress of each backfill job (see backfill.py) moves out of sync_cursor, where
+# it was stored as a sync_cursor row with the thread count in last_created_utc,
+# into a table of its own.
+
+BACKFILL_CHECKPOINT_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS backfill_checkpoint (
+        job TEXT PRIMARY KEY,
+        threads_done INTEGER NOT NULL,
+        last_submission_id INTEGER NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+def _backfill_checkpoints_up(conn):
+    conn.create_function("reddit_id_to_int", 1, encode_reddit_id, deterministic=True)
+    conn.execute(BACKFILL_CHECKPOINT_SCHEMA)
+    conn.execute(
+        """
+        INSERT INTO backfill_checkpoint (job, threads_done, last_submission_id)
+        SELECT substr(scope, length('backfill:') + 1), CAST(last_created_utc AS INTEGER), reddit_id_to_int(last_id)
+        FROM sync_cursor WHERE direction = 'backfill' AND last_id IS NOT NULL
+        """
+    )
+    conn.execute("DELETE FROM sync_cursor WHERE direction = 'backfill'")
+
+def _backfill_checkpoints_down(conn):
+    conn.create_function("int_to_reddit_id", 1, decode_reddit_id, deterministic=True)
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO sync_cursor (scope, direction, last_created_utc, last_id)
+        SELECT 'backfill:' || job, 'backfill', threads_done, int_to_reddit_id(last_submission_id)
+        FROM backfill_checkpoint
+        """
+    )
+    conn.execute("DROP TABLE backfill_checkpoint")
+
+MIGRATIONS = (
+    Migration(1, "baseline", _baseline_up, _baseline_down),
+    Migration(2, "integer reddit ids and unique keys", _integer_ids_up, _integer_ids_down),
+    Migration(3, "backfill checkpoints", _backfill_checkpoints_up, _backfill_checkpoints_down),
+)
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def _step(conn, from_version, to_version, func):
+    """
+    Runs one migration step in its own transaction, unless another process got
+    there first. Returns False if the database was not at `from_version`.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if current_version(conn) != from_version:
+            conn.execute("ROLLBACK")
+            return False
+        func(conn)
+        conn.execute(f"PRAGMA user_version = {int(to_version)}")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    return True
+
+def migrate(conn, target=LATEST_VERSION):
+    """
+    Upgrades or downgrades the database to `target` (0 drops everything). `conn`
+    must be in autocommit mode (isolation_level=None). Returns the final version.
+    """
+    if target < 0 or target > LATEST_VERSION:
+        raise ValueError(f"Unknown schema version: {target}")
+    while True:
+        version = current_version(conn)
+        if version == target:
+            return version
+        if version < target:
+            migration = MIGRATIONS[version]
+            if _step(conn, version, migration.version, migration.up):
+                print(f"Migrations: applied {migration.version} ({migration.name}).")
+        elif version > LATEST_VERSION:
+            raise RuntimeError(f"Database schema version {version} is newer than this code ({LATEST_VERSION}).")
+        else:
+            migration = MIGRATIONS[version - 1]
+            if _step(conn, version, version - 1, migration.down):
+                print(f"Migrations: reverted {migration.version} ({migration.name}).")
+
+if __name__ == "__main__":
+    from mapping_store import DATABASE_FILE, MappingStore
+
+    parser = argparse.ArgumentParser(description="Apply or revert mapping.db schema migrations.")
+    parser.add_argument("--to", type=int, default=LATEST_VERSION, help="target schema version (0 drops all tables)")
+    parser.add_argument("--status", action="store_true", help="only print the current version")
+    args = parser.parse_args()
+
+    store = MappingStore()
+    if args.status:
+        print(f"{DATABASE_FILE}: schema version {current_version(store.conn)} (latest {LATEST_VERSION})")
+    else:
+        print(f"{DATABASE_FILE}: schema version {migrate(store.conn, args.to)}")
+    store.close()
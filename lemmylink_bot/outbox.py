@@ -0,0 +1,308 @@
+# outbox.py
+#
+# Durable outbox for outbound writes. Producers (BridgeManager, the sync
+# functions, the comment stream) enqueue jobs into the SQLite `outbox` table
+# instead of calling Lemmy/Reddit inline; a pool of worker threads drains the
+# queue with retries. Each job's mapping rows are written in the same
+# transaction that marks it done, so a Lemmy hiccup delays work instead of
+# losing it, and the stream consumers never block on slow writes.
+#
+# Job kinds:
+#   lemmy_post    - create the Lemmy post for a trigger (or reuse the thread's
+#                   existing one), store the mapping and enqueue the Reddit
+#                   reply with the link
+#   lemmy_comment - create a Lemmy comment for a Reddit comment
+#   reddit_reply  - reply on Reddit (trigger replies and Lemmy-to-Reddit comments)
+#   lemmy_delete_post - delete a duplicate Lemmy post left by a lost race
+
+import random
+import time
+from contextlib import nullcontext
+
+import config
+from mapping_store import get_store
+from bridged_posts import get_bridged_posts, bridged_post_of, lemmy_post_url
+from ratelimit import get_rate_limiter, HIGH, NORMAL
+from sync_cursors import REDDIT_TO_LEMMY, LEMMY_TO_REDDIT
+from metrics import COMMENTS_SYNCED, POSTS_CREATED, record_error
+
+OUTBOX_ENABLED = getattr(config, "OUTBOX_ENABLED", True)
+OUTBOX_WORKERS = getattr(config, "OUTBOX_WORKERS", 4)
+OUTBOX_MAX_ATTEMPTS = getattr(config, "OUTBOX_MAX_ATTEMPTS", 8)
+OUTBOX_BACKOFF_BASE = getattr(config, "OUTBOX_BACKOFF_BASE", 5.0)
+OUTBOX_BACKOFF_MAX = getattr(config, "OUTBOX_BACKOFF_MAX", 3600.0)
+OUTBOX_POLL_INTERVAL = getattr(config, "OUTBOX_POLL_INTERVAL", 1.0)
+# A claimed job whose worker died is picked up again after this many seconds.
+OUTBOX_LEASE_SECONDS = getattr(config, "OUTBOX_LEASE_SECONDS", 300)
+
+LEMMY_POST = "lemmy_post"
+LEMMY_COMMENT = "lemmy_comment"
+REDDIT_REPLY = "reddit_reply"
+LEMMY_DELETE_POST = "lemmy_delete_post"
+
+def lemmy_comment_job(reddit_comment_id, lemmy_post_id, content, lemmy_instance=None):
+    """
+    Returns the (kind, key, payload) job that forwards a Reddit comment to Lemmy.
+    `lemmy_instance` is the base URL of the post's instance (None = config's).
+    """
+    payload = {
+        "reddit_comment_id": reddit_comment_id,
+        "post_id": lemmy_post_id,
+        "content": content,
+        "lemmy_instance": lemmy_instance,
+    }
+    return LEMMY_COMMENT, f"{LEMMY_COMMENT}:{reddit_comment_id}", payload
+
+def reddit_reply_job(target_fullname, text, lemmy_comment_id=None):
+    """
+    Returns the (kind, key, payload) job that replies to a Reddit submission or
+    comment. With lemmy_comment_id set, the reply is recorded as that Lemmy
+    comment's mirror.
+    """
+    if lemmy_comment_id is not None:
+        key = f"{REDDIT_REPLY}:lemmy:{lemmy_comment_id}"
+    else:
+        key = f"{REDDIT_REPLY}:{target_fullname}"
+    payload = {"target": target_fullname, "text": text, "lemmy_comment_id": lemmy_comment_id}
+    return REDDIT_REPLY, key, payload
+
+def lemmy_post_job(reddit_submission_id, reddit_trigger_id, trigger_fullname, community_id, title, body,
+                   subreddit=None, lemmy_instance=None):
+    """
+    Returns the (kind, key, payload) job that bridges a triggered thread to Lemmy.
+    """
+    payload = {
+        "reddit_submission_id": reddit_submission_id,
+        "reddit_trigger_id": reddit_trigger_id,
+        "trigger_fullname": trigger_fullname,
+        "community_id": community_id,
+        "title": title,
+        "body": body,
+        "subreddit": subreddit,
+        "lemmy_instance": lemmy_instance,
+    }
+    return LEMMY_POST, f"{LEMMY_POST}:{reddit_trigger_id}", payload
+
+def lemmy_delete_post_job(lemmy_post_id, lemmy_instance=None):
+    """
+    Returns the (kind, key, payload) job that deletes one of the bot's Lemmy posts.
+    """
+    payload = {"post_id": lemmy_post_id, "lemmy_instance": lemmy_instance}
+    return LEMMY_DELETE_POST, f"{LEMMY_DELETE_POST}:{lemmy_instance}:{lemmy_post_id}", payload
+
+def bridge_reply_text(lemmy_post_url, existing=False):
+    """
+    The Reddit reply posted once a thread has been bridged (`existing`: by an
+    earlier trigger).
+    """
+    if existing:
+        return (
+            "LemmyLink bot here!\n\n"
+            f"This thread is already bridged to Lemmy: {lemmy_post_url}"
+        )
+    return (
+        "LemmyLink bot here!\n\n"
+        f"I've created a corresponding post on Lemmy: {lemmy_post_url}\n\n"
+        "Stay tuned for future updates (e.g., comment syncing)!"
+    )
+
+class Outbox:
+    """
+    Enqueues outbound jobs and executes them from a worker pool.
+    """
+
+    def __init__(self, reddit, lemmy, store=None, index=None, routing=None):
+        self.reddit = reddit
+        self.lemmy = lemmy
+        # With a RoutingTable, jobs for other Lemmy instances use that instance's client.
+        self.routing = routing
+        self.store = store or get_store()
+        self.index = index
+        self.handlers = {
+            LEMMY_POST: self._handle_lemmy_post,
+            LEMMY_COMMENT: self._handle_lemmy_comment,
+            REDDIT_REPLY: self._handle_reddit_reply,
+            LEMMY_DELETE_POST: self._handle_lemmy_delete_post,
+        }
+
+    def enqueue(self, job):
+        """
+        Enqueues a (kind, key, payload) job; duplicates (same key) are ignored.
+        """
+        kind, key, payload = job
+        return self.store.enqueue_job(kind, key, payload)
+
+    def depth(self):
+        return self.store.count_jobs("pending")
+
+    def _lemmy_for(self, payload):
+        instance = payload.get("lemmy_instance")
+        if instance is None or self.routing is None or instance.rstrip("/") == self.lemmy.base_url.rstrip("/"):
+            return self.lemmy
+        return self.routing.lemmy_client_for_instance(instance)
+
+    # --- Handlers ------------------------------------------------------------
+    # Each handler performs the remote call and returns apply(conn), which writes
+    # the resulting rows inside the transaction that marks the job done and
+    # returns the comment mapping pairs it recorded.
+
+    def _handle_lemmy_post(self, payload):
+        # Runs under the submission's single-flight lock (see run_job), so an
+        # earlier trigger's mapping is visible here.
+        existing = get_bridged_posts().lookup(payload["reddit_submission_id"])
+        if existing is not None:
+            return self._reuse_lemmy_post(payload, existing)
+        if payload["community_id"] is None:
+            raise RuntimeError(f"No Lemmy community for trigger {payload['reddit_trigger_id']}; not creating a post")
+        lemmy = self._lemmy_for(payload)
+        post_response = lemmy.create_post(
+            community_id=payload["community_id"], title=payload["title"], body=payload["body"]
+        )
+        post_data = post_response.get("post_view", {}).get("post", {})
+        if "id" not in post_data:
+            raise RuntimeError(f"Could not find 'id' in Lemmy post response: {post_response}")
+        new_post_id = post_data["id"]
+        POSTS_CREATED.inc()
+        print(f"Outbox: created Lemmy post {new_post_id} for trigger {payload['reddit_trigger_id']}")
+
+        def apply(conn):
+            self.store._insert_mapping(
+                conn, payload["reddit_submission_id"], payload["reddit_trigger_id"], new_post_id,
+                payload.get("subreddit"), payload.get("lemmy_instance")
+            )
+            # Another process may have mapped the submission first; link to its post.
+            post = bridged_post_of(self.store._mapping_for_submission(conn, payload["reddit_submission_id"]))
+            if post.lemmy_post_id != new_post_id:
+                print(f"[WARN] Outbox: submission {payload['reddit_submission_id']} was bridged concurrently "
+                      f"as Lemmy post {post.lemmy_post_id}; deleting duplicate post {new_post_id}.")
+                self.store._enqueue_job(conn, *lemmy_delete_post_job(new_post_id, payload.get("lemmy_instance")))
+                self.store._revive_mapping(conn, payload["reddit_submission_id"])
+            text = bridge_reply_text(lemmy_post_url(post))
+            kind, key, reply_payload = reddit_reply_job(payload["trigger_fullname"], text)
+            self.store._enqueue_job(conn, kind, key, reply_payload)
+            return []
+        return apply
+
+    def _reuse_lemmy_post(self, payload, post):
+        print(f"Outbox: submission {payload['reddit_submission_id']} is already bridged as Lemmy post "
+              f"{post.lemmy_post_id}; reusing it for trigger {payload['reddit_trigger_id']}")
+
+        def apply(conn):
+            if post.reddit_trigger_id != payload["reddit_trigger_id"]:
+                # A new trigger in a thread that went quiet: poll it again.
+                self.store._revive_mapping(conn, payload["reddit_submission_id"])
+                text = bridge_reply_text(lemmy_post_url(post), existing=True)
+                kind, key, reply_payload = reddit_reply_job(payload["trigger_fullname"], text)
+                self.store._enqueue_job(conn, kind, key, reply_payload)
+            return []
+        return apply
+
+    def _handle_lemmy_comment(self, payload):
+        lemmy_response = self._lemmy_for(payload).create_comment(
+            post_id=payload["post_id"], content=payload["content"], parent_id=None
+        )
+        lemmy_comment_id = lemmy_response.get("comment_view", {}).get("comment", {}).get("id")
+        if not lemmy_comment_id:
+            raise RuntimeError(f"Failed to extract Lemmy comment ID. Response: {lemmy_response}")
+        pairs = [(payload["reddit_comment_id"], lemmy_comment_id)]
+        print(f"Outbox: synced Reddit comment {payload['reddit_comment_id']} to Lemmy comment {lemmy_comment_id}")
+
+        def apply(conn):
+            self.store._insert_comment_pairs(conn, pairs)
+            return pairs
+        return apply
+
+    def _handle_lemmy_delete_post(self, payload):
+        self._lemmy_for(payload).delete_post(payload["post_id"])
+        print(f"Outbox: deleted duplicate Lemmy post {payload['post_id']}")
+        return lambda conn: []
+
+    def _handle_reddit_reply(self, payload):
+        prefix, target_id = payload["target"].split("_", 1)
+        if prefix == "t3":
+            target = self.reddit.submission(id=target_id)
+        else:
+            target = self.reddit.comment(id=target_id)
+        reddit_comment = target.reply(payload["text"])
+        print(f"Outbox: replied to {payload['target']} with Reddit comment {reddit_comment.id}")
+        lemmy_comment_id = payload.get("lemmy_comment_id")
+        pairs = [(reddit_comment.id, lemmy_comment_id)] if lemmy_comment_id is not None else []
+
+        def apply(conn):
+            self.store._insert_comment_pairs(conn, pairs)
+            return pairs
+        return apply
+
+    # --- Workers -------------------------------------------------------------
+
+    @staticmethod
+    def _priority(kind, payload):
+        # Trigger work (the Lemmy post and the reply carrying its link) is what
+        # users wait on, so it may dip into the buckets' high-priority reserve.
+        if kind == LEMMY_POST or (kind == REDDIT_REPLY and payload.get("lemmy_comment_id") is None):
+            return HIGH
+        return NORMAL
+
+    @staticmethod
+    def _flight(kind, payload):
+        # lemmy_post jobs of one submission run one at a time, through to the
+        # commit of their mapping, so only the first creates a post.
+        if kind == LEMMY_POST:
+            return get_bridged_posts().single_flight(payload["reddit_submission_id"])
+        return nullcontext()
+
+    @staticmethod
+    def _count_done(kind, payload):
+        # POSTS_CREATED is counted by the lemmy_post handler, which may reuse a post.
+        if kind == LEMMY_COMMENT:
+            COMMENTS_SYNCED.inc(direction=REDDIT_TO_LEMMY)
+        elif kind == REDDIT_REPLY and payload.get("lemmy_comment_id") is not None:
+            COMMENTS_SYNCED.inc(direction=LEMMY_TO_REDDIT)
+
+    def _retry_at(self, attempts):
+        ceiling = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * (2 ** (attempts - 1)))
+        return time.time() + random.uniform(ceiling / 2, ceiling)
+
+    def run_job(self, job):
+        """
+        Executes one claimed job and records its outcome.
+        """
+        job_id, kind, key, payload, attempts = job
+        handler = self.handlers.get(kind)
+        try:
+            if handler is None:
+                raise RuntimeError(f"Unknown outbox job kind: {kind}")
+            with self._flight(kind, payload):
+                with get_rate_limiter().priority(self._priority(kind, payload)):
+                    apply = handler(payload)
+                pairs = self.store.complete_job(job_id, apply)
+            if pairs and self.index is not None:
+                self.index.add(pairs)
+            self._count_done(kind, payload)
+            return True
+        except Exception as e:
+            record_error(f"outbox:{kind}")
+            if attempts >= OUTBOX_MAX_ATTEMPTS:
+                print(f"[ERROR] Outbox: job {key} failed permanently after {attempts} attempts: {e}")
+                self.store.fail_job(job_id, e, None)
+            else:
+                print(f"[ERROR] Outbox: job {key} failed (attempt {attempts}), will retry: {e}")
+                self.store.fail_job(job_id, e, self._retry_at(attempts))
+            return False
+
+    def run_once(self, limit=1):
+        """
+        Claims and runs up to `limit` due jobs. Returns the number of jobs claimed.
+        """
+        jobs = self.store.claim_jobs(limit, OUTBOX_LEASE_SECONDS)
+        for job in jobs:
+            self.run_job(job)
+        return len(jobs)
+
+    def run_worker(self, stop_event):
+        """
+        Worker loop: drains due jobs, sleeping OUTBOX_POLL_INTERVAL when idle.
+        """
+        while not stop_event.is_set():
+            if self.run_once() == 0:
+                stop_event.wait(OUTBOX_POLL_INTERVAL)
@@ -0,0 +1,145 @@
+# poll_scheduler.py
+#
+# Adaptive polling for the comment sync. Instead of re-syncing every mapping each
+# cycle, each mapping has its own next-poll time kept in a heap: a thread that
+# had new comments is polled again after POLL_MIN_INTERVAL, a quiet one backs
+# off exponentially up to POLL_MAX_INTERVAL, and one with no activity for
+# POLL_ARCHIVE_AFTER seconds is archived and no longer polled. Only active
+# mappings are kept in memory, so a cycle costs O(due mappings) no matter how
+# many threads have been bridged over time. State is persisted in the poll_state
+# table so restarts keep the schedule.
+#
+# Activity is read off the sync cursors: a mapping whose cursor moved in either
+# direction during its poll had new comments. A cursor held back by a failed
+# comment (see sync_cursors.mark_stalled) also counts as activity, so the retry
+# is not backed off. With a RoutingTable, only the mappings of routes this
+# process owns are scheduled; other shards schedule (and archive) their own.
+
+import heapq
+import time
+
+import config
+from mapping_store import get_store
+from sync_cursors import REDDIT_TO_LEMMY, LEMMY_TO_REDDIT, mapping_scope, take_stalled
+from metrics import POLL_ACTIVE
+
+POLL_SCHEDULER_ENABLED = getattr(config, "POLL_SCHEDULER", True)
+POLL_MIN_INTERVAL = getattr(config, "POLL_MIN_INTERVAL", getattr(config, "SYNC_INTERVAL", 60))
+POLL_MAX_INTERVAL = getattr(config, "POLL_MAX_INTERVAL", 6 * 3600)
+POLL_BACKOFF_FACTOR = getattr(config, "POLL_BACKOFF_FACTOR", 2.0)
+# Seconds without activity after which a mapping is archived; None never archives.
+POLL_ARCHIVE_AFTER = getattr(config, "POLL_ARCHIVE_AFTER", 30 * 86400)
+
+class PollScheduler:
+    """
+    Priority queue of active mappings ordered by next poll time. Use as:
+
+        due = scheduler.due()
+        before = scheduler.cursor_positions(due)
+        try:
+            ... sync `due` ...
+        finally:
+            scheduler.complete(due, before)
+    """
+
+    def __init__(self, store=None, routing=None):
+        self.store = store or get_store()
+        self.routing = routing
+        self.mappings = {}  # mapping_id -> mapping row
+        self.state = {}  # mapping_id -> (next_poll_at, interval, last_activity_at)
+        self._heap = []
+        self._last_mapping_id = 0
+
+    def refresh(self):
+        """
+        Picks up mappings created (or revived, see MappingStore.revive_mapping)
+        since the last call; all active ones on the first.
+        """
+        for mapping, next_poll_at, interval, last_activity_at in self.store.get_active_poll_states(
+            self._last_mapping_id
+        ):
+            mapping_id = mapping[0]
+            self._last_mapping_id = max(self._last_mapping_id, mapping_id)
+            if mapping_id in self.mappings:
+                continue
+            if self.routing is not None and self.routing.route_for_mapping(mapping) is None:
+                continue  # another shard's mapping
+            self.mappings[mapping_id] = mapping
+            self.state[mapping_id] = (next_poll_at, interval or POLL_MIN_INTERVAL, last_activity_at or time.time())
+            heapq.heappush(self._heap, (next_poll_at, mapping_id))
+        POLL_ACTIVE.set(len(self.mappings))
+
+    def active_mappings(self):
+        """
+        Returns all mappings that are not archived.
+        """
+        self.refresh()
+        return list(self.mappings.values())
+
+    def due(self, now=None):
+        """
+        Removes and returns the mappings whose next poll time has passed. Each must
+        be handed back through complete().
+        """
+        self.refresh()
+        now = time.time() if now is None else now
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            next_poll_at, mapping_id = heapq.heappop(self._heap)
+            state = self.state.get(mapping_id)
+            if state is None or state[0] != next_poll_at:
+                continue  # superseded entry
+            due.append(self.mappings[mapping_id])
+        return due
+
+    def seconds_until_next(self, now=None):
+        """
+        Seconds until the next mapping is due (None if nothing is scheduled).
+        """
+        if not self._heap:
+            return None
+        now = time.time() if now is None else now
+        return max(0.0, self._heap[0][0] - now)
+
+    def cursor_positions(self, mappings):
+        """
+        Returns {mapping_id: (reddit cursor, lemmy cursor)} for the given mappings.
+        """
+        scopes = [mapping_scope(mapping[0]) for mapping in mappings]
+        if not scopes:
+            return {}
+        reddit = self.store.get_cursors(REDDIT_TO_LEMMY, scopes)
+        lemmy = self.store.get_cursors(LEMMY_TO_REDDIT, scopes)
+        return {
+            mapping[0]: (reddit.get(scope), lemmy.get(scope)) for mapping, scope in zip(mappings, scopes)
+        }
+
+    def complete(self, mappings, before, now=None):
+        """
+        Reschedules polled mappings: back to POLL_MIN_INTERVAL if a cursor moved
+        since `before` or is stalled on a failed comment, otherwise the interval grows by POLL_BACKOFF_FACTOR. Quiet
+        mappings past POLL_ARCHIVE_AFTER are archived. Persists all in one transaction.
+        """
+        now = time.time() if now is None else now
+        after = self.cursor_positions(mappings)
+        stalled = take_stalled(mapping_scope(mapping[0]) for mapping in mappings)
+        rows = []
+        for mapping in mappings:
+            mapping_id = mapping[0]
+            _, interval, last_activity_at = self.state[mapping_id]
+            if after.get(mapping_id) != before.get(mapping_id) or mapping_scope(mapping_id) in stalled:
+                interval = POLL_MIN_INTERVAL
+                last_activity_at = now
+            else:
+                interval = min(POLL_MAX_INTERVAL, interval * POLL_BACKOFF_FACTOR)
+            archived = POLL_ARCHIVE_AFTER is not None and now - last_activity_at >= POLL_ARCHIVE_AFTER
+            next_poll_at = now + interval
+            rows.append((mapping_id, next_poll_at, interval, last_activity_at, archived))
+            if archived:
+                del self.mappings[mapping_id]
+                del self.state[mapping_id]
+            else:
+                self.state[mapping_id] = (next_poll_at, interval, last_activity_at)
+                heapq.heappush(self._heap, (next_poll_at, mapping_id))
+        self.store.save_poll_states(rows)
+        POLL_ACTIVE.set(len(self.mappings))
@@ -0,0 +1,216 @@
+# ratelimit.py
+#
+# Shared rate-limit layer for all outbound Reddit and Lemmy requests. Every
+# (service, kind) pair -- e.g. ("lemmy", "write") -- gets its own token bucket,
+# so reads and writes have separate budgets. An endpoint ("METHOD /path") can
+# have a bucket of its own, e.g. Lemmy's comment and post creation and login,
+# which Lemmy limits separately; other requests fall back to their kind's
+# bucket. Buckets adapt to the server's
+# X-Ratelimit-Remaining/Reset headers and pause on 429 Retry-After, and part
+# of each bucket is reserved for high-priority work (replies to triggers) so
+# background reconciliation cannot starve it.
+
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+
+HIGH = 0        # user-visible writes, e.g. the reply to a trigger
+NORMAL = 1      # live sync traffic (default)
+BACKGROUND = 2  # polling / reconciliation passes
+
+# Per service and kind or endpoint: (tokens per second, burst capacity, share of
+# the service's header-reported budget). Reddit allows ~100 requests/minute per
+# OAuth client.
+DEFAULT_RATE_LIMITS = {
+    "reddit": {"read": (1.0, 5, 0.65), "write": (0.5, 3, 0.35)},
+    "lemmy": {
+        "read": (5.0, 10, 0.6),
+        "write": (0.5, 3, 0.1),
+        "POST /api/v3/comment": (1.0, 5, 0.2),
+        "POST /api/v3/post": (0.2, 2, 0.05),
+        "POST /api/v3/user/login": (0.1, 1, 0.05),
+    },
+}
+RATE_LIMITS = getattr(config, "RATE_LIMITS", DEFAULT_RATE_LIMITS)
+
+# Fraction of each bucket's capacity that only HIGH priority may use
+# (NORMAL may use half of it).
+HIGH_PRIORITY_RESERVE = getattr(config, "HIGH_PRIORITY_RESERVE", 0.25)
+
+class TokenBucket:
+    """
+    Thread-safe token bucket whose rate can be lowered by server feedback.
+    """
+
+    def __init__(self, rate, capacity):
+        self.configured_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.paused_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _threshold(self, priority):
+        reserve = self.capacity * HIGH_PRIORITY_RESERVE
+        if priority <= HIGH:
+            return 1.0
+        if priority == NORMAL:
+            return 1.0 + reserve / 2
+        return 1.0 + reserve
+
+    def try_acquire(self, priority=NORMAL):
+        """
+        Takes a token if the bucket allows it at this priority. Returns 0 on
+        success, otherwise the number of seconds to wait before trying again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self._refill(now)
+            needed = min(self._threshold(priority), self.capacity)
+            if self.tokens >= needed:
+                self.tokens -= 1.0
+                return 0.0
+            return (needed - self.tokens) / self.rate if self.rate > 0 else 1.0
+
+    def pause(self, seconds):
+        """
+        Blocks the bucket for `seconds` (e.g. after a 429 with Retry-After).
+        """
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+    def adapt(self, allowed_rate, remaining):
+        """
+        Caps the rate to what the server says is left in the current window.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(min(self.configured_rate, allowed_rate), 0.01)
+            self.tokens = min(self.tokens, max(remaining, 0.0))
+
+class RateLimiter:
+    """
+    Registry of token buckets keyed by (service, kind) or (service, endpoint).
+    """
+
+    def __init__(self, limits=RATE_LIMITS):
+        self.buckets = {}
+        self.shares = {}
+        for service, kinds in limits.items():
+            for kind, (rate, capacity, share) in kinds.items():
+                self.buckets[(service, kind)] = TokenBucket(rate, capacity)
+                self.shares[(service, kind)] = share
+        self._local = threading.local()
+
+    def bucket(self, service, kind, endpoint=None):
+        """
+        Returns the endpoint's bucket if it has one, else the kind's (or None).
+        """
+        if endpoint is not None:
+            bucket = self.buckets.get((service, endpoint))
+            if bucket is not None:
+                return bucket
+        return self.buckets.get((service, kind))
+
+    # --- Priority ------------------------------------------------------------
+
+    @property
+    def current_priority(self):
+        return getattr(self._local, "priority", NORMAL)
+
+    @contextmanager
+    def priority(self, level):
+        """
+        Runs the enclosed requests (on this thread) at the given priority.
+        """
+        previous = self.current_priority
+        self._local.priority = level
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    # --- Acquire -------------------------------------------------------------
+
+    def acquire(self, service, kind, priority=None, endpoint=None):
+        """
+        Blocks until a request of this kind (to `endpoint`, "METHOD /path") may be sent.
+        """
+        bucket = self.bucket(service, kind, endpoint)
+        if bucket is None:
+            return
+        priority = self.current_priority if priority is None else priority
+        while True:
+            wait = bucket.try_acquire(priority)
+            if wait <= 0:
+                return
+            time.sleep(min(wait, 5.0))
+
+    async def acquire_async(self, service, kind, priority=NORMAL, endpoint=None):
+        """
+        asyncio version of acquire().
+        """
+        bucket = self.bucket(service, kind, endpoint)
+        if bucket is None:
+            return
+        while True:
+            wait = bucket.try_acquire(priority)
+            if wait <= 0:
+                return
+            await asyncio.sleep(min(wait, 5.0))
+
+    # --- Feedback ------------------------------------------------------------
+
+    def observe(self, service, kind, status_code, headers, endpoint=None):
+        """
+        Feeds a response's rate-limit signals back into the buckets.
+        """
+        if status_code == 429:
+            retry_after = _parse_float(headers.get("Retry-After"))
+            bucket = self.bucket(service, kind, endpoint)
+            if bucket is not None:
+                bucket.pause(retry_after if retry_after is not None else 5.0)
+
+        remaining = _parse_float(headers.get("X-Ratelimit-Remaining"))
+        reset = _parse_float(headers.get("X-Ratelimit-Reset"))
+        if remaining is None or reset is None:
+            return
+        # The header budget is shared by every bucket of the service.
+        for (bucket_service, bucket_kind), bucket in self.buckets.items():
+            if bucket_service != service:
+                continue
+            share = self.shares[(bucket_service, bucket_kind)]
+            if remaining < 1:
+                bucket.pause(reset)
+            else:
+                bucket.adapt(remaining * share / max(reset, 1.0), remaining * share)
+
+def _parse_float(value):
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_rate_limiter():
+    """
+    Returns the process-wide RateLimiter shared by the Reddit and Lemmy clients.
+    """
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+        return _limiter
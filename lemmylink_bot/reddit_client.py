@@ -1,7 +1,46 @@
 # reddit_client.py
 
+import time
+from urllib.parse import urlparse
+
 import praw
+import prawcore
 import config
+from ratelimit import get_rate_limiter
+from metrics import REDDIT_API_LATENCY
+from capture import CAPTURE_FILE, CAPTURE_REDDIT_BODIES, REDDIT, record_response
+
+class RateLimitedRequestor(prawcore.Requestor):
+    """
+    prawcore Requestor that routes every Reddit API call through the shared
+    rate limiter and feeds Reddit's X-Ratelimit-* headers back into it.
+    """
+
+    def request(self, *args, **kwargs):
+        method = (args[0] if args else kwargs.get("method", "GET")).upper()
+        url = args[1] if len(args) > 1 else kwargs.get("url", "")
+        if "access_token" in url:
+            # OAuth token refreshes don't count against the API budget.
+            return super().request(*args, **kwargs)
+        kind = "read" if method == "GET" else "write"
+        endpoint = f"{method} {urlparse(url).path}"
+        limiter = get_rate_limiter()
+        limiter.acquire("reddit", kind, endpoint=endpoint)
+        start = time.monotonic()
+        try:
+            response = super().request(*args, **kwargs)
+        except Exception:
+            REDDIT_API_LATENCY.observe(time.monotonic() - start, method=method, status="error")
+            raise
+        latency = time.monotonic() - start
+        REDDIT_API_LATENCY.observe(latency, method=method, status=response.status_code)
+        if CAPTURE_FILE:
+            record_response(
+                REDDIT, method, urlparse(url).path, response.status_code, latency, response,
+                kwargs.get("params"), body=CAPTURE_REDDIT_BODIES
+            )
+        limiter.observe("reddit", kind, response.status_code, response.headers, endpoint)
+        return response
 
 def get_reddit_client():
     """
@@ -14,5 +53,6 @@ def get_reddit_client():
         username=config.REDDIT_USERNAME,
         password=config.REDDIT_PASSWORD,
         user_agent=config.REDDIT_USER_AGENT,
+        requestor_class=RateLimitedRequestor,
     )
     return reddit
@@ -0,0 +1,35 @@
+# reddit_ids.py
+#
+# Reddit IDs are base36 strings ("k3x9a1"); the database stores them as the
+# integers they encode, which makes rows and indexes smaller and comparisons cheaper.
+
+BASE36_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+def reddit_id_to_int(reddit_id):
+    """
+    Decodes a base36 Reddit ID (without the t1_/t3_ prefix) to an integer.
+    """
+    return int(reddit_id, 36)
+
+def int_to_reddit_id(number):
+    """
+    Encodes an integer back to its base36 Reddit ID.
+    """
+    digits = []
+    while True:
+        number, remainder = divmod(number, 36)
+        digits.append(BASE36_DIGITS[remainder])
+        if number == 0:
+            return "".join(reversed(digits))
+
+def encode_reddit_id(reddit_id):
+    """
+    reddit_id_to_int() that passes None through (for nullable columns).
+    """
+    return None if reddit_id is None else reddit_id_to_int(reddit_id)
+
+def decode_reddit_id(number):
+    """
+    int_to_reddit_id() that passes None through (for nullable columns).
+    """
+    return None if number is None else int_to_reddit_id(number)
@@ -0,0 +1,242 @@
+# routing.py
+#
+# Routing table for running many bridges in one deployment. Each route maps a
+# subreddit to a Lemmy community (optionally on its own instance/account). The
+# runtime reads one combined "sub1+sub2+..." stream for all routes it owns and
+# hands every item to that route's worker queue, so a slow route never stalls
+# the others. Routes can be split across several processes: each process owns
+# the routes whose stable hash falls into its shard.
+
+import os
+import queue
+import threading
+import zlib
+
+import config
+from lemmy_client import LemmyClient
+from metrics import record_error
+from stream_checkpoint import StreamProgress, SUBMISSIONS, COMMENTS
+
+# ROUTES = [
+#     {"subreddit": "fediverse", "community_id": 12},
+#     {"subreddit": "selfhosted", "community_id": 7, "lemmy_base_url": "https://other.example",
+#      "lemmy_username": "bot", "lemmy_password": "..."},
+# ]
+# Without ROUTES, a single route is built from SUBREDDIT_NAME / LEMMY_COMMUNITY_ID.
+ROUTES = getattr(config, "ROUTES", None)
+
+# This process owns the routes with shard_for(subreddit) == SHARD_INDEX. The
+# LEMMYLINK_SHARD environment variable ("index/count", e.g. "0/4") overrides the
+# config so several processes can share one config.py.
+SHARD_COUNT = getattr(config, "SHARD_COUNT", 1)
+SHARD_INDEX = getattr(config, "SHARD_INDEX", 0)
+if os.environ.get("LEMMYLINK_SHARD"):
+    SHARD_INDEX, SHARD_COUNT = (int(part) for part in os.environ["LEMMYLINK_SHARD"].split("/"))
+
+# Items buffered per route before the stream blocks (backpressure).
+ROUTE_QUEUE_SIZE = getattr(config, "ROUTE_QUEUE_SIZE", 1000)
+
+class Route:
+    """
+    One subreddit -> Lemmy community bridge.
+    """
+
+    def __init__(self, subreddit, community_id, lemmy_base_url=None, lemmy_username=None, lemmy_password=None):
+        self.subreddit = subreddit
+        self.community_id = community_id
+        self.lemmy_base_url = (lemmy_base_url or config.LEMMY_BASE_URL).rstrip("/")
+        self.lemmy_username = lemmy_username
+        self.lemmy_password = lemmy_password
+
+    @property
+    def key(self):
+        return self.subreddit.lower()
+
+    @property
+    def sync_only(self):
+        """
+        True for a route without a community (one removed from the config): it
+        keeps syncing existing bridges but never creates posts.
+        """
+        return self.community_id is None
+
+    def __repr__(self):
+        return f"Route(r/{self.subreddit} -> {self.lemmy_base_url} community {self.community_id})"
+
+def load_routes(routes=ROUTES):
+    """
+    Returns the configured routes as Route objects.
+    """
+    if not routes:
+        return [Route(config.SUBREDDIT_NAME, config.LEMMY_COMMUNITY_ID)]
+    return [Route(**route) for route in routes]
+
+def shard_for(subreddit, shard_count):
+    """
+    Stable shard number for a subreddit (same on every process and restart,
+    unlike hash()).
+    """
+    return zlib.crc32(subreddit.lower().encode("utf-8")) % shard_count
+
+class RoutingTable:
+    """
+    The routes owned by this process, plus one shared LemmyClient per instance.
+    """
+
+    def __init__(self, routes=None, shard_index=SHARD_INDEX, shard_count=SHARD_COUNT):
+        all_routes = routes if routes is not None else load_routes()
+        # Mappings written before routing existed have no subreddit; they belong
+        # to the first configured route.
+        self.default_route = all_routes[0]
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.all_routes = {route.key: route for route in all_routes}
+        self.routes = {
+            route.key: route for route in all_routes if shard_for(route.subreddit, shard_count) == shard_index
+        }
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+
+    def stream_name(self):
+        """
+        Name of the combined subreddit ("sub1+sub2+...") covering all owned routes.
+        """
+        return "+".join(route.subreddit for route in self.routes.values())
+
+    def route_for_subreddit(self, subreddit_name):
+        if not subreddit_name:
+            return None
+        return self.routes.get(subreddit_name.lower())
+
+    def route_for(self, item):
+        """
+        Returns the owned route of a stream submission/comment, or None.
+        """
+        # Stream items carry their subreddit name, so this doesn't trigger a fetch.
+        subreddit = getattr(item, "subreddit", None)
+        return self.route_for_subreddit(getattr(subreddit, "display_name", None))
+
+    def route_for_mapping(self, mapping):
+        """
+        Returns the route a mapping row belongs to (None if another shard owns it).
+        """
+        subreddit = mapping[5]
+        if not subreddit:
+            return self.routes.get(self.default_route.key)
+        if subreddit.lower() in self.all_routes:
+            return self.routes.get(subreddit.lower())
+        # The route has since been removed from the config: the shard its subreddit
+        # hashes to keeps syncing the existing bridges against the recorded instance,
+        # through a sync-only route.
+        if shard_for(subreddit, self.shard_count) != self.shard_index:
+            return None
+        return Route(subreddit, None, mapping[6])
+
+    # --- Lemmy clients -------------------------------------------------------
+
+    def lemmy_client_for_instance(self, base_url=None, username=None, password=None):
+        """
+        Returns the shared LemmyClient for an instance, creating it on first use.
+        Login is lazy (the client logs in on its first authenticated request).
+        """
+        base_url = (base_url or config.LEMMY_BASE_URL).rstrip("/")
+        with self._clients_lock:
+            client = self._clients.get(base_url)
+            if client is None:
+                if username is None:
+                    # Use the credentials of the first route configured for the instance.
+                    for route in self.all_routes.values():
+                        if route.lemmy_base_url == base_url and route.lemmy_username:
+                            username, password = route.lemmy_username, route.lemmy_password
+                            break
+                client = LemmyClient(base_url, username, password)
+                self._clients[base_url] = client
+            return client
+
+    def lemmy_client(self, route):
+        return self.lemmy_client_for_instance(route.lemmy_base_url, route.lemmy_username, route.lemmy_password)
+
+    def register_client(self, client):
+        """
+        Registers an existing (e.g. already logged-in) client for its instance.
+        """
+        with self._clients_lock:
+            self._clients.setdefault(client.base_url.rstrip("/"), client)
+
+    def mappings_by_client(self, mappings):
+        """
+        Groups the owned mappings by the LemmyClient of their instance.
+        Returns a list of (client, mappings, community_ids), where community_ids
+        are the communities of the owned routes on that instance.
+        """
+        groups = {}
+        for route in self.routes.values():
+            client = self.lemmy_client(route)
+            community_ids = groups.setdefault(id(client), (client, [], []))[2]
+            if not route.sync_only:
+                community_ids.append(route.community_id)
+        for mapping in mappings:
+            route = self.route_for_mapping(mapping)
+            if route is None:
+                continue
+            client = self.lemmy_client(route)
+            groups.setdefault(id(client), (client, [], []))[1].append(mapping)
+        return list(groups.values())
+
+class RouteDispatcher:
+    """
+    Hands stream items to per-route worker queues. It exposes handle_trigger()
+    and handle()/refresh_mappings(), so watch_submissions/watch_comments can use
+    it in place of a BridgeManager and a RedditCommentForwarder.
+    """
+
+    def __init__(self, routing, bridge_managers, forwarder=None):
+        self.routing = routing
+        self.bridge_managers = bridge_managers
+        self.forwarder = forwarder
+        self.queues = {key: queue.Queue(ROUTE_QUEUE_SIZE) for key in routing.routes}
+        # Per stream, so each checkpoint only waits for its own queued items
+        # (see stream_checkpoint.py).
+        self.progress = {SUBMISSIONS: StreamProgress(), COMMENTS: StreamProgress()}
+
+    def _progress_of(self, item):
+        # Submissions are "t3_" fullnames; comments (and comment triggers) "t1_".
+        return self.progress[SUBMISSIONS if item.fullname.startswith("t3_") else COMMENTS]
+
+    def _put(self, route_key, func, item):
+        self._progress_of(item).hold(item)
+        self.queues[route_key].put((func, item))
+
+    def handle_trigger(self, trigger):
+        route = self.routing.route_for(trigger)
+        if route is not None:
+            self._put(route.key, self.bridge_managers[route.key].handle_trigger, trigger)
+
+    def handle(self, comment):
+        route = self.routing.route_for(comment)
+        if route is None or self.forwarder is None:
+            return False
+        self._put(route.key, self.forwarder.handle, comment)
+        return True
+
+    def refresh_mappings(self, force=False):
+        if self.forwarder is not None:
+            self.forwarder.refresh_mappings(force)
+
+    def run_worker(self, route_key, stop_event):
+        """
+        Worker loop for one route: runs queued items in arrival order.
+        """
+        work = self.queues[route_key]
+        while not stop_event.is_set():
+            try:
+                func, item = work.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                func(item)
+            except Exception as e:
+                record_error(f"route:{route_key}")
+                print(f"[ERROR] Route r/{route_key}: failed to process {item.id}: {e}")
+            finally:
+                self._progress_of(item).done(item)
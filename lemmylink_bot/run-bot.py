@@ -1,18 +1,6 @@
-import subprocess
-import sys
-import time
+# Starts the whole bot (trigger streams + bidirectional sync) in a single process.
+# See runtime.py; main.py and bidirectional_sync.py can still be run on their own.
+from runtime import main
 
-# Start both processes
-proc_main = subprocess.Popen([sys.executable, "main.py"])
-proc_sync = subprocess.Popen([sys.executable, "bidirectional_sync.py"])
-
-try:
-    # Keep the main thread alive while both processes run.
-    while True:
-        time.sleep(1)
-except KeyboardInterrupt:
-    print("Terminating both processes...")
-    proc_main.terminate()
-    proc_sync.terminate()
-    proc_main.wait()
-    proc_sync.wait()
+if __name__ == "__main__":
+    main()
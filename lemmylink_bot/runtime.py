@@ -0,0 +1,205 @@
+# runtime.py
+#
+# Single-process bot runtime. Runs the submission trigger stream, the comment
+# stream (triggers + Reddit-to-Lemmy forwarding) and the sync scheduler as
+# supervised threads that share one Reddit client, one LemmyClient session per
+# Lemmy instance and one MappingStore connection. Both streams read the combined
+# "sub1+sub2+..." listing of every route this process owns (see routing.py) and
+# hand items to per-route worker threads.
+
+import random
+import threading
+import time
+
+import config
+from reddit_client import get_reddit_client
+from lemmy_client import LemmyClient
+from bridge_manager import BridgeManager
+from mapping_store import get_store
+from synced_index import get_synced_index
+from outbox import Outbox, OUTBOX_ENABLED, OUTBOX_WORKERS
+from routing import RoutingTable, RouteDispatcher
+from stream_sync import RedditCommentForwarder, RECONCILE_INTERVAL
+from bidirectional_sync import (
+    REDDIT_SYNC_MODE,
+    LEMMY_SYNC_MODE,
+    sync_reddit_to_lemmy_comments,
+    sync_lemmy_to_reddit
+)
+from main import watch_submissions, watch_comments
+from poll_scheduler import PollScheduler, POLL_SCHEDULER_ENABLED
+from sync_snapshot import SyncSnapshot
+from ratelimit import get_rate_limiter, BACKGROUND
+from metrics import MAPPINGS, OUTBOX_DEPTH, SYNC_CYCLE, record_error, start_metrics_server
+
+SYNC_INTERVAL = getattr(config, "SYNC_INTERVAL", 60)
+
+# Restart backoff for crashed tasks: jittered exponential between these bounds (seconds).
+SUPERVISOR_BACKOFF_BASE = getattr(config, "SUPERVISOR_BACKOFF_BASE", 1.0)
+SUPERVISOR_BACKOFF_MAX = getattr(config, "SUPERVISOR_BACKOFF_MAX", 300.0)
+# A task that ran this long before failing is considered healthy again (backoff resets).
+SUPERVISOR_HEALTHY_AFTER = 600
+
+class Supervisor:
+    """
+    Runs named long-lived tasks in daemon threads and restarts any task that raises
+    (or returns) with jittered exponential backoff, until stop() is called.
+    Each task is called as target(stop_event) and should return soon after the
+    event is set.
+    """
+
+    def __init__(self):
+        self.stop_event = threading.Event()
+        self._threads = []
+
+    def add(self, name, target):
+        thread = threading.Thread(target=self._run, args=(name, target), name=name, daemon=True)
+        self._threads.append(thread)
+
+    def _run(self, name, target):
+        failures = 0
+        while not self.stop_event.is_set():
+            started = time.monotonic()
+            try:
+                print(f"Supervisor: starting task '{name}'.")
+                target(self.stop_event)
+                if self.stop_event.is_set():
+                    return
+                print(f"Supervisor: task '{name}' exited unexpectedly.")
+            except Exception as e:
+                record_error(f"task:{name}")
+                print(f"[ERROR] Supervisor: task '{name}' crashed: {e}")
+
+            failures = 1 if time.monotonic() - started >= SUPERVISOR_HEALTHY_AFTER else failures + 1
+            ceiling = min(SUPERVISOR_BACKOFF_MAX, SUPERVISOR_BACKOFF_BASE * (2 ** (failures - 1)))
+            delay = random.uniform(ceiling / 2, ceiling)
+            print(f"Supervisor: restarting '{name}' in {delay:.1f}s.")
+            self.stop_event.wait(delay)
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=10):
+        self.stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+def _client_groups(lemmy, routing, reddit_mappings, lemmy_mappings):
+    """
+    Returns (client, reddit_mappings, lemmy_mappings, community_ids) per Lemmy
+    client. Without a RoutingTable everything goes through `lemmy`.
+    """
+    if routing is None:
+        return [(lemmy, reddit_mappings, lemmy_mappings, None)]
+    groups = {}
+    for client, mappings, community_ids in routing.mappings_by_client(reddit_mappings):
+        groups[id(client)] = [client, mappings, [], community_ids]
+    for client, mappings, community_ids in routing.mappings_by_client(lemmy_mappings):
+        groups.setdefault(id(client), [client, [], [], community_ids])[2] = mappings
+    return [tuple(group) for group in groups.values()]
+
+def run_sync_scheduler(reddit, lemmy, stop_event, outbox=None, routing=None):
+    """
+    Runs a sync cycle every SYNC_INTERVAL seconds. In stream mode the Reddit
+    direction is handled by the comment stream, so the full-tree poll only runs as
+    a reconciliation pass every RECONCILE_INTERVAL seconds.
+    With the PollScheduler, a cycle only polls the mappings that are due; the
+    passes that cover a whole community or reconcile the stream take all active
+    (not archived) mappings.
+    Polling runs at BACKGROUND priority so it cannot starve trigger replies.
+    With a RoutingTable, only the mappings of owned routes are synced, each
+    through the client of its Lemmy instance.
+    """
+    scheduler = PollScheduler(routing=routing) if POLL_SCHEDULER_ENABLED else None
+    snapshot = SyncSnapshot(reddit)
+    last_reconcile = None
+    while not stop_event.is_set():
+        print("Starting bidirectional comment sync...")
+        cycle_start = time.monotonic()
+        reconcile = REDDIT_SYNC_MODE != "stream" or (
+            last_reconcile is None or time.monotonic() - last_reconcile >= RECONCILE_INTERVAL
+        )
+        if reconcile and REDDIT_SYNC_MODE == "stream":
+            print("Running Reddit-to-Lemmy reconciliation pass...")
+            last_reconcile = time.monotonic()
+
+        if scheduler is None:
+            due = None
+            reddit_mappings = lemmy_mappings = None if routing is None else get_store().get_all_mappings(include_held=False)
+        else:
+            due = scheduler.due()
+            before = scheduler.cursor_positions(due)
+            active = scheduler.active_mappings()
+            reddit_mappings = active if REDDIT_SYNC_MODE == "stream" else due
+            lemmy_mappings = active if LEMMY_SYNC_MODE == "community" else due
+            print(f"Poll scheduler: {len(due)} of {len(active)} active mappings due.")
+        snapshot.start_cycle()
+        try:
+            with get_rate_limiter().priority(BACKGROUND):
+                for client, client_reddit, client_lemmy, community_ids in _client_groups(
+                    lemmy, routing, reddit_mappings, lemmy_mappings
+                ):
+                    if reconcile:
+                        sync_reddit_to_lemmy_comments(reddit, client, outbox, client_reddit, snapshot)
+                    sync_lemmy_to_reddit(reddit, client, outbox, client_lemmy, community_ids, snapshot)
+        finally:
+            if scheduler is not None:
+                scheduler.complete(due, before)
+        SYNC_CYCLE.observe(time.monotonic() - cycle_start)
+        print(f"Bidirectional sync complete. Waiting {SYNC_INTERVAL} seconds before next check...")
+        stop_event.wait(SYNC_INTERVAL)
+
+def build_runtime():
+    """
+    Creates the shared clients and a Supervisor with all bot tasks registered.
+    """
+    reddit = get_reddit_client()
+    lemmy = LemmyClient()
+    lemmy.ensure_login()
+    store = get_store()  # open the shared connection and create the schema up front
+    routing = RoutingTable()
+    routing.register_client(lemmy)
+    outbox = Outbox(reddit, lemmy, store, get_synced_index(), routing) if OUTBOX_ENABLED else None
+    MAPPINGS.set_function(store.count_mappings)
+    OUTBOX_DEPTH.set_function(store.count_jobs)
+
+    bridge_managers = {
+        key: BridgeManager(lemmy_client=routing.lemmy_client(route), outbox=outbox, route=route)
+        for key, route in routing.routes.items()
+    }
+    forwarder = None
+    if REDDIT_SYNC_MODE == "stream":
+        forwarder = RedditCommentForwarder(reddit, lemmy, outbox=outbox, routing=routing)
+    dispatcher = RouteDispatcher(routing, bridge_managers, forwarder)
+    comment_forwarder = dispatcher if forwarder is not None else None
+
+    supervisor = Supervisor()
+    if routing.routes:
+        subreddit = reddit.subreddit(routing.stream_name())
+        supervisor.add("submission-stream", lambda stop: watch_submissions(subreddit, dispatcher, stop))
+        supervisor.add("comment-stream", lambda stop: watch_comments(subreddit, dispatcher, comment_forwarder, stop))
+        for key in routing.routes:
+            supervisor.add(f"route-{key}", lambda stop, key=key: dispatcher.run_worker(key, stop))
+    else:
+        print(f"Shard {routing.shard_index}/{routing.shard_count} owns no routes; only draining the outbox.")
+    supervisor.add("sync-scheduler", lambda stop: run_sync_scheduler(reddit, lemmy, stop, outbox, routing))
+    if outbox is not None:
+        for worker in range(OUTBOX_WORKERS):
+            supervisor.add(f"outbox-worker-{worker}", outbox.run_worker)
+    return supervisor, routing
+
+def main():
+    supervisor, routing = build_runtime()
+    start_metrics_server()
+    supervisor.start()
+    print(f"LemmyLink runtime started for r/{routing.stream_name() or '(none)'}.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Stopping LemmyLink runtime...")
+        supervisor.stop()
+
+if __name__ == "__main__":
+    main()
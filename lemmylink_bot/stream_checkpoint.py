@@ -0,0 +1,231 @@
+# stream_checkpoint.py
+#
+# Durable checkpoints for the Reddit submission and comment streams. A bare
+# stream(skip_existing=True) drops everything posted while the bot was down, so
+# each stream consumer records the newest item it has handled (created_utc and
+# fullname) in the sync_cursor table. On startup it first catches up from the
+# subreddit listing back to that checkpoint -- bounded by STREAM_CATCHUP_LIMIT
+# items and STREAM_CATCHUP_MAX_AGE seconds -- replays those items oldest first,
+# and only then switches to the live stream.
+#
+# Checkpoint writes are batched: at most one per STREAM_CHECKPOINT_INTERVAL
+# seconds while items flow, plus one whenever the stream goes idle and one on
+# shutdown. A crash can therefore replay a few seconds of items, which the
+# trigger and comment handlers already tolerate (mappings are unique per
+# submission, synced comments are skipped).
+#
+# A consumer that hands items on to worker queues (routing.RouteDispatcher)
+# passes a StreamProgress per stream and marks the items it queues as held until
+# a worker is done with them. The checkpoint then only moves up to the low-water
+# mark -- the newest item that, with every item before it, has been handled -- so
+# a crash never skips queued items and a busy stream still checkpoints.
+
+import threading
+import time
+from collections import deque
+
+import config
+from mapping_store import get_store
+from reddit_ids import reddit_id_to_int
+
+STREAM_CHECKPOINTS = getattr(config, "STREAM_CHECKPOINTS", True)
+# Reddit listings stop at 1000 items; anything older than that is lost anyway.
+STREAM_CATCHUP_LIMIT = getattr(config, "STREAM_CATCHUP_LIMIT", 1000)
+# Items older than this many seconds are not caught up (None for no limit).
+STREAM_CATCHUP_MAX_AGE = getattr(config, "STREAM_CATCHUP_MAX_AGE", 24 * 3600)
+STREAM_CHECKPOINT_INTERVAL = getattr(config, "STREAM_CHECKPOINT_INTERVAL", 5)
+
+SUBMISSIONS = "submissions"
+COMMENTS = "comments"
+
+def stream_scope(subreddit):
+    """
+    Returns the checkpoint scope key for a (possibly combined "a+b") subreddit.
+    """
+    return f"stream:{subreddit.display_name}"
+
+def _order(position):
+    # Fullnames are "t1_<base36>"; compare the decoded ID so "zz" sorts before "100".
+    created_utc, fullname = position
+    return (created_utc, reddit_id_to_int(fullname.split("_", 1)[-1]))
+
+class StreamProgress:
+    """
+    The items of one stream that are yielded but not handled yet, in stream
+    order. checkpointed_stream() starts and settles each item; a consumer that
+    hands an item to another thread holds it first and marks it done when
+    finished. Thread-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items = deque()  # [position, state] in stream order
+        self._by_name = {}  # fullname -> its entry
+
+    def start(self, item):
+        entry = [(item.created_utc, item.fullname), "started"]
+        with self._lock:
+            self._items.append(entry)
+            self._by_name[item.fullname] = entry
+
+    def hold(self, item):
+        """
+        Keeps an item unhandled after the stream moves on, until done(item).
+        """
+        self._set(item, "held", "started")
+
+    def settle(self, item):
+        # The stream's caller returned: done unless it held the item.
+        self._set(item, "done", "started")
+
+    def done(self, item):
+        self._set(item, "done")
+
+    def _set(self, item, state, only_from=None):
+        with self._lock:
+            entry = self._by_name.get(item.fullname)
+            if entry is not None and (only_from is None or entry[1] == only_from):
+                entry[1] = state
+
+    def low_water(self):
+        """
+        Returns the position of the newest item that is done along with every
+        item before it, if any became so since the last call.
+        """
+        position = None
+        with self._lock:
+            while self._items and self._items[0][1] == "done":
+                entry = self._items.popleft()
+                position = entry[0]
+                if self._by_name.get(position[1]) is entry:
+                    del self._by_name[position[1]]
+        return position
+
+class StreamCheckpoint:
+    """
+    The newest handled (created_utc, fullname) of one stream consumer, stored as a
+    sync_cursor row with the consumer as its direction.
+    """
+
+    def __init__(self, scope, consumer, store=None, progress=None):
+        self.store = store or get_store()
+        self.scope = scope
+        self.consumer = consumer
+        self.progress = progress
+        self.position = self.store.get_cursor(scope, consumer)
+        self._saved = self.position
+        self._last_flush = time.monotonic()
+
+    def is_new(self, item):
+        """
+        True if the item is past the checkpoint.
+        """
+        return self.position is None or _order((item.created_utc, item.fullname)) > _order(self.position)
+
+    def start(self, item):
+        """
+        Called before an item is handed to the consumer.
+        """
+        if self.progress is not None:
+            self.progress.start(item)
+
+    def advance(self, item):
+        """
+        Called once the consumer returned from an item. With a StreamProgress
+        the position moves to its low-water mark instead.
+        """
+        if self.progress is not None:
+            self.progress.settle(item)
+            self._advance_to(self.progress.low_water())
+        elif self.is_new(item):
+            self.position = (item.created_utc, item.fullname)
+
+    def _advance_to(self, position):
+        if position is not None and (self.position is None or _order(position) > _order(self.position)):
+            self.position = position
+
+    def flush(self, force=False):
+        """
+        Writes the position if it moved and, unless `force`, the last write is
+        at least STREAM_CHECKPOINT_INTERVAL seconds old.
+        """
+        if self.progress is not None:
+            self._advance_to(self.progress.low_water())
+        if self.position == self._saved:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < STREAM_CHECKPOINT_INTERVAL:
+            return
+        self.store.set_cursor(self.scope, self.consumer, self.position)
+        self._saved = self.position
+        self._last_flush = now
+
+def catch_up(listing, checkpoint, limit=STREAM_CATCHUP_LIMIT, max_age=STREAM_CATCHUP_MAX_AGE):
+    """
+    Returns the items of a newest-first `listing` (e.g. subreddit.new) that are
+    past the checkpoint, oldest first. Returns nothing without a checkpoint.
+    """
+    if checkpoint.position is None:
+        return []
+    oldest = None if max_age is None else time.time() - max_age
+    backlog = []
+    for item in listing(limit=limit):
+        if not checkpoint.is_new(item):
+            break
+        if oldest is not None and item.created_utc < oldest:
+            print(f"[WARN] Stream catch-up for {checkpoint.scope} {checkpoint.consumer} stopped at the "
+                  f"{max_age}s age limit; older items are skipped.")
+            break
+        backlog.append(item)
+    else:
+        if len(backlog) >= limit:
+            print(f"[WARN] Stream catch-up for {checkpoint.scope} {checkpoint.consumer} hit the "
+                  f"{limit} item listing limit; older items are skipped.")
+    backlog.reverse()
+    return backlog
+
+def checkpointed_stream(subreddit, kind, consumer=None, store=None, progress=None):
+    """
+    Yields new `kind` ("submissions" or "comments") items of a subreddit like
+    subreddit.stream.<kind>(pause_after=0), None included, but starting from the
+    consumer's checkpoint instead of "now". An item is checkpointed when the next
+    one is requested, i.e. after the caller handled it. `consumer` names the
+    checkpoint (defaults to `kind`) so independent readers of one stream don't
+    share it. A caller that handles items asynchronously passes a
+    StreamProgress and holds the items it hands on (see StreamProgress.hold).
+    """
+    stream = getattr(subreddit.stream, kind)
+    if not STREAM_CHECKPOINTS:
+        yield from stream(skip_existing=True, pause_after=0)
+        return
+    listing = subreddit.new if kind == SUBMISSIONS else subreddit.comments
+    checkpoint = StreamCheckpoint(stream_scope(subreddit), consumer or kind, store, progress)
+    try:
+        backlog = catch_up(listing, checkpoint)
+        if backlog:
+            print(f"Catching up on {len(backlog)} {kind} in r/{subreddit.display_name} "
+                  f"posted since the last checkpoint...")
+        for item in backlog:
+            checkpoint.start(item)
+            yield item
+            checkpoint.advance(item)
+            checkpoint.flush()
+
+        # When resuming, the stream's first batch overlaps what was just handled;
+        # skip those items until its first idle poll. Later items are always
+        # yielded, even if they surface with an older created_utc.
+        resuming = checkpoint.position is not None
+        for item in stream(skip_existing=not resuming, pause_after=0):
+            if item is None:
+                resuming = False
+                checkpoint.flush(force=True)
+                yield None
+                continue
+            if resuming and not checkpoint.is_new(item):
+                continue
+            checkpoint.start(item)
+            yield item
+            checkpoint.advance(item)
+            checkpoint.flush()
+    finally:
+        checkpoint.flush(force=True)
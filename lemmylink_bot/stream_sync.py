@@ -0,0 +1,112 @@
+# stream_sync.py
+#
+# Event-driven Reddit -> Lemmy comment sync. Instead of polling every mapped
+# submission's full comment tree, consume the subreddit comment stream once and
+# forward each comment whose submission is mapped as soon as it arrives. A full
+# tree poll (sync_reddit_to_lemmy_comments) only runs as a periodic
+# reconciliation pass to catch anything the stream missed.
+
+import time
+
+import config
+from reddit_client import get_reddit_client
+from lemmy_client import LemmyClient
+from mapping_store import get_store
+from synced_index import get_synced_index
+from bidirectional_sync import sync_reddit_thread_to_lemmy, sync_reddit_to_lemmy_comments
+from metrics import record_error
+from stream_checkpoint import checkpointed_stream, COMMENTS
+
+# Seconds between full-tree reconciliation passes.
+RECONCILE_INTERVAL = getattr(config, "RECONCILE_INTERVAL", 3600)
+
+# Seconds between reloads of newly created mappings into the in-memory set.
+MAPPING_REFRESH_INTERVAL = getattr(config, "MAPPING_REFRESH_INTERVAL", 30)
+
+class RedditCommentForwarder:
+    """
+    Holds an in-memory reddit_submission_id -> (lemmy_post_id, lemmy_instance)
+    index of mapped submissions and forwards stream comments that belong to one
+    of them. With a RoutingTable, posts on other Lemmy instances are written
+    through that instance's client.
+    """
+
+    def __init__(self, reddit, lemmy, store=None, index=None, outbox=None, routing=None):
+        self.reddit = reddit
+        self.lemmy = lemmy
+        self.outbox = outbox
+        self.routing = routing
+        self.store = store or get_store()
+        self.index = index or get_synced_index()
+        self.lemmy_post_by_submission = {}
+        self._last_mapping_row_id = 0
+        self._last_refresh = 0.0
+
+    def refresh_mappings(self, force=False):
+        """
+        Loads mappings created since the last refresh (by row ID).
+        """
+        now = time.monotonic()
+        if not force and now - self._last_refresh < MAPPING_REFRESH_INTERVAL:
+            return
+        self._last_refresh = now
+        for mapping in self.store.get_mappings_after(self._last_mapping_row_id):
+            # The first mapping of a submission wins, matching the poll-based sync.
+            self.lemmy_post_by_submission.setdefault(mapping[1], (mapping[3], mapping[6]))
+            self._last_mapping_row_id = mapping[0]
+
+    def handle(self, comment):
+        """
+        Forwards a stream comment to Lemmy if its submission is mapped.
+        Returns True if the comment belonged to a mapped submission.
+        """
+        # link_id is the submission fullname, e.g. "t3_abc123".
+        submission_id = comment.link_id.split("_", 1)[-1]
+        target = self.lemmy_post_by_submission.get(submission_id)
+        if target is None:
+            return False
+        lemmy_post_id, lemmy_instance = target
+        lemmy = self.lemmy
+        if self.routing is not None and lemmy_instance:
+            lemmy = self.routing.lemmy_client_for_instance(lemmy_instance)
+        # No cursor here: a comment that fails is left for the reconciliation pass,
+        # which owns cursor advancement.
+        sync_reddit_thread_to_lemmy(
+            self.reddit, lemmy, self.index, [comment], lemmy_post_id, outbox=self.outbox
+        )
+        return True
+
+def run_stream_sync(reddit, lemmy, subreddit_name=None):
+    """
+    Consumes the subreddit comment stream forever, forwarding mapped comments to
+    Lemmy and running a reconciliation pass every RECONCILE_INTERVAL seconds.
+    """
+    subreddit = reddit.subreddit(subreddit_name or config.SUBREDDIT_NAME)
+    forwarder = RedditCommentForwarder(reddit, lemmy)
+    forwarder.refresh_mappings(force=True)
+    last_reconcile = None  # reconcile once at startup to cover downtime
+    print(f"Streaming comments from r/{subreddit.display_name} for Reddit-to-Lemmy sync...")
+
+    # The stream yields None whenever a poll returns nothing new, which gives us a
+    # chance to do housekeeping between bursts. It has its own checkpoint, apart
+    # from main.py's comment stream.
+    for comment in checkpointed_stream(subreddit, COMMENTS, consumer="comment_sync"):
+        if comment is not None:
+            try:
+                forwarder.handle(comment)
+            except Exception as e:
+                record_error("forward")
+                print(f"Error forwarding Reddit comment {comment.id}: {e}")
+
+        # Both checks are time-gated, so they are cheap on every item.
+        forwarder.refresh_mappings()
+        if last_reconcile is None or time.monotonic() - last_reconcile >= RECONCILE_INTERVAL:
+            print("Running Reddit-to-Lemmy reconciliation pass...")
+            sync_reddit_to_lemmy_comments(reddit, lemmy)
+            last_reconcile = time.monotonic()
+
+if __name__ == "__main__":
+    reddit = get_reddit_client()
+    lemmy = LemmyClient()
+    lemmy.ensure_login()
+    run_stream_sync(reddit, lemmy)
@@ -0,0 +1,139 @@
+# sync_cursors.py
+#
+# Per-mapping high-water marks for the comment sync. Each direction remembers how
+# far it got in a thread (newest Reddit created_utc/ID, highest Lemmy comment ID)
+# so a cycle only looks at comments past that point. Cursors are stored in the
+# sync_cursor table and advanced in the same transaction as the comment mappings.
+
+import threading
+
+import config
+
+REDDIT_TO_LEMMY = "reddit_to_lemmy"
+LEMMY_TO_REDDIT = "lemmy_to_reddit"
+
+# A comment that keeps failing (deleted parent, rejected with a 4xx, ...) blocks
+# its thread's cursor for this many attempts; after that it is logged and skipped
+# so the cursor can move past it. Attempts are counted per process.
+SYNC_MAX_COMMENT_ATTEMPTS = getattr(config, "SYNC_MAX_COMMENT_ATTEMPTS", 5)
+
+_failed_attempts = {}  # (direction, comment ID) -> failed attempts
+_failed_attempts_lock = threading.Lock()
+
+def record_failed_attempt(direction, comment_id):
+    """
+    Counts a failed attempt to sync a comment and returns the number so far.
+    """
+    key = (direction, comment_id)
+    with _failed_attempts_lock:
+        _failed_attempts[key] = _failed_attempts.get(key, 0) + 1
+        return _failed_attempts[key]
+
+# Scopes whose cursor is held back by a failed comment awaiting retry. The poll
+# scheduler treats them as active, so a stalled thread is not backed off (or
+# archived) as quiet.
+_stalled_scopes = set()
+_stalled_scopes_lock = threading.Lock()
+
+def mark_stalled(scope):
+    """
+    Notes that a scope's cursor stopped before a comment that will be retried.
+    """
+    with _stalled_scopes_lock:
+        _stalled_scopes.add(scope)
+
+def take_stalled(scopes):
+    """
+    Returns which of `scopes` were marked stalled, and forgets them.
+    """
+    with _stalled_scopes_lock:
+        stalled = _stalled_scopes.intersection(scopes)
+        _stalled_scopes.difference_update(stalled)
+        return stalled
+
+# Reddit comments can surface a little after their created_utc (spam filter, mod
+# approval), so the Reddit cursor is re-checked this many seconds back. The synced
+# index makes the overlap cheap.
+CURSOR_GRACE_SECONDS = getattr(config, "CURSOR_GRACE_SECONDS", 300)
+
+def mapping_scope(mapping_id):
+    """
+    Returns the cursor scope key for a mapping row.
+    """
+    return f"mapping:{mapping_id}"
+
+def community_scope(community_id):
+    """
+    Returns the cursor scope key for a whole Lemmy community.
+    """
+    return f"community:{community_id}"
+
+class CursorAdvance:
+    """
+    Tracks how far a cursor may move while walking comments oldest-first: it follows
+    each handled comment (never moving backwards) and stops at the first failure,
+    so a failed comment is retried on the next cycle -- up to
+    SYNC_MAX_COMMENT_ATTEMPTS times, then it is skipped.
+    """
+
+    def __init__(self, cursor):
+        self.start = cursor
+        self.position = cursor
+        self._blocked = False
+
+    def done(self, position):
+        if self._blocked:
+            return
+        if self.position is None or position > self.position:
+            self.position = position
+
+    def failed(self, position=None, direction=None, comment_id=None):
+        """
+        Stops the cursor before a comment that failed, unless the comment (given by
+        direction and comment_id) has used up its attempts: then the cursor moves
+        past it like past a handled comment.
+        """
+        if comment_id is not None:
+            attempts = record_failed_attempt(direction, comment_id)
+            if attempts >= SYNC_MAX_COMMENT_ATTEMPTS:
+                if attempts == SYNC_MAX_COMMENT_ATTEMPTS:
+                    print(f"[WARN] Giving up on {direction} comment {comment_id} after {attempts} failed "
+                          f"attempts; the cursor moves past it.")
+                self.done(position)
+                return
+        self._blocked = True
+
+    @property
+    def blocked(self):
+        return self._blocked
+
+    @property
+    def moved(self):
+        return self.position != self.start
+
+def reddit_comments_after(comments, cursor):
+    """
+    Returns the Reddit comments at or after the cursor (minus the grace window),
+    oldest first. `cursor` is (last_created_utc, last_id) or None.
+    """
+    ordered = sorted(comments, key=lambda comment: (comment.created_utc, comment.id))
+    if cursor is None or cursor[0] is None:
+        return ordered
+    threshold = cursor[0] - CURSOR_GRACE_SECONDS
+    return [comment for comment in ordered if comment.created_utc >= threshold]
+
+def lemmy_cursor(cursor):
+    """
+    Normalizes a stored Lemmy cursor to (None, last_id as int), or None.
+    """
+    if cursor is None or cursor[1] is None:
+        return None
+    return (None, int(cursor[1]))
+
+def lemmy_comments_after(comment_datas, cursor):
+    """
+    Returns the Lemmy comment dicts with an ID above the cursor, lowest ID first.
+    """
+    last_id = cursor[1] if cursor is not None else 0
+    with_ids = [data for data in comment_datas if data.get("id") and data["id"] > last_id]
+    return sorted(with_ids, key=lambda data: data["id"])
@@ -0,0 +1,190 @@
+# sync_snapshot.py
+#
+# Cycle-scoped fetch cache for the comment sync. Both directions of a cycle go
+# through one SyncSnapshot: the mapping list is loaded once, and each thread's
+# Reddit comment tree and Lemmy comment list are fetched at most once per cycle.
+#
+# Each direction also uses what was fetched for the other to detect echoes:
+# copies the bot already made but whose mapping row is missing (e.g. lost to a
+# crash between posting and recording). Without this, a Reddit comment would be
+# bridged to Lemmy twice, or the bot's Lemmy copy would be sent back to Reddit.
+#
+# Threads that turned out cold (no Reddit comment for COLD_THREAD_AGE seconds, or
+# no new Lemmy comments) are not fetched again for SYNC_SNAPSHOT_TTL seconds. The
+# poll scheduler already polls quiet threads rarely, so the TTL defaults to 0
+# (fetch every cycle) when it is enabled.
+
+import re
+import time
+
+import config
+from mapping_store import get_store
+from comment_tree import walk_comment_tree
+from metrics import record_error
+from poll_scheduler import POLL_SCHEDULER_ENABLED
+from sync_cursors import mapping_scope
+
+SYNC_SNAPSHOT_TTL = getattr(config, "SYNC_SNAPSHOT_TTL", 0 if POLL_SCHEDULER_ENABLED else 300)
+
+# A Reddit thread whose newest comment is older than this (seconds) is cold.
+COLD_THREAD_AGE = 3600
+
+# The Reddit permalink in the header of a bridged comment (see
+# bidirectional_sync.format_reddit_comment_for_lemmy); its last path segment is
+# the Reddit comment ID.
+BRIDGED_LINK = re.compile(r"\(\[Link to Reddit Comment\]\(https://www\.reddit\.com/[^)\s]*?/(\w+)/?\)\)")
+
+REDDIT = "reddit"
+LEMMY = "lemmy"
+
+def bridged_reddit_id(lemmy_comment, lemmy_username=None):
+    """
+    Returns the Reddit comment ID a Lemmy comment entry is the bot's copy of, or None.
+    With `lemmy_username`, only comments written by that account qualify.
+    """
+    view = lemmy_comment.get("comment_view", lemmy_comment)
+    creator = view.get("creator", {}).get("name") or ""
+    if lemmy_username and creator.lower() != lemmy_username.lower():
+        return None
+    content = view.get("comment", {}).get("content", "")
+    if not content.startswith("From Reddit user "):
+        return None
+    match = BRIDGED_LINK.search(content)
+    return match.group(1) if match else None
+
+class SyncSnapshot:
+    """
+    Fetch cache shared by both sync directions. Call start_cycle() before each
+    cycle: per-cycle data is dropped, only the cold-thread marks are kept.
+    """
+
+    def __init__(self, reddit, ttl=SYNC_SNAPSHOT_TTL, store=None):
+        self.reddit = reddit
+        self.ttl = ttl
+        self.store = store or get_store()
+        self._cold = {}  # (side, mapping_id) -> time the thread was found cold
+        self.start_cycle()
+
+    def start_cycle(self, mappings=None):
+        """
+        Begins a new cycle. `mappings`, if given, is returned by mappings().
+        """
+        now = time.time()
+        self._mappings = mappings
+        self._walked = set()  # mapping IDs whose Reddit tree was fetched this cycle
+        self._lemmy = {}  # mapping_id -> new Lemmy comment entries, or None if the fetch failed
+        self._cold = {key: since for key, since in self._cold.items() if now - since < self.ttl}
+
+    def mappings(self):
+        """
+        Returns the cycle's mappings, loading all mappings once if none were given.
+        """
+        if self._mappings is None:
+            self._mappings = self.store.get_all_mappings(include_held=False)
+        return self._mappings
+
+    def reddit_batches(self, mapping, submission):
+        """
+        Yields the (comments, branch) batches of walk_comment_tree() for a mapping,
+        or nothing if its tree was already fetched this cycle or is cold.
+        Batches are not kept.
+        """
+        mapping_id = mapping[0]
+        if mapping_id in self._walked or (REDDIT, mapping_id) in self._cold:
+            return
+        self._walked.add(mapping_id)
+        newest = 0
+        for comments, branch in walk_comment_tree(self.reddit, submission, mapping_scope(mapping_id)):
+            for comment in comments:
+                newest = max(newest, comment.created_utc)
+            yield comments, branch
+        if time.time() - newest >= COLD_THREAD_AGE:
+            self._cold[(REDDIT, mapping_id)] = time.time()
+
+    def lemmy_comments(self, lemmy, mapping, cursor):
+        """
+        Returns the Lemmy comments of a mapping's post newer than `cursor`
+        (newest first), fetching them once per cycle. Returns [] for a cold post
+        and None if the fetch failed or there is no cursor yet (a first sync is
+        streamed by lemmy_pages() instead of being held in memory).
+        """
+        mapping_id = mapping[0]
+        if mapping_id in self._lemmy:
+            return self._lemmy[mapping_id]
+        if (LEMMY, mapping_id) in self._cold:
+            return []
+        if cursor is None:
+            return None
+        lemmy_post_id = mapping[3]
+        try:
+            # Newest first, stopping at the cursor: only comments since the last
+            # cycle are fetched. A partial fetch is discarded so nothing is skipped.
+            comments = list(lemmy.iter_comments(lemmy_post_id, sort="New", stop_at_id=cursor[1]))
+        except Exception as e:
+            record_error("lemmy_fetch")
+            print(f"Error fetching comments from Lemmy for post {lemmy_post_id}: {e}")
+            comments = None
+        if comments == []:
+            self._cold[(LEMMY, mapping_id)] = time.time()
+        self._lemmy[mapping_id] = comments
+        return comments
+
+    def lemmy_pages(self, lemmy, mapping, cursor):
+        """
+        Yields the Lemmy comments of a mapping's post newer than `cursor` in pages.
+        With a cursor this is lemmy_comments() as a single page. Without one (the
+        thread's first sync) the post is walked oldest first, one API page at a
+        time, so the caller can move the cursor after each page. A failed fetch is
+        logged and ends the pages.
+        """
+        if cursor is not None:
+            comments = self.lemmy_comments(lemmy, mapping, cursor)
+            if comments:
+                yield comments
+            return
+        mapping_id = mapping[0]
+        if (LEMMY, mapping_id) in self._cold:
+            return
+        lemmy_post_id = mapping[3]
+        pages = lemmy.iter_comment_pages(lemmy_post_id, sort="Old")
+        found = False
+        while True:
+            try:
+                comments = next(pages, None)
+            except Exception as e:
+                record_error("lemmy_fetch")
+                print(f"Error fetching comments from Lemmy for post {lemmy_post_id}: {e}")
+                return
+            if comments is None:
+                break
+            found = True
+            yield comments
+        if not found:
+            self._cold[(LEMMY, mapping_id)] = time.time()
+
+    def reddit_echoes(self, lemmy, mapping):
+        """
+        Returns {reddit_comment_id: lemmy_comment_id} for the bot's Lemmy copies
+        among this cycle's Lemmy comments of a mapping (nothing is fetched).
+        """
+        echoes = {}
+        for comment in self._lemmy.get(mapping[0]) or ():
+            reddit_comment_id = bridged_reddit_id(comment, lemmy.username)
+            if reddit_comment_id is not None:
+                echoes.setdefault(reddit_comment_id, comment.get("comment_view", comment)["comment"]["id"])
+        return echoes
+
+    def lemmy_echoes(self, lemmy, mapping, lemmy_comments):
+        """
+        Returns {lemmy_comment_id: reddit_comment_id} for Lemmy comments that must
+        not be posted to Reddit: the bot's own copies of Reddit comments. Only
+        comments written by the bot's Lemmy account with a bridged header match,
+        so a user's comment is never taken for an echo because of its text.
+        """
+        echoes = {}
+        for comment in lemmy_comments:
+            data = comment.get("comment_view", comment).get("comment", {})
+            reddit_comment_id = bridged_reddit_id(comment, lemmy.username)
+            if reddit_comment_id is not None:
+                echoes[data["id"]] = reddit_comment_id
+        return echoes
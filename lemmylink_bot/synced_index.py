@@ -0,0 +1,169 @@
+# synced_index.py
+#
+# In-process membership index of synced Reddit and Lemmy comment IDs. It is
+# warm-loaded from comment_mapping at startup so the sync loop can answer
+# "already synced?" from memory; only IDs the index has never seen are confirmed
+# against the database. The database stays the source of truth for writes.
+
+import threading
+from array import array
+from bisect import bisect_left
+from heapq import merge
+
+import config
+from mapping_store import get_store
+from reddit_ids import reddit_id_to_int, int_to_reddit_id
+
+# "set" keeps plain Python sets (fastest, ~70+ bytes per ID).
+# "array" keeps sorted 64-bit integer arrays (8 bytes per ID) for very large tables.
+SYNCED_INDEX_MODE = getattr(config, "SYNCED_INDEX_MODE", "set")
+
+# Rows fetched per query while warm-loading.
+LOAD_BATCH_SIZE = 10000
+
+# New IDs are buffered in a small set and merged into the sorted array in bulk.
+ARRAY_MERGE_THRESHOLD = 4096
+
+class SortedIdArray:
+    """
+    Compact set of integer IDs: a sorted array('q') plus a small pending buffer.
+    """
+
+    def __init__(self):
+        self._sorted = array("q")
+        self._pending = set()
+
+    def __len__(self):
+        return len(self._sorted) + len(self._pending)
+
+    def __contains__(self, value):
+        if value in self._pending:
+            return True
+        i = bisect_left(self._sorted, value)
+        return i < len(self._sorted) and self._sorted[i] == value
+
+    def add(self, value):
+        if value in self:
+            return
+        self._pending.add(value)
+        if len(self._pending) >= ARRAY_MERGE_THRESHOLD:
+            self._merge()
+
+    def extend_sorted(self, values):
+        """
+        Appends unique ints that sort after everything already loaded (a warm-load
+        in ascending order), without a temporary list or re-sort.
+        """
+        self._sorted.extend(values)
+
+    def _merge(self):
+        self._sorted = array("q", merge(self._sorted, sorted(self._pending)))
+        self._pending = set()
+
+class SyncedIndex:
+    """
+    Memory-resident view of which Reddit/Lemmy comment IDs already have a mapping.
+    """
+
+    def __init__(self, store, mode=SYNCED_INDEX_MODE):
+        if mode not in ("set", "array"):
+            raise ValueError(f"Unknown SYNCED_INDEX_MODE: {mode!r}")
+        self.store = store
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._reddit = set() if mode == "set" else SortedIdArray()
+        self._lemmy = set() if mode == "set" else SortedIdArray()
+
+    def __len__(self):
+        return len(self._reddit)
+
+    def _reddit_key(self, reddit_comment_id):
+        return reddit_comment_id if self.mode == "set" else reddit_id_to_int(reddit_comment_id)
+
+    def load(self):
+        """
+        Warm-loads every mapped ID from comment_mapping, LOAD_BATCH_SIZE rows at a
+        time. IDs arrive in ascending order, so array mode appends each batch
+        straight to its sorted arrays (Reddit IDs as stored integers) and peak
+        memory stays at the arrays plus one batch.
+        """
+        if self.mode == "set":
+            reddit, lemmy = set(), set()
+            for batch in self.store.iter_comment_mapping_ids("reddit_comment_id", LOAD_BATCH_SIZE):
+                reddit.update(map(int_to_reddit_id, batch))
+            for batch in self.store.iter_comment_mapping_ids("lemmy_comment_id", LOAD_BATCH_SIZE):
+                lemmy.update(batch)
+        else:
+            reddit, lemmy = SortedIdArray(), SortedIdArray()
+            for batch in self.store.iter_comment_mapping_ids("reddit_comment_id", LOAD_BATCH_SIZE):
+                reddit.extend_sorted(batch)
+            for batch in self.store.iter_comment_mapping_ids("lemmy_comment_id", LOAD_BATCH_SIZE):
+                lemmy.extend_sorted(batch)
+
+        with self._lock:
+            self._reddit = reddit
+            self._lemmy = lemmy
+        print(f"SyncedIndex: loaded {len(reddit)} comment mappings ({self.mode} mode).")
+
+    def add(self, pairs):
+        """
+        Adds (reddit_comment_id, lemmy_comment_id) pairs that are known to be mapped.
+        """
+        with self._lock:
+            for reddit_comment_id, lemmy_comment_id in pairs:
+                self._reddit.add(self._reddit_key(reddit_comment_id))
+                self._lemmy.add(lemmy_comment_id)
+
+    def record(self, pairs, cursor=None, jobs=()):
+        """
+        Writes new mappings (plus an optional (scope, direction, position) cursor and
+        outbox jobs) to the database in one transaction, then adds the mappings to memory.
+        """
+        pairs = list(pairs)
+        self.store.record_synced(pairs, cursor, jobs)
+        self.add(pairs)
+
+    def unsynced_reddit_ids(self, reddit_comment_ids):
+        """
+        Returns the set of the given Reddit comment IDs that have no mapping yet.
+        Only IDs missing from memory are confirmed with (one) database query.
+        """
+        with self._lock:
+            misses = {cid for cid in reddit_comment_ids if self._reddit_key(cid) not in self._reddit}
+        if not misses:
+            return misses
+        confirmed = self.store.get_synced_reddit_comment_ids(misses)
+        if confirmed:
+            with self._lock:
+                for cid in confirmed:
+                    self._reddit.add(self._reddit_key(cid))
+        return misses - confirmed
+
+    def unsynced_lemmy_ids(self, lemmy_comment_ids):
+        """
+        Returns the set of the given Lemmy comment IDs that have no mapping yet.
+        """
+        with self._lock:
+            misses = {cid for cid in lemmy_comment_ids if cid not in self._lemmy}
+        if not misses:
+            return misses
+        confirmed = self.store.get_synced_lemmy_comment_ids(misses)
+        if confirmed:
+            with self._lock:
+                for cid in confirmed:
+                    self._lemmy.add(cid)
+        return misses - confirmed
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_synced_index():
+    """
+    Returns the process-wide SyncedIndex, warm-loading it on first use.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SyncedIndex(get_store())
+            _index.load()
+        return _index
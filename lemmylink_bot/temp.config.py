@@ -13,4 +13,98 @@ LEMMY_PASSWORD = "YOUR_LEMMY_PASSWORD"
 # you can either figure out its numeric ID or pass a community name. We'll show both methods.
 LEMMY_COMMUNITY_ID = 1
 # OR you can store a community name if you prefer a name-based lookup in the future.
-# LEMMY_COMMUNITY_NAME = "your_lemmy_community_name"
\ No newline at end of file
+# LEMMY_COMMUNITY_NAME = "your_lemmy_community_name"
+
+# Optional Lemmy HTTP client tuning (defaults shown).
+# LEMMY_POOL_SIZE = 10          # keep-alive sockets kept open to the Lemmy instance
+# LEMMY_TIMEOUT = (5, 30)       # (connect, read) timeout in seconds
+# LEMMY_MAX_RETRIES = 3         # retries on connection errors, 429 and 5xx
+# LEMMY_BACKOFF_BASE = 0.5      # first retry waits up to this many seconds (jittered, doubles each retry)
+# LEMMY_BACKOFF_MAX = 30.0
+# LEMMY_TOKEN_CACHE = True      # keep the login JWT in mapping.db and reuse it across restarts
+
+# Optional sync tuning (defaults shown).
+# SYNC_INTERVAL = 60            # seconds between sync cycles
+# POLL_SCHEDULER = True        # poll each mapping on its own adaptive schedule (poll_scheduler.py)
+# POLL_MIN_INTERVAL = 60        # poll interval of threads with new comments (defaults to SYNC_INTERVAL)
+# POLL_MAX_INTERVAL = 21600     # quiet threads back off up to this many seconds
+# POLL_BACKOFF_FACTOR = 2.0     # interval growth per quiet poll
+# POLL_ARCHIVE_AFTER = 2592000  # stop polling threads quiet for this long (None = never)
+# SYNC_SNAPSHOT_TTL = 0         # skip re-fetching cold threads for this many seconds (default 300 without POLL_SCHEDULER)
+# SYNC_CONCURRENCY = 20         # mappings processed concurrently by async_sync.py
+# REDDIT_CONCURRENCY = 2        # concurrent Reddit API calls (keeps within the Reddit budget)
+# SYNCED_INDEX_MODE = "set"     # "array" stores synced comment IDs as sorted 64-bit arrays (8 bytes/ID)
+# CURSOR_GRACE_SECONDS = 300    # Reddit sync cursor re-checks comments this far back
+# SYNC_MAX_COMMENT_ATTEMPTS = 5 # a comment that keeps failing stops blocking its thread's cursor after this many attempts
+# REDDIT_MORE_COMMENTS_BUDGET = 4     # "load more comments" links expanded per thread per cycle
+# REDDIT_MORE_COMMENTS_REFRESH = 3600 # re-expand an already expanded link after this many seconds
+# LEMMY_COMMENT_PAGE_SIZE = 50  # comments per /comment/list page (Lemmy caps this at 50)
+# LEMMY_COMMENT_SORT = "New"
+# LEMMY_COMMENT_MAX_DEPTH = None
+# LEMMY_SYNC_MODE = "per_post"  # "community": fetch new comments for the whole community in one paginated listing
+# REDDIT_SYNC_MODE = "poll"     # "stream": run stream_sync.py for near-real-time Reddit-to-Lemmy sync
+# RECONCILE_INTERVAL = 3600     # seconds between full-tree reconciliation passes in stream mode
+# MAPPING_REFRESH_INTERVAL = 30 # seconds between reloads of new mappings in stream mode
+# STREAM_CHECKPOINTS = True     # resume the Reddit streams from their last checkpoint after a restart
+# STREAM_CATCHUP_LIMIT = 1000   # max items caught up per stream on startup (Reddit listings stop at 1000)
+# STREAM_CATCHUP_MAX_AGE = 86400  # don't catch up items older than this many seconds (None = no limit)
+# STREAM_CHECKPOINT_INTERVAL = 5  # seconds between checkpoint writes while items flow
+# SUPERVISOR_BACKOFF_BASE = 1.0 # runtime.py: first restart delay for a crashed task (doubles per crash)
+# SUPERVISOR_BACKOFF_MAX = 300.0
+# OUTBOX_ENABLED = True         # runtime.py: queue Lemmy posts/comments and Reddit replies in a durable outbox
+# OUTBOX_WORKERS = 4            # worker threads draining the outbox
+# OUTBOX_MAX_ATTEMPTS = 8       # attempts before a job is marked 'dead'
+# OUTBOX_BACKOFF_BASE = 5.0     # first retry delay in seconds (doubles per attempt, jittered)
+# OUTBOX_BACKOFF_MAX = 3600.0
+# OUTBOX_POLL_INTERVAL = 1.0
+# OUTBOX_LEASE_SECONDS = 300    # a claimed job is retried after this long if its worker died
+# BACKFILL_WORKERS = 4          # backfill.py: threads bridged in parallel
+# BACKFILL_BATCH_SIZE = 1000    # backfill.py: mapping rows per database transaction
+# BACKFILL_FLUSH_INTERVAL = 10  # backfill.py: max seconds between database flushes
+# BACKFILL_MORE_COMMENTS_BUDGET = 32  # backfill.py: 'load more' links expanded per thread (rest: sync loop)
+
+# Optional rate limiting (ratelimit.py). Per service and kind ("read", "write") or
+# "METHOD /path" endpoint: (tokens per second, burst, share of the server-reported
+# X-Ratelimit budget). Requests to an endpoint without its own bucket use their
+# kind's. Defaults shown.
+# RATE_LIMITS = {
+#     "reddit": {"read": (1.0, 5, 0.65), "write": (0.5, 3, 0.35)},
+#     "lemmy": {
+#         "read": (5.0, 10, 0.6),
+#         "write": (0.5, 3, 0.1),                      # writes without a bucket of their own
+#         "POST /api/v3/comment": (1.0, 5, 0.2),       # one bucket per "METHOD /path" endpoint
+#         "POST /api/v3/post": (0.2, 2, 0.05),
+#         "POST /api/v3/user/login": (0.1, 1, 0.05),
+#     },
+# }
+# HIGH_PRIORITY_RESERVE = 0.25  # fraction of each bucket reserved for trigger replies
+
+# Optional trigger matching (trigger_matcher.py). Matching ignores case and treats
+# any run of whitespace as a single space unless turned off below.
+# TRIGGER_PHRASES = ["LemmyLink!"]
+# SUBREDDIT_TRIGGERS = {"fediverse": ["bridge to lemmy"]}  # extra phrases for some subreddits only
+# TRIGGER_OPT_OUT = ["#nolemmylink"]  # never bridge a post/comment containing one of these
+# TRIGGER_IGNORE_CASE = True
+# TRIGGER_COLLAPSE_WHITESPACE = True
+
+# Optional multi-bridge routing (routing.py). Without ROUTES the bot bridges
+# SUBREDDIT_NAME to LEMMY_COMMUNITY_ID only.
+# ROUTES = [
+#     {"subreddit": "fediverse", "community_id": 12},
+#     {"subreddit": "selfhosted", "community_id": 7, "lemmy_base_url": "https://other.example",
+#      "lemmy_username": "bot", "lemmy_password": "..."},
+# ]
+# SHARD_COUNT = 1               # split routes across processes by a stable hash of the subreddit;
+# SHARD_INDEX = 0               # or set LEMMYLINK_SHARD="index/count" per process
+# ROUTE_QUEUE_SIZE = 1000       # stream items buffered per route worker
+
+# Optional metrics endpoint (metrics.py): Prometheus text format at /metrics, plus
+# a sampling profiler toggled with /profile/start and /profile/stop and read at /profile.
+# METRICS_ADDRESS = "127.0.0.1"
+# METRICS_PORT = 9464           # None disables it; LEMMYLINK_METRICS_PORT overrides per process
+# PROFILER_INTERVAL = 0.01      # seconds between profiler stack samples
+
+# Optional traffic capture for offline replay (capture.py, benchmarks/replay.py).
+# CAPTURE_FILE = "capture.jsonl.gz"  # or set LEMMYLINK_CAPTURE per process; None disables it
+# CAPTURE_REDDIT_BODIES = True  # False records only status and latency of Reddit API calls
+# CAPTURE_FLUSH_INTERVAL = 5    # seconds between flushes to disk
@@ -0,0 +1,50 @@
+# conftest.py
+#
+# Fixtures for the tests that drive the bot against the fake Lemmy server and
+# fake PRAW objects of benchmarks/. The `config` module is replaced before any
+# bot module is imported (they read it at import time), and every test gets a
+# fresh SQLite database in its tmp_path.
+
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_sync import install_config
+from benchmarks.fake_lemmy import FakeLemmy
+from benchmarks.fake_reddit import FakeReddit
+
+FAKE_LEMMY = FakeLemmy()
+install_config(FAKE_LEMMY.start(), types.SimpleNamespace(index_mode="set", lemmy_sync_mode="per_post"))
+
+def pytest_sessionfinish(session, exitstatus):
+    FAKE_LEMMY.stop()
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """
+    A MappingStore on a new database, installed as the process-wide store.
+    """
+    import bridged_posts
+    import mapping_store
+    import synced_index
+
+    store = mapping_store.MappingStore(str(tmp_path / "mapping.db"))
+    store.create_tables()
+    monkeypatch.setattr(mapping_store, "_store", store)
+    monkeypatch.setattr(mapping_store, "_store_pid", os.getpid())
+    monkeypatch.setattr(synced_index, "_index", None)
+    monkeypatch.setattr(bridged_posts, "_bridged_posts", None)
+    yield store
+    store.close()
+
+@pytest.fixture
+def lemmy():
+    return FAKE_LEMMY
+
+@pytest.fixture
+def reddit():
+    return FakeReddit()
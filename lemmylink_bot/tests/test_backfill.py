@@ -0,0 +1,67 @@
+# test_backfill.py
+#
+# The backfill against the bot's sync: a thread being backfilled is held from
+# the poll schedule until the flush that records its copied comments, so the
+# sync never copies them again -- also not after a crash before the flush.
+
+from backfill import Backfill
+from bidirectional_sync import sync_reddit_to_lemmy_comments
+from poll_scheduler import PollScheduler
+from routing import RoutingTable
+from sync_snapshot import SyncSnapshot
+
+def sync_once(reddit, client, store, mappings=None):
+    sync_reddit_to_lemmy_comments(reddit, client, mappings=mappings, snapshot=SyncSnapshot(reddit, store=store))
+
+def test_poll_before_flush_copies_nothing(store, lemmy, reddit):
+    submission = reddit.add_submission("bench", "Backfilled", comment_count=8)
+    routing = RoutingTable(shard_index=0, shard_count=1)
+    client = routing.lemmy_client(routing.default_route)
+    backfill = Backfill(reddit, routing, flush_interval=3600, batch_size=10 ** 6)
+
+    result = backfill.bridge_thread(submission)
+    backfill._finished(result)
+    post_id = result.post.lemmy_post_id
+    assert result.created and result.ok
+    assert len(lemmy.comments_by_post[post_id]) == 8
+
+    # The bot polls before the backfill flushed its comment mappings.
+    scheduler = PollScheduler(store)
+    assert scheduler.due() == []
+    assert store.get_all_mappings(include_held=False) == []
+    sync_once(reddit, client, store)
+    assert len(lemmy.comments_by_post[post_id]) == 8
+
+    backfill.flush(force=True)
+    due = scheduler.due()
+    assert [mapping[0] for mapping in due] == [result.mapping_id]
+    sync_once(reddit, client, store, due)
+    assert len(lemmy.comments_by_post[post_id]) == 8
+
+def test_resume_after_crash_recovers_copies(store, lemmy, reddit):
+    submission = reddit.add_submission("bench", "Interrupted", comment_count=6)
+    routing = RoutingTable(shard_index=0, shard_count=1)
+
+    # The first run copies the comments and dies before flushing.
+    crashed = Backfill(reddit, routing, flush_interval=3600, batch_size=10 ** 6)
+    result = crashed.bridge_thread(submission)
+    post_id = result.post.lemmy_post_id
+    assert store.is_mapping_held(result.mapping_id)
+
+    stats = Backfill(reddit, routing, flush_interval=0).run([submission])
+    assert stats["comments"] == 0 and stats["failed"] == 0
+    assert len(lemmy.comments_by_post[post_id]) == 6
+    assert not store.is_mapping_held(result.mapping_id)
+    comment_ids = [comment.id for comment in reddit.comments.values()]
+    assert store.get_synced_reddit_comment_ids(comment_ids) == set(comment_ids)
+
+def test_bridged_thread_is_left_to_the_sync(store, lemmy, reddit):
+    submission = reddit.add_submission("bench", "Bridged before", comment_count=4)
+    post_id = lemmy.add_post(1, "Bridged before")["id"]
+    mapping_id = store.insert_mapping(submission.id, None, post_id)
+    routing = RoutingTable(shard_index=0, shard_count=1)
+
+    stats = Backfill(reddit, routing, flush_interval=0).run([submission])
+    assert stats == {"threads": 1, "failed": 0, "posts": 0, "comments": 0}
+    assert lemmy.comments_by_post[post_id] == []
+    assert [mapping[0] for mapping in PollScheduler(store).due()] == [mapping_id]
@@ -0,0 +1,122 @@
+# test_migrations.py
+#
+# Round trip of the schema migrations on a database written before versioning
+# (TEXT Reddit IDs, duplicate mappings of one submission). Run from lemmylink_bot:
+#
+#   python -m pytest tests
+
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import LATEST_VERSION, current_version, migrate
+from reddit_ids import reddit_id_to_int
+
+# The tables as the bot created them before migrations existed.
+LEGACY_SCHEMA = (
+    """
+    CREATE TABLE mapping (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        reddit_submission_id TEXT NOT NULL,
+        reddit_trigger_comment_id TEXT,
+        lemmy_post_id INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE comment_mapping (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        reddit_comment_id TEXT NOT NULL,
+        lemmy_comment_id INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE sync_cursor (
+        scope TEXT NOT NULL,
+        direction TEXT NOT NULL,
+        last_created_utc REAL,
+        last_id TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (scope, direction)
+    )
+    """,
+    """
+    CREATE TABLE comment_branch (
+        scope TEXT NOT NULL,
+        branch_key TEXT NOT NULL,
+        parent_id TEXT NOT NULL,
+        children TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        expanded_at REAL,
+        PRIMARY KEY (scope, branch_key)
+    )
+    """,
+)
+
+def legacy_database(path):
+    conn = sqlite3.connect(path, isolation_level=None)
+    for statement in LEGACY_SCHEMA:
+        conn.execute(statement)
+    conn.executemany(
+        "INSERT INTO mapping (id, reddit_submission_id, reddit_trigger_comment_id, lemmy_post_id) VALUES (?, ?, ?, ?)",
+        [(1, "abc12", "def34", 100), (2, "abc12", "ghi56", 101), (3, "zz9", None, 102)],
+    )
+    conn.executemany(
+        "INSERT INTO comment_mapping (reddit_comment_id, lemmy_comment_id) VALUES (?, ?)",
+        [("c1", 1000), ("c1", 1001), ("c2", 1002)],
+    )
+    conn.executemany(
+        "INSERT INTO sync_cursor (scope, direction, last_created_utc, last_id) VALUES (?, ?, ?, ?)",
+        [("mapping:1", "reddit_to_lemmy", 1.0, "c2"), ("mapping:2", "reddit_to_lemmy", 2.0, "c1"),
+         ("backfill:old", "backfill", 12, "zz9")],
+    )
+    conn.executemany(
+        "INSERT INTO comment_branch (scope, branch_key, parent_id, children, count) VALUES (?, ?, ?, ?, ?)",
+        [("mapping:1", "t1_c1", "t1_c1", "c3", 1), ("mapping:2", "t1_c1", "t1_c1", "c4", 1)],
+    )
+    return conn
+
+def rows(conn, sql):
+    return conn.execute(sql).fetchall()
+
+def test_legacy_database_round_trip(tmp_path, capsys):
+    conn = legacy_database(str(tmp_path / "mapping.db"))
+
+    assert migrate(conn, LATEST_VERSION) == LATEST_VERSION
+    assert rows(conn, "SELECT id, reddit_submission_id, lemmy_post_id FROM mapping ORDER BY id") == [
+        (1, reddit_id_to_int("abc12"), 100), (3, reddit_id_to_int("zz9"), 102),
+    ]
+    assert rows(conn, "SELECT reddit_comment_id, lemmy_comment_id FROM comment_mapping ORDER BY id") == [
+        (reddit_id_to_int("c1"), 1000), (reddit_id_to_int("c2"), 1002),
+    ]
+    # The dropped duplicate's rows go with it; the kept mapping's stay.
+    assert rows(conn, "SELECT scope FROM sync_cursor") == [("mapping:1",)]
+    assert rows(conn, "SELECT job, threads_done, last_submission_id FROM backfill_checkpoint") == [
+        ("old", 12, reddit_id_to_int("zz9")),
+    ]
+    assert rows(conn, "SELECT scope FROM comment_branch") == [("mapping:1",)]
+    assert rows(conn, "SELECT mapping_id FROM poll_state ORDER BY mapping_id") == [(1,), (3,)]
+    output = capsys.readouterr().out
+    assert "dropping duplicate mapping 2 of submission abc12 (Lemmy post 101)" in output
+
+    # Downgrading to 1 restores the TEXT IDs and the backfill cursor row.
+    assert migrate(conn, 1) == 1
+    assert rows(conn, "SELECT last_created_utc, last_id FROM sync_cursor WHERE scope = 'backfill:old'") == [
+        (12, "zz9"),
+    ]
+    assert rows(conn, "SELECT reddit_submission_id FROM mapping ORDER BY id") == [("abc12",), ("zz9",)]
+
+    assert migrate(conn, 0) == 0
+    assert rows(conn, "SELECT name FROM sqlite_master WHERE type = 'table' AND name != 'sqlite_sequence'") == []
+
+    assert migrate(conn, LATEST_VERSION) == LATEST_VERSION
+    assert current_version(conn) == LATEST_VERSION
+    assert rows(conn, "SELECT COUNT(*) FROM mapping") == [(0,)]
+    conn.execute(
+        "INSERT INTO mapping (reddit_submission_id, reddit_trigger_comment_id, lemmy_post_id) VALUES (?, ?, ?)",
+        (reddit_id_to_int("abc12"), None, 100),
+    )
+    conn.close()
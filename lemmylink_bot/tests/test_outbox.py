@@ -0,0 +1,90 @@
+# test_outbox.py
+#
+# The outbox's delivery guarantees and the lost race for a submission's
+# mapping: a claimed job whose lease ran out is claimed again, a dead job is
+# revived by re-enqueueing it, and a Lemmy post created for a submission that
+# another process bridged first is deleted -- by the lemmy_post job and by the
+# inline BridgeManager path -- while the winner's mapping is polled again.
+
+import time
+
+from bridge_manager import BridgeManager
+from lemmy_client import LemmyClient
+from outbox import LEMMY_DELETE_POST, Outbox, lemmy_post_job, reddit_reply_job
+
+class RacingLemmyClient(LemmyClient):
+    """
+    A client whose post creation loses the race: another process maps the
+    submission (to its own, since archived, post) before this post is stored.
+    """
+
+    def __init__(self, store, lemmy, reddit_submission_id):
+        super().__init__()
+        self.store = store
+        self.winner = lemmy.add_post(1, "Bridged by another process")["id"]
+        self.reddit_submission_id = reddit_submission_id
+
+    def create_post(self, community_id, title, body):
+        response = super().create_post(community_id=community_id, title=title, body=body)
+        mapping_id = self.store.insert_mapping(self.reddit_submission_id, "rival", self.winner)
+        self.store.save_poll_states([(mapping_id, 0, None, time.time(), True)])
+        return response
+
+def jobs_of(store, kind):
+    return [job for job in store.claim_jobs(100, 60) if job[1] == kind]
+
+def test_expired_lease_is_claimed_again(store):
+    store.enqueue_job(*reddit_reply_job("t3_abc", "Hello"))
+    # The worker holding the job died; its lease has run out.
+    (job_id, _, _, _, attempts), = store.claim_jobs(10, -1)
+    assert attempts == 1
+    assert [(job[0], job[4]) for job in store.claim_jobs(10, 60)] == [(job_id, 2)]
+    # A live lease is not claimed twice.
+    assert store.claim_jobs(10, 60) == []
+
+def test_dead_job_is_revived_by_enqueue(store):
+    job = reddit_reply_job("t3_abc", "Hello")
+    assert store.enqueue_job(*job)
+    assert not store.enqueue_job(*job)
+    (job_id, _, _, _, _), = store.claim_jobs(10, 60)
+    store.fail_job(job_id, RuntimeError("gone"), None)
+    assert store.count_jobs("dead") == 1
+
+    assert store.enqueue_job(*job)
+    assert store.count_jobs("dead") == 0
+    assert [(job[0], job[4]) for job in store.claim_jobs(10, 60)] == [(job_id, 1)]
+
+def test_lost_lemmy_post_race_deletes_duplicate(store, lemmy, reddit):
+    submission = reddit.add_submission("bench", "Raced")
+    client = RacingLemmyClient(store, lemmy, submission.id)
+    outbox = Outbox(reddit, client, store)
+    outbox.enqueue(lemmy_post_job(
+        submission.id, submission.id, submission.fullname, 1, submission.title, "Body", "bench", None
+    ))
+    assert outbox.run_once() == 1
+    duplicate = max(lemmy.posts)
+    assert duplicate != client.winner
+
+    (mapping,) = store.get_mapping_by_reddit_submission(submission.id)
+    assert mapping[3] == client.winner
+    assert [state[0][0] for state in store.get_active_poll_states()] == [mapping[0]]
+
+    assert outbox.run_once(limit=10) == 2
+    assert lemmy.posts[duplicate].get("deleted") is True
+    assert not lemmy.posts[client.winner].get("deleted")
+    (reply,) = submission._top_level
+    assert reply.body.endswith(f"/post/{client.winner}\n\nStay tuned for future updates (e.g., comment syncing)!")
+    assert jobs_of(store, LEMMY_DELETE_POST) == []
+
+def test_lost_inline_race_deletes_duplicate(store, lemmy, reddit):
+    submission = reddit.add_submission("bench", "Raced inline")
+    client = RacingLemmyClient(store, lemmy, submission.id)
+    BridgeManager(client).handle_trigger(submission)
+    duplicate = max(lemmy.posts)
+
+    (mapping,) = store.get_mapping_by_reddit_submission(submission.id)
+    assert mapping[3] == client.winner
+    assert lemmy.posts[duplicate].get("deleted") is True
+    assert [state[0][0] for state in store.get_active_poll_states()] == [mapping[0]]
+    (reply,) = submission._top_level
+    assert f"/post/{client.winner}\n" in reply.body
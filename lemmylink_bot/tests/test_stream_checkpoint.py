@@ -0,0 +1,101 @@
+# test_stream_checkpoint.py
+#
+# Stream checkpoints behind a RouteDispatcher: the checkpoint follows the
+# low-water mark of the items the route workers have handled, so it keeps
+# advancing while items are always in flight, and one stream's queued items do
+# not hold back the other's checkpoint.
+
+import threading
+import time
+import types
+
+from routing import Route, RouteDispatcher, RoutingTable
+from stream_checkpoint import COMMENTS, SUBMISSIONS, StreamCheckpoint
+
+class Item:
+    def __init__(self, prefix, number):
+        self.id = f"x{number}"
+        self.fullname = f"{prefix}_{self.id}"
+        self.created_utc = 1000 + number
+        self.subreddit = types.SimpleNamespace(display_name="bench")
+
+def wait_for_cursor(checkpoint, store, expected, timeout=5):
+    deadline = time.monotonic() + timeout
+    while True:
+        checkpoint.flush(force=True)
+        cursor = store.get_cursor(checkpoint.scope, checkpoint.consumer)
+        if cursor == expected or time.monotonic() > deadline:
+            return cursor
+        time.sleep(0.01)
+
+def position(item):
+    return (item.created_utc, item.fullname)
+
+def test_checkpoint_advances_under_continuous_dispatch(store):
+    items = [Item("t1", number) for number in range(20)]
+    # Each comment is only finished once the next one has been dispatched, so
+    # the route always has an item in flight.
+    released = {item.fullname: threading.Event() for item in items}
+    handled = []
+
+    def forward(comment):
+        released[comment.fullname].wait(5)
+        handled.append(comment.id)
+
+    forwarder = types.SimpleNamespace(handle=forward, refresh_mappings=lambda force=False: None)
+    dispatcher = RouteDispatcher(RoutingTable([Route("bench", 1)]), {"bench": None}, forwarder)
+    checkpoint = StreamCheckpoint("stream:bench", COMMENTS, store, dispatcher.progress[COMMENTS])
+    stop = threading.Event()
+    worker = threading.Thread(target=dispatcher.run_worker, args=("bench", stop), daemon=True)
+    worker.start()
+    try:
+        for number, item in enumerate(items):
+            checkpoint.start(item)
+            dispatcher.handle(item)
+            checkpoint.advance(item)
+            if number:
+                released[items[number - 1].fullname].set()
+                assert wait_for_cursor(checkpoint, store, position(items[number - 1])) == position(items[number - 1])
+                assert items[number].id not in handled
+        released[items[-1].fullname].set()
+        assert wait_for_cursor(checkpoint, store, position(items[-1])) == position(items[-1])
+        assert handled == [item.id for item in items]
+    finally:
+        stop.set()
+        worker.join()
+
+def test_streams_checkpoint_independently(store):
+    stuck = threading.Event()
+    forwarder = types.SimpleNamespace(handle=lambda comment: stuck.wait(5), refresh_mappings=lambda force=False: None)
+    routing = RoutingTable([Route("bench", 1), Route("other", 2)])
+    bridge_managers = {"bench": None, "other": types.SimpleNamespace(handle_trigger=lambda submission: None)}
+    dispatcher = RouteDispatcher(routing, bridge_managers, forwarder)
+    comments = StreamCheckpoint("stream:bench", COMMENTS, store, dispatcher.progress[COMMENTS])
+    submissions = StreamCheckpoint("stream:bench", SUBMISSIONS, store, dispatcher.progress[SUBMISSIONS])
+    stop = threading.Event()
+    workers = [
+        threading.Thread(target=dispatcher.run_worker, args=(key, stop), daemon=True) for key in ("bench", "other")
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        comment = Item("t1", 1)
+        comments.start(comment)
+        dispatcher.handle(comment)
+        comments.advance(comment)
+
+        submission = Item("t3", 2)
+        submission.subreddit = types.SimpleNamespace(display_name="other")
+        submissions.start(submission)
+        dispatcher.handle_trigger(submission)
+        submissions.advance(submission)
+        assert wait_for_cursor(submissions, store, position(submission)) == position(submission)
+        assert wait_for_cursor(comments, store, position(comment), timeout=0.2) is None
+
+        stuck.set()
+        assert wait_for_cursor(comments, store, position(comment)) == position(comment)
+    finally:
+        stuck.set()
+        stop.set()
+        for worker in workers:
+            worker.join()
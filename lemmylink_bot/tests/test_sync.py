@@ -0,0 +1,27 @@
+# test_sync.py
+#
+# The polling sync against failures of a single thread: a submission that can
+# no longer be fetched is skipped, and the mappings after it are still synced.
+
+from bidirectional_sync import sync_lemmy_to_reddit_comments, sync_reddit_to_lemmy_comments
+from lemmy_client import LemmyClient
+from sync_snapshot import SyncSnapshot
+
+def test_unfetchable_submission_skips_only_its_thread(store, lemmy, reddit):
+    # FakeReddit raises for an ID it doesn't know, like PRAW for a deleted thread.
+    gone_post = lemmy.add_post(1, "Deleted on Reddit")["id"]
+    store.insert_mapping("gone1", None, gone_post)
+    submission = reddit.add_submission("bench", "Still there", comment_count=3)
+    post_id = lemmy.add_post(1, "Still there")["id"]
+    store.insert_mapping(submission.id, None, post_id)
+    lemmy.add_comment(post_id, "Hello from Lemmy")
+    client = LemmyClient()
+
+    snapshot = SyncSnapshot(reddit, store=store)
+    sync_reddit_to_lemmy_comments(reddit, client, snapshot=snapshot)
+    assert len(lemmy.comments_by_post[post_id]) == 1 + 3
+
+    sync_lemmy_to_reddit_comments(reddit, client, snapshot=snapshot)
+    assert [comment.body for comment in submission._top_level if comment.author.name == "lemmylink_bot"] == [
+        "Hello from Lemmy"
+    ]
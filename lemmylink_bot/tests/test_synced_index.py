@@ -0,0 +1,23 @@
+# test_synced_index.py
+#
+# Warm-loading the synced index in both modes from more rows than one load
+# batch, inserted out of ID order.
+
+import pytest
+
+import synced_index
+from synced_index import SyncedIndex
+
+@pytest.mark.parametrize("mode", ["set", "array"])
+def test_load_in_batches(store, monkeypatch, mode):
+    monkeypatch.setattr(synced_index, "LOAD_BATCH_SIZE", 7)
+    pairs = [(f"c{number:03}", 5000 - number) for number in range(50)][::-1]
+    store.insert_comment_mappings(pairs)
+
+    index = SyncedIndex(store, mode)
+    index.load()
+    assert len(index) == 50
+    assert index.unsynced_reddit_ids(["c000", "c049", "zzz1"]) == {"zzz1"}
+    assert index.unsynced_lemmy_ids([5000, 4951, 1]) == {1}
+    index.add([("zzz1", 1)])
+    assert index.unsynced_reddit_ids(["zzz1"]) == set()
@@ -0,0 +1,228 @@
+# trigger_matcher.py
+#
+# Trigger detection for the submission/comment streams. All configured phrases
+# (global triggers, per-subreddit triggers and opt-out keywords) are compiled
+# into one Aho-Corasick automaton, so each title/selftext/body is scanned once no
+# matter how many phrases are configured. Text and phrases are casefolded and
+# whitespace runs collapsed before matching; reported positions refer to the
+# original text.
+
+import re
+from collections import namedtuple
+
+import config
+
+TRIGGER_PHRASES = getattr(config, "TRIGGER_PHRASES", ["LemmyLink!"])
+# Extra triggers that only apply in some subreddits: {"subreddit_name": ["phrase", ...]}.
+SUBREDDIT_TRIGGERS = getattr(config, "SUBREDDIT_TRIGGERS", {})
+# A submission/comment containing any of these is never bridged, even if it has a trigger.
+TRIGGER_OPT_OUT = getattr(config, "TRIGGER_OPT_OUT", [])
+TRIGGER_IGNORE_CASE = getattr(config, "TRIGGER_IGNORE_CASE", True)
+TRIGGER_COLLAPSE_WHITESPACE = getattr(config, "TRIGGER_COLLAPSE_WHITESPACE", True)
+
+TRIGGER = "trigger"
+OPT_OUT = "opt_out"
+
+_WHITESPACE = re.compile(r"\s+")
+
+# phrase: the configured phrase that matched; field: "title", "selftext" or "body";
+# start/end: slice of the original field text covering the match.
+TriggerMatch = namedtuple("TriggerMatch", ["phrase", "field", "start", "end"])
+
+class TriggerMatcher:
+    """
+    Multi-pattern matcher for trigger phrases and opt-out keywords.
+    """
+
+    def __init__(self, triggers=TRIGGER_PHRASES, subreddit_triggers=SUBREDDIT_TRIGGERS, opt_out=TRIGGER_OPT_OUT,
+                 ignore_case=TRIGGER_IGNORE_CASE, collapse_whitespace=TRIGGER_COLLAPSE_WHITESPACE):
+        self.ignore_case = ignore_case
+        self.collapse_whitespace = collapse_whitespace
+
+        # Entries are (phrase, kind, subreddit or None); several entries may share a pattern.
+        self.entries = []
+        for phrase in triggers:
+            self.entries.append((phrase, TRIGGER, None))
+        for subreddit, phrases in subreddit_triggers.items():
+            for phrase in phrases:
+                self.entries.append((phrase, TRIGGER, subreddit.lower()))
+        for phrase in opt_out:
+            self.entries.append((phrase, OPT_OUT, None))
+        self.has_opt_out = any(kind == OPT_OUT for _, kind, _ in self.entries)
+        self._build()
+
+    def normalize(self, text):
+        if self.ignore_case:
+            text = text.casefold()
+        if self.collapse_whitespace:
+            text = _WHITESPACE.sub(" ", text)
+        return text
+
+    # --- Automaton -----------------------------------------------------------
+
+    def _build(self):
+        """
+        Builds the goto/fail/output tables. State 0 is the root; outputs are
+        (entry index, pattern length) pairs, merged along fail links so the scan
+        never has to follow them to report matches.
+        """
+        goto = [{}]
+        outputs = [[]]
+        for entry_id, (phrase, _, _) in enumerate(self.entries):
+            pattern = self.normalize(phrase).strip()
+            if not pattern:
+                continue
+            state = 0
+            for ch in pattern:
+                next_state = goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][ch] = next_state
+                    goto.append({})
+                    outputs.append([])
+                state = next_state
+            outputs[state].append((entry_id, len(pattern)))
+        # Built from the trie before outputs are merged along fail links.
+        prefilter = self._trie_regex(goto, outputs, 0)
+
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for state in queue:  # breadth-first; the list grows while we iterate
+            for ch, next_state in goto[state].items():
+                queue.append(next_state)
+                fallback = fail[state]
+                while fallback and ch not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[next_state] = goto[fallback].get(ch, 0)
+                outputs[next_state] = outputs[next_state] + outputs[fail[next_state]]
+
+        self._goto = goto
+        self._fail = fail
+        self._outputs = outputs
+        # While in the root state, jump straight to the next character that can
+        # start a pattern (the search runs in C instead of the Python loop).
+        first_chars = "".join(sorted(goto[0]))
+        self._root_skip = re.compile(f"[{re.escape(first_chars)}]") if first_chars else None
+        # Almost no firehose text contains a phrase at all; this C-level search
+        # over the casefolded (not yet collapsed) text rejects those before any
+        # other work is done.
+        self._prefilter = re.compile(prefilter) if prefilter else None
+
+    def _trie_regex(self, goto, outputs, state):
+        """
+        Returns a regex that matches wherever some pattern below `state` starts.
+        Nesting the alternation along the trie keeps `re` from retrying every
+        phrase at every position.
+        """
+        if outputs[state]:
+            return ""  # a phrase ends here; any longer one starts with it
+        branches = []
+        for ch, next_state in sorted(goto[state].items()):
+            piece = r"\s+" if ch == " " and self.collapse_whitespace else re.escape(ch)
+            branches.append(piece + self._trie_regex(goto, outputs, next_state))
+        if len(branches) == 1:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")"
+
+    def _scan(self, text):
+        """
+        Yields (entry index, start, end) for every pattern occurrence in the
+        normalized text, in order of their end position.
+        """
+        if self._root_skip is None:
+            return
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        skip = self._root_skip.search
+        state = 0
+        i = 0
+        length = len(text)
+        while i < length:
+            if state == 0:
+                found = skip(text, i)
+                if found is None:
+                    return
+                i = found.start()
+            ch = text[i]
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            i += 1
+            for entry_id, pattern_length in outputs[state]:
+                yield entry_id, i - pattern_length, i
+
+    def _original_offset(self, text, target):
+        """
+        Maps an index into normalize(text) back to an index into text.
+        """
+        position = 0
+        in_space = False
+        for i, ch in enumerate(text):
+            is_space = self.collapse_whitespace and ch.isspace()
+            # The rest of a whitespace run maps to the same normalized space.
+            if position >= target and not (is_space and in_space):
+                return i
+            if is_space:
+                if not in_space:
+                    position += 1
+            else:
+                position += len(ch.casefold()) if self.ignore_case else 1
+            in_space = is_space
+        return len(text)
+
+    # --- Matching ------------------------------------------------------------
+
+    def match(self, fields, subreddit=None):
+        """
+        Scans (field_name, text) pairs and returns the first trigger as a
+        TriggerMatch, or None if there is none or any field contains an opt-out
+        keyword. Subreddit-specific triggers only apply when `subreddit` matches.
+        """
+        subreddit = subreddit.lower() if subreddit else None
+        found = None
+        for field, text in fields:
+            if not text:
+                continue
+            folded = text.casefold() if self.ignore_case else text
+            if self._prefilter is None or self._prefilter.search(folded) is None:
+                continue
+            normalized = _WHITESPACE.sub(" ", folded) if self.collapse_whitespace else folded
+            for entry_id, start, end in self._scan(normalized):
+                phrase, kind, scope = self.entries[entry_id]
+                if scope is not None and scope != subreddit:
+                    continue
+                if kind == OPT_OUT:
+                    return None
+                if found is None:
+                    # ASCII casefolding keeps lengths and collapsing only shortens,
+                    # so equal-length ASCII text needs no offset mapping.
+                    if len(normalized) != len(text) or not text.isascii():
+                        start, end = self._original_offset(text, start), self._original_offset(text, end)
+                    found = TriggerMatch(phrase, field, start, end)
+                    if not self.has_opt_out:
+                        return found
+        return found
+
+    def match_text(self, text, subreddit=None):
+        return self.match((("text", text),), subreddit)
+
+    def match_submission(self, submission):
+        return self.match((("title", submission.title), ("selftext", submission.selftext)), _subreddit_name(submission))
+
+    def match_comment(self, comment):
+        return self.match((("body", comment.body),), _subreddit_name(comment))
+
+def _subreddit_name(item):
+    # Stream items carry their subreddit name, so this doesn't trigger a fetch.
+    subreddit = getattr(item, "subreddit", None)
+    return getattr(subreddit, "display_name", None)
+
+_matcher = None
+
+def get_trigger_matcher():
+    """
+    Returns the process-wide TriggerMatcher built from config.py.
+    """
+    global _matcher
+    if _matcher is None:
+        _matcher = TriggerMatcher()
+    return _matcher
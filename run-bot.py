@@ -1,19 +1,12 @@
-# Starts the bot and the bidirectional sync processes in separate threads
+# Starts the bot and the bidirectional sync in a single runtime process
 import subprocess
 import sys
-import time
 
-# Start both processes
-proc_main = subprocess.Popen([sys.executable, "LemmyLink/main.py"])
-proc_sync = subprocess.Popen([sys.executable, "LemmyLink/bidirectional_sync.py"])
+proc_runtime = subprocess.Popen([sys.executable, "runtime.py"], cwd="lemmylink_bot")
 
 try:
-    # Keep the main thread alive while both processes run.
-    while True:
-        time.sleep(1)
+    proc_runtime.wait()
 except KeyboardInterrupt:
-    print("Terminating both processes...")
-    proc_main.terminate()
-    proc_sync.terminate()
-    proc_main.wait()
-    proc_sync.wait()
+    print("Terminating the runtime process...")
+    proc_runtime.terminate()
+    proc_runtime.wait()